@@ -0,0 +1,417 @@
+"""
+Event-driven backtester
+
+Replays recorded Luno websocket messages (one JSON message per line, .gz
+accepted, the first one a full order book) through LunoOrderBook and feeds
+every resulting tick to AvellanedaStrategy.on_book. Orders go to a
+SimExchange which fills them against the trade tape, see sim_exchange.py.
+
+Deterministic and offline: time comes from the message timestamps, no
+websocket, Redis or REST calls are made.
+
+The book does not depend on the strategy, so the ticks and trades a
+recording produces can be computed once (TickStream) and replayed against
+many strategy configs, see sweep.py.
+
+python backtest/backtest.py -s XBTMYR -f data/XBTMYR.jsonl.gz
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+import time
+from typing import Iterable, Iterator, Tuple, Union
+
+import numpy as np
+from termcolor import cprint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# limit_order_book first: its config.py is a superset of marketmaking/config.py
+sys.path.extend([ROOT, os.path.join(ROOT, "limit_order_book"), os.path.join(ROOT, "marketmaking")])
+import config
+from orderbook import LunoOrderBook
+from decode import loads
+from avellaneda import AvellanedaStrategy
+from sim_exchange import SimExchange, SimExecutor
+from common.recorder import SegmentReader
+
+NO_AUTH = {"LUNO_KEY_ID": "", "LUNO_KEY_SECRET": ""}
+# LOB:: fields on_book reads, kept in a TickStream. ts is the replay clock (ms),
+# on_book drops ticks older than the last BOOK_STATUS:: by it
+TICK_FIELDS = ("ts", "mid_price", "best_bid", "best_ask", "vamp", "volatility", "alpha", "kappa", "buffer_ready")
+TAKER_SIDES = {"BUY": 1, "SELL": -1}
+
+
+class ReplayClock:
+    """Time of the message being replayed, in seconds"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class NullPublisher:
+    """Publisher stand-in, replayed books publish nowhere"""
+
+    def publish(self, channel: str, payload):
+        pass
+
+    def publish_latest(self, channel: str, payload):
+        pass
+
+    def start(self):
+        pass
+
+
+def read_messages(path: str, start_ts: int = None, end_ts: int = None) -> Iterable[str]:
+    """Raw websocket messages from a recorder directory (common/recorder.py),
+    or all of a .jsonl(.gz) file"""
+    if os.path.isdir(path):
+        yield from SegmentReader(path).messages(start_ts, end_ts)
+        return
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+class Backtester:
+    """
+    Args:
+        pair (str): e.g. XBTMYR
+        trading_config (dict): passed to AvellanedaStrategy
+        quote_balance (float): starting counter balance. Defaults to 10,000.
+        base_balance (float): starting base balance. Defaults to the value of
+            quote_balance at the first mid price (q_target = 0.5).
+        maker_fee (float): see SimExchange. Defaults to 0.
+        latency_ms (int): see SimExchange. Defaults to 0.
+        fill_model (str): see SimExchange. Defaults to "through".
+        sample_ms (int): equity / inventory sampling interval. Defaults to 1000.
+        fixed_point (bool): see LunoOrderBook. Defaults to False.
+    """
+
+    def __init__(self,
+                 pair: str,
+                 trading_config: dict = None,
+                 quote_balance: float = 10_000,
+                 base_balance: float = None,
+                 maker_fee: float = 0.0,
+                 latency_ms: int = 0,
+                 fill_model: str = "through",
+                 sample_ms: int = 1000,
+                 fixed_point: bool = False):
+        self.pair = pair.upper()
+        self.trading_config = trading_config
+        self.quote_balance = quote_balance
+        self.base_balance = base_balance
+        self.maker_fee = maker_fee
+        self.latency_ms = latency_ms
+        self.fill_model = fill_model
+        self.sample_ms = sample_ms
+        self.fixed_point = fixed_point
+        self.clock = ReplayClock()
+        self.book = None
+        self.exchange = None
+        self.strategy = None
+        self.samples = None
+        self.replay_stats = None
+        self.trading_rules = config.get_trading_rules(self.pair)
+
+    def _start(self, ts: int):
+        self.clock.now = ts / 1000
+        self.book = self._new_book()
+
+    def _new_book(self) -> LunoOrderBook:
+        book = LunoOrderBook(NO_AUTH, self.pair, fixed_point=self.fixed_point,
+                             publisher=NullPublisher(), clock=self.clock)
+        book.log_trades = False
+        return book
+
+    def book_params(self) -> dict:
+        """Book settings that shape the ticks, a TickStream built with other ones is stale"""
+        book = self.book or self._new_book()
+        return dict(
+            fixed_point=self.fixed_point,
+            trading_rules=self.trading_rules,
+            top_levels=book.top_levels,
+            imbalance_levels=list(book.analytics.imbalance_levels),
+            trade_buffer_ms=book.trade_buffer_duration*60*1000,
+            vol_method=book.vol_estimator.method,
+            vol_window=book.vol_buffer_size,
+            intensity_method=book.intensity_estimator.method,
+            intensity_refit_ms=book.intensity_estimator.refit_interval_ms,
+        )
+
+    def _start_strategy(self, mid_price: float):
+        base, quote = self.pair[:3], self.pair[3:]
+        base_balance = self.base_balance if self.base_balance is not None else self.quote_balance / mid_price
+        self.exchange = SimExchange(self.pair,
+                                    {base: base_balance, quote: self.quote_balance},
+                                    maker_fee=self.maker_fee,
+                                    latency_ms=self.latency_ms,
+                                    fill_model=self.fill_model,
+                                    clock=self.clock)
+        self.strategy = AvellanedaStrategy(auth_config=NO_AUTH,
+                                           pair=self.pair,
+                                           trading_rules=self.trading_rules,
+                                           sub_channels=[f"LOB::{self.pair}"],
+                                           trading_config=self.trading_config,
+                                           simulated=False,
+                                           client=self.exchange,
+                                           executor=SimExecutor(self.exchange),
+                                           clock=self.clock)
+        self._initial_equity = self._equity(mid_price)
+
+    def _equity(self, mid_price: float) -> float:
+        balances = self.exchange.balances
+        return balances[self.exchange.quote_asset] + balances[self.exchange.base_asset] * mid_price
+
+    def _deliver(self):
+        for msg in self.exchange.drain_events():
+            self.strategy.on_user_stream_update(msg)
+
+    def replay(self, messages: Iterable[Union[str, bytes, dict]]) -> Iterator[Tuple[int, dict, list]]:
+        """Rebuild the book from `messages`, yields (ts, tick, trades) per update.
+        trades: [(price, amount, taker_side), ...] of that update"""
+        book = None
+        clock = self.clock
+        stats = self.replay_stats = dict(messages=0, gaps=0, first_ts=None, last_ts=None)
+        synced = False
+
+        for raw in messages:
+            data = loads(raw) if isinstance(raw, (str, bytes)) else raw
+            if not data:
+                continue  # keep alive
+            stats["messages"] += 1
+            ts = int(data["timestamp"])
+            if book is None:
+                self._start(ts)
+                book = self.book
+                stats["first_ts"] = ts
+            clock.now = ts / 1000
+            stats["last_ts"] = ts
+
+            if "asks" in data:
+                # reconnect snapshot or a checkpoint, see LunoOrderBook.checkpoint()
+                if not synced or int(data["sequence"]) > book.sequence:
+                    book.load_snapshot(data)
+                    synced = True
+                continue
+            if not synced:
+                continue
+            sequence = int(data["sequence"])
+            if sequence <= book.sequence:
+                continue  # replayed message
+            if sequence != book.sequence + 1:
+                # the book is unknown until the next snapshot in the recording
+                stats["gaps"] += 1
+                synced = False
+                continue
+            book.sequence = sequence
+
+            # maker side has to be read before the fill removes the order
+            trades = []
+            for update in data["trade_updates"] or ():
+                maker = book.levels.get(update["maker_order_id"])
+                if maker is not None:
+                    base = float(update["base"])
+                    taker_side = "SELL" if maker.side == "BID" else "BUY"
+                    trades.append((float(update["counter"]) / base, base, taker_side))
+            try:
+                book.process_message(data)
+            except ValueError as e:
+                # finer than the fixed point quantum, like the live book: Decimal from the next snapshot
+                if not book.fixed_point:
+                    raise
+                book.use_decimal(str(e))
+                stats["gaps"] += 1
+                synced = False
+                continue
+            tick = book.build_tick(ts)
+            if tick is None:
+                continue  # a side is empty
+            yield ts, tick, trades
+
+    def run(self, messages: Iterable[Union[str, bytes, dict]]) -> dict:
+        """Replay `messages` and return the summary statistics"""
+        return self.run_ticks(self.replay(messages))
+
+    def run_stream(self, stream: "TickStream") -> dict:
+        """Run the strategy on precomputed ticks"""
+        self.replay_stats = dict(stream.meta)
+        return self.run_ticks(stream.ticks())
+
+    def run_ticks(self, ticks: Iterable[Tuple[int, dict, list]]) -> dict:
+        wall_start = time.perf_counter()
+        clock = self.clock
+        samples = {"ts": [], "mid_price": [], "base": [], "quote": [], "equity": []}
+        next_sample = 0
+        n_ticks = 0
+        mid = math.nan
+
+        for ts, tick, trades in ticks:
+            clock.now = ts / 1000
+            n_ticks += 1
+            mid = tick["mid_price"]
+            if self.strategy is None:
+                self._start_strategy(mid)
+            exchange = self.exchange
+            exchange.set_top(tick["best_bid"], tick["best_ask"])
+            for price, amount, taker_side in trades:
+                exchange.on_trade(ts, price, amount, taker_side)
+            self._deliver()
+            self.strategy.on_book(tick)
+            self._deliver()
+
+            if ts >= next_sample:
+                next_sample = ts + self.sample_ms
+                samples["ts"].append(ts)
+                samples["mid_price"].append(mid)
+                samples["base"].append(exchange.balances[exchange.base_asset])
+                samples["quote"].append(exchange.balances[exchange.quote_asset])
+                samples["equity"].append(self._equity(mid))
+
+        self.samples = {k: np.asarray(v, dtype=float) for k, v in samples.items()}
+        return self.summary(n_ticks, mid, time.perf_counter() - wall_start)
+
+    def summary(self, n_ticks: int, last_mid: float, wall: float) -> dict:
+        replay = self.replay_stats
+        first_ts, last_ts = replay["first_ts"], replay["last_ts"]
+        stats = dict(pair=self.pair, messages=replay["messages"], ticks=n_ticks, gaps=replay["gaps"],
+                     wall_time_s=wall,
+                     replayed_s=(last_ts - first_ts) / 1000 if first_ts is not None else 0.0)
+        stats["speedup"] = stats["replayed_s"] / wall if wall else math.nan
+        exchange = self.exchange
+        if exchange is None:
+            return stats
+        equity = self.samples["equity"]
+        final_equity = self._equity(last_mid)
+        drawdown = np.maximum.accumulate(equity) - equity if len(equity) else np.zeros(1)
+        volume, notional = exchange.volume, exchange.notional
+        stats.update(
+            pnl=final_equity - self._initial_equity,
+            pnl_pct=(final_equity / self._initial_equity - 1) * 100,
+            max_drawdown=float(drawdown.max()),
+            final_base=exchange.balances[exchange.base_asset],
+            final_quote=exchange.balances[exchange.quote_asset],
+            orders_placed=exchange.placed,
+            orders_cancelled=exchange.cancelled,
+            orders_rejected=exchange.rejected,
+            fills=exchange.fills,
+            buy_volume=volume["BID"],
+            sell_volume=volume["ASK"],
+            avg_buy_price=notional["BID"] / volume["BID"] if volume["BID"] else math.nan,
+            avg_sell_price=notional["ASK"] / volume["ASK"] if volume["ASK"] else math.nan,
+            fees_base=exchange.fees[exchange.base_asset],
+            fees_quote=exchange.fees[exchange.quote_asset],
+        )
+        return stats
+
+
+class TickStream:
+    """Ticks and trades of a recording as flat arrays
+
+    Saved as one .npy per array plus meta.json, load(mmap=True) maps them so
+    worker processes share one copy through the page cache.
+    """
+
+    ARRAYS = ("ts", "fields", "trade_offsets", "trade_price", "trade_amount", "trade_side")
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.arrays = arrays
+        self.meta = meta
+
+    def __len__(self) -> int:
+        return len(self.arrays["ts"])
+
+    @classmethod
+    def record(cls, pair: str, messages: Iterable, fixed_point: bool = False) -> "TickStream":
+        """Replay the book once and keep what the strategy sees"""
+        backtester = Backtester(pair, fixed_point=fixed_point)
+        ts, fields, offsets = [], [], [0]
+        trade_price, trade_amount, trade_side = [], [], []
+        for tick_ts, tick, trades in backtester.replay(messages):
+            ts.append(tick_ts)
+            fields.append([float(tick[f]) for f in TICK_FIELDS])
+            for price, amount, taker_side in trades:
+                trade_price.append(price)
+                trade_amount.append(amount)
+                trade_side.append(TAKER_SIDES[taker_side])
+            offsets.append(len(trade_price))
+        arrays = dict(
+            ts=np.asarray(ts, dtype=np.int64),
+            fields=np.asarray(fields, dtype=float).reshape(-1, len(TICK_FIELDS)),
+            trade_offsets=np.asarray(offsets, dtype=np.int64),
+            trade_price=np.asarray(trade_price, dtype=float),
+            trade_amount=np.asarray(trade_amount, dtype=float),
+            trade_side=np.asarray(trade_side, dtype=np.int8),
+        )
+        meta = dict(backtester.replay_stats, pair=backtester.pair, fields=list(TICK_FIELDS),
+                    book=backtester.book_params())
+        return cls(arrays, meta)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), self.arrays[name])
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "TickStream":
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if tuple(meta["fields"]) != TICK_FIELDS:
+            raise ValueError(f"{path} was recorded with fields {meta['fields']}, expected {TICK_FIELDS}")
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in cls.ARRAYS}
+        return cls(arrays, meta)
+
+    def ticks(self) -> Iterator[Tuple[int, dict, list]]:
+        a = self.arrays
+        sides = {v: k for k, v in TAKER_SIDES.items()}
+        offsets = a["trade_offsets"].tolist()
+        trade_price = a["trade_price"].tolist()
+        trade_amount = a["trade_amount"].tolist()
+        trade_side = a["trade_side"].tolist()
+        for i, (ts, row) in enumerate(zip(a["ts"].tolist(), a["fields"].tolist())):
+            tick = dict(zip(TICK_FIELDS, row))
+            tick["ts"] = ts
+            tick["buffer_ready"] = bool(tick["buffer_ready"])
+            start, end = offsets[i], offsets[i + 1]
+            trades = [(trade_price[j], trade_amount[j], sides[trade_side[j]]) for j in range(start, end)]
+            yield ts, tick, trades
+
+
+if __name__ == "__main__":
+    # python backtest/backtest.py -s XBTMYR -f data/XBTMYR.jsonl.gz
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--symbol", type=str, required=True, help="Symbol")
+    parser.add_argument("-f", "--file", type=str, required=True, help="Recorder directory, .jsonl or .jsonl.gz")
+    parser.add_argument("--quote-balance", type=float, default=10_000)
+    parser.add_argument("--maker-fee", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--fill-model", type=str, default="through", choices=["through", "touch"])
+    parser.add_argument("--fixed-point", action="store_true", help="Store prices/volumes as scaled integers")
+    parser.add_argument("-o", "--output", type=str, help="Write the summary as JSON")
+    args = parser.parse_args()
+
+    backtester = Backtester(args.symbol,
+                            quote_balance=args.quote_balance,
+                            maker_fee=args.maker_fee,
+                            latency_ms=args.latency_ms,
+                            fill_model=args.fill_model,
+                            fixed_point=args.fixed_point)
+    stats = backtester.run(read_messages(args.file))
+    for k, v in stats.items():
+        cprint(f"{k:>18}: {v}", "green")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(stats, f, indent=2)
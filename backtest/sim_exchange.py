@@ -0,0 +1,267 @@
+"""
+Simulated exchange for backtests
+
+Stands in for Luno behind the strategy: the REST client (get_balances), the
+order executor (place / cancel) and the user stream (ORDER_STATUS / FILL /
+BALANCE messages, encoded like the order gateway publishes them).
+
+Fill model: resting quotes are matched against the recorded trade tape.
+- an ASK fills when a taker buys above its price, a BID when a taker sells
+  below it ("through"), or already at its price with fill_model="touch"
+- the fill size is capped by the trade size, shared by our orders best price first
+- orders can only fill latency_ms after they were placed
+- post-only orders that would cross the touch are cancelled, like on Luno
+- orders above the available balance are refused (ErrInsufficientBalance)
+- maker_fee is charged on the asset received (base for buys, counter for sells)
+"""
+
+import itertools
+import os
+import sys
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List
+
+from luno_python.error import APIError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import codec
+
+FILL_MODELS = ("through", "touch")
+
+
+class SimOrder:
+    __slots__ = ("order_id", "client_order_id", "side", "price", "volume", "filled", "active_ts")
+
+    def __init__(self, order_id: str, client_order_id: str, side: str, price: float, volume: float, active_ts: int):
+        self.order_id = order_id
+        self.client_order_id = client_order_id
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.filled = 0.0
+        self.active_ts = active_ts
+
+
+class SimExchange:
+    """
+    Args:
+        pair (str): e.g. XBTMYR
+        balances (dict): starting balance per asset
+        maker_fee (float): fee rate on fills. Defaults to 0.
+        latency_ms (int): delay before a placed order can fill. Defaults to 0.
+        fill_model (str): "through" or "touch". Defaults to "through".
+        clock (Callable): time in seconds, the replay clock in a backtest
+    """
+
+    def __init__(self,
+                 pair: str,
+                 balances: Dict[str, float],
+                 maker_fee: float = 0.0,
+                 latency_ms: int = 0,
+                 fill_model: str = "through",
+                 clock: Callable[[], float] = time.time):
+        if fill_model not in FILL_MODELS:
+            raise ValueError(f"Unknown fill model {fill_model}, use any of {FILL_MODELS}")
+        self.pair = pair
+        self.base_asset, self.quote_asset = pair[:3], pair[3:]
+        self.balances = {self.base_asset: 0.0, self.quote_asset: 0.0, **balances}
+        self.reserved = {asset: 0.0 for asset in self.balances}
+        self.account_ids = {asset: str(i + 1) for i, asset in enumerate(self.balances)}
+        self._row_index = {asset: 0 for asset in self.balances}
+        self.maker_fee = maker_fee
+        self.latency_ms = latency_ms
+        self.touch = fill_model == "touch"
+        self.clock = clock
+        self.best_bid = None
+        self.best_ask = None
+        self._orders: Dict[str, SimOrder] = {}
+        self._ids = itertools.count(1)
+        self.events = deque()  # ORDER_UPDATES messages for the strategy
+        # stats
+        self.placed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.fills = 0
+        self.volume = {"BID": 0.0, "ASK": 0.0}
+        self.notional = {"BID": 0.0, "ASK": 0.0}
+        self.fees = {asset: 0.0 for asset in self.balances}
+
+    def _now_ms(self) -> int:
+        return int(self.clock()*1000)
+
+    # REST client, same shape as luno_python.client.Client
+    def get_balances(self, assets: List[str] = None) -> dict:
+        return {'balance': [
+            dict(account_id=self.account_ids[asset],
+                 asset=asset,
+                 balance=str(balance),
+                 reserved=str(self.reserved[asset]),
+                 unconfirmed="0")
+            for asset, balance in self.balances.items()
+            if not assets or asset in assets
+        ]}
+
+    @property
+    def open_orders(self) -> List[SimOrder]:
+        return list(self._orders.values())
+
+    def set_top(self, best_bid: float, best_ask: float):
+        self.best_bid = best_bid
+        self.best_ask = best_ask
+
+    def place(self, side: str, price: float, volume: float, client_order_id: str = "", post_only: bool = True) -> str:
+        order_id = f"SIM{next(self._ids)}"
+        order = SimOrder(order_id, client_order_id or "", side, float(price), float(volume),
+                         self._now_ms() + self.latency_ms)
+        if side == "BID":
+            needed, asset = order.price * order.volume, self.quote_asset
+        else:
+            needed, asset = order.volume, self.base_asset
+        if needed > self.balances[asset] - self.reserved[asset] + 1e-12:
+            self.rejected += 1
+            raise APIError("ErrInsufficientBalance", f"Insufficient {asset} balance")
+        crosses = ((side == "BID" and self.best_ask is not None and order.price >= self.best_ask)
+                   or (side == "ASK" and self.best_bid is not None and order.price <= self.best_bid))
+        if post_only and crosses:
+            self.rejected += 1
+            self._status(order, "COMPLETE")
+            return order_id
+        self.placed += 1  # rests in the book
+        self._orders[order_id] = order
+        self._reserve(order, order.volume)
+        self._status(order, "PENDING")
+        return order_id
+
+    def cancel(self, order_id: str) -> dict:
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return dict(success=False)
+        self.cancelled += 1
+        self._reserve(order, -(order.volume - order.filled))
+        self._status(order, "COMPLETE")
+        return dict(success=True)
+
+    def on_trade(self, ts: int, price: float, amount: float, taker_side: str):
+        """Match our resting orders against a trade, taker_side "BUY" or "SELL" """
+        if not self._orders:
+            return
+        side = "ASK" if taker_side == "BUY" else "BID"
+        if side == "ASK":
+            candidates = [o for o in self._orders.values() if o.side == "ASK" and
+                          (price > o.price or (self.touch and price == o.price))]
+            candidates.sort(key=lambda o: o.price)
+        else:
+            candidates = [o for o in self._orders.values() if o.side == "BID" and
+                          (price < o.price or (self.touch and price == o.price))]
+            candidates.sort(key=lambda o: -o.price)
+        for order in candidates:
+            if amount <= 0:
+                break
+            if order.active_ts > ts:
+                continue
+            size = min(order.volume - order.filled, amount)
+            amount -= size
+            self._fill(order, size)
+
+    def _fill(self, order: SimOrder, size: float):
+        base, quote = self.base_asset, self.quote_asset
+        notional = size * order.price
+        order.filled += size
+        self.fills += 1
+        self.volume[order.side] += size
+        self.notional[order.side] += notional
+        if order.side == "BID":
+            fee = size * self.maker_fee
+            self.reserved[quote] -= notional
+            self.balances[quote] -= notional
+            self.balances[base] += size - fee
+            self.fees[base] += fee
+        else:
+            fee = notional * self.maker_fee
+            self.reserved[base] -= size
+            self.balances[base] -= size
+            self.balances[quote] += notional - fee
+            self.fees[quote] += fee
+        self._emit("FILL", dict(
+            order_id=order.client_order_id,
+            exchange_order_id=order.order_id,
+            full_symbol=f"{self.pair} LUNO",
+            symbol=self.pair,
+            exchange="LUNO",
+            fill_price=order.price,
+            fill_size=order.filled,
+            fill_time=self.clock(),
+            commission=fee,
+        ))
+        self._balance(base)
+        self._balance(quote)
+        if order.filled >= order.volume - 1e-12:
+            del self._orders[order.order_id]
+            self._status(order, "COMPLETE")
+
+    def _reserve(self, order: SimOrder, volume: float):
+        if order.side == "BID":
+            self.reserved[self.quote_asset] += volume * order.price
+        else:
+            self.reserved[self.base_asset] += volume
+
+    def _status(self, order: SimOrder, status: str):
+        self._emit("ORDER_STATUS", dict(
+            order_id=order.client_order_id,
+            exchange_order_id=order.order_id,
+            full_symbol=f"{self.pair} LUNO",
+            symbol=self.pair,
+            exchange="LUNO",
+            order_status=status,
+        ))
+
+    def _balance(self, asset: str):
+        self._row_index[asset] += 1
+        balance = self.balances[asset]
+        self._emit("BALANCE", dict(
+            account_id=self.account_ids[asset],
+            exchange="LUNO",
+            row_index=self._row_index[asset],
+            balance=balance,
+            balance_delta=0.0,
+            available=balance - self.reserved[asset],
+            available_delta=0.0,
+            ts=self._now_ms(),
+        ))
+
+    def _emit(self, msg_type: str, msg: dict):
+        msg["msg_type"] = msg_type
+        self.events.append(dict(channel="ORDER_UPDATES", data=codec.encode(msg_type, msg)))
+
+    def drain_events(self) -> Iterable[dict]:
+        events = self.events
+        while events:
+            yield events.popleft()
+
+
+class SimExecutor:
+    """OrderExecutor interface on a SimExchange. The coroutines never suspend,
+    so the strategy can drive them without an event loop."""
+
+    def __init__(self, exchange: SimExchange):
+        self.client = exchange
+        self.pair = exchange.pair
+        self.failures = 0
+
+    async def place(self, orders) -> list:
+        results = []
+        for o in orders:
+            try:
+                results.append(self.client.place(o.side, o.price, o.volume, o.client_order_id, o.post_only))
+            except APIError as e:
+                # same as OrderExecutor: the exception is the result of that order
+                self.failures += 1
+                results.append(e)
+        return results
+
+    async def cancel(self, order_ids) -> list:
+        return [self.client.cancel(oid) for oid in order_ids]
+
+    async def cancel_replace(self, order_ids, orders, concurrent: bool = True) -> tuple:
+        return await self.cancel(order_ids), await self.place(orders)
@@ -0,0 +1,219 @@
+"""
+Parameter sweep
+
+Evaluates many AvellanedaStrategy configs (trading_config, see
+avellaneda.USER_INPUTS) on the same recording with a process pool.
+
+- the recording is replayed through the book once and kept as a TickStream
+  next to it (<file>.ticks/), workers memory-map it instead of re-parsing.
+  It is rebuilt when the recording, the tick fields or the book settings
+  (fixed point, quanta, estimator windows) changed since
+- grid: every combination of the given values, random: n draws from ranges
+- results (one row per config: params + backtest summary) go to a columnar
+  .npz, or .parquet when pandas has a parquet engine
+
+python backtest/sweep.py -s XBTMYR -f data/XBTMYR.jsonl.gz --grid gamma=0.1,0.5,1 eta=-0.005,0 -w 8
+python backtest/sweep.py -s XBTMYR -f data/XBTMYR.jsonl.gz --random 200 --space gamma=0.01:2 min_spread=0:50
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from termcolor import cprint
+
+from backtest import TICK_FIELDS, Backtester, TickStream, read_messages
+from avellaneda import USER_INPUTS
+
+_stream = None  # per worker
+_backtest_kwargs = None
+
+
+def grid(space: Dict[str, list]) -> List[dict]:
+    """Every combination of the values in `space`"""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_search(space: Dict[str, tuple], n: int, seed: int = 0) -> List[dict]:
+    """n configs, (low, high) ranges are drawn uniformly, lists are sampled"""
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(n):
+        config = {}
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                config[key] = rng.randint(low, high) if isinstance(low, int) and isinstance(high, int) \
+                    else rng.uniform(low, high)
+            else:
+                config[key] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+
+def source_signature(path: str) -> dict:
+    """Size and last modification of a recording (file or recorder directory)"""
+    if os.path.isdir(path):
+        stats = [os.stat(os.path.join(path, name)) for name in sorted(os.listdir(path))]
+    else:
+        stats = [os.stat(path)]
+    return dict(path=os.path.abspath(path),
+                size=sum(st.st_size for st in stats),
+                mtime_ns=max((st.st_mtime_ns for st in stats), default=0))
+
+
+def _stale(cache: str, expected: dict) -> str:
+    """Why the TickStream in `cache` can't be reused, "" when it can"""
+    try:
+        with open(os.path.join(cache, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return "missing"
+    for key, value in expected.items():
+        if meta.get(key) != value:
+            return f"{key} changed"
+    return ""
+
+
+def prepare_stream(pair: str, path: str, cache: str = None, fixed_point: bool = False) -> str:
+    """Replay the recording once, returns the TickStream directory"""
+    cache = cache or f"{path.rstrip(os.sep)}.ticks"
+    expected = dict(
+        pair=pair.upper(),
+        fields=list(TICK_FIELDS),
+        book=Backtester(pair, fixed_point=fixed_point).book_params(),
+        source=source_signature(path),
+    )
+    reason = _stale(cache, expected)
+    if reason:
+        if reason != "missing":
+            cprint(f"{cache} is stale ({reason}), rebuilding", "yellow")
+        start = time.perf_counter()
+        stream = TickStream.record(pair, read_messages(path), fixed_point=fixed_point)
+        stream.meta["source"] = expected["source"]
+        stream.save(cache)
+        cprint(f"{len(stream)} ticks precomputed in {time.perf_counter() - start:.1f}s -> {cache}", "blue")
+    return cache
+
+
+def _init_worker(stream_path: str, backtest_kwargs: dict):
+    global _stream, _backtest_kwargs
+    _stream = TickStream.load(stream_path, mmap=True)
+    _backtest_kwargs = backtest_kwargs
+
+
+def _evaluate(config: dict) -> dict:
+    backtester = Backtester(_stream.meta["pair"], trading_config=config, **_backtest_kwargs)
+    try:
+        stats = backtester.run_stream(_stream)
+        stats["error"] = ""
+    except Exception as e:
+        stats = dict(error=repr(e))
+    return dict(config, **stats)
+
+
+def run_sweep(stream_path: str,
+              configs: List[dict],
+              workers: int = None,
+              backtest_kwargs: dict = None) -> List[dict]:
+    """Evaluate `configs` on a TickStream in a process pool, results in config order"""
+    for config in configs:
+        unknown = set(config) - set(USER_INPUTS)
+        if unknown:
+            raise ValueError(f"Unknown trading config {unknown}, use any of {USER_INPUTS}")
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(configs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(stream_path, backtest_kwargs or {})) as pool:
+        return list(pool.map(_evaluate, configs, chunksize=chunksize))
+
+
+def to_columns(rows: List[dict]) -> Dict[str, np.ndarray]:
+    keys = list(dict.fromkeys(k for row in rows for k in row))
+    columns = {}
+    for key in keys:
+        values = [row.get(key) for row in rows]
+        if all(isinstance(v, (int, float, bool, np.number)) for v in values):
+            columns[key] = np.asarray(values, dtype=float)
+        else:
+            columns[key] = np.asarray(["" if v is None else str(v) for v in values])
+    return columns
+
+
+def save_results(rows: List[dict], path: str):
+    """Columnar output: .parquet through pandas, anything else as .npz"""
+    columns = to_columns(rows)
+    if path.endswith(".parquet"):
+        import pandas as pd
+        pd.DataFrame(columns).to_parquet(path, index=False)
+    else:
+        np.savez(path, **columns)
+
+
+def _parse_value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_space(items: List[str], ranges: bool = False) -> dict:
+    """gamma=0.1,0.5,1 -> {"gamma": [0.1, 0.5, 1]}, with ranges gamma=0.1:1 -> {"gamma": (0.1, 1)}"""
+    space = {}
+    for item in items:
+        key, _, values = item.partition("=")
+        if ranges and ":" in values:
+            low, high = values.split(":")
+            space[key] = (_parse_value(low), _parse_value(high))
+        else:
+            space[key] = [_parse_value(v) for v in values.split(",")]
+    return space
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--symbol", type=str, required=True, help="Symbol")
+    parser.add_argument("-f", "--file", type=str, required=True, help="Recorder directory, .jsonl or .jsonl.gz")
+    parser.add_argument("--grid", type=str, nargs="+", help="name=v1,v2,... per parameter")
+    parser.add_argument("--random", type=int, help="Number of random configs drawn from --space")
+    parser.add_argument("--space", type=str, nargs="+", help="name=low:high or name=v1,v2,...")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache", type=str, help="TickStream directory, defaults to <file>.ticks")
+    parser.add_argument("--quote-balance", type=float, default=10_000)
+    parser.add_argument("--maker-fee", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--fill-model", type=str, default="through", choices=["through", "touch"])
+    parser.add_argument("--fixed-point", action="store_true", help="Store prices/volumes as scaled integers")
+    parser.add_argument("-o", "--output", type=str, default="sweep_results.npz")
+    args = parser.parse_args()
+
+    if args.random:
+        configs = random_search(parse_space(args.space or [], ranges=True), args.random, seed=args.seed)
+    else:
+        configs = grid(parse_space(args.grid or []))
+
+    stream_path = prepare_stream(args.symbol.upper(), args.file, args.cache, fixed_point=args.fixed_point)
+    start = time.perf_counter()
+    rows = run_sweep(stream_path, configs, workers=args.workers, backtest_kwargs=dict(
+        quote_balance=args.quote_balance,
+        maker_fee=args.maker_fee,
+        latency_ms=args.latency_ms,
+        fill_model=args.fill_model,
+    ))
+    elapsed = time.perf_counter() - start
+    save_results(rows, args.output)
+    cprint(f"{len(rows)} configs in {elapsed:.1f}s ({len(rows) / elapsed * 3600:.0f}/h) -> {args.output}", "green")
+    best = max((r for r in rows if not r.get("error")), key=lambda r: r.get("pnl", -np.inf), default=None)
+    if best is not None:
+        cprint(f"best pnl {best['pnl']:.2f}: { {k: best[k] for k in configs[0]} }", "green")
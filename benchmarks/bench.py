@@ -0,0 +1,297 @@
+"""
+Benchmark suite
+
+Times the orderbook and strategy hot paths on synthetic Luno streams
+(stream_generator.py), in process: no websocket, Redis or REST.
+
+Per book depth (orders per side):
+    peek_sequence       sequence number of one raw update (what a duplicate / gap costs)
+    parse               decode.loads of one update (orjson when installed)
+    process_message     apply one update to the book
+    consolidate         aggregate one side into price levels
+    read_top            top levels of one side (what build_tick uses)
+    calc_vamp / calc_order_imbalance / calc_analytics
+    build_tick          everything one LOB:: tick costs
+Per trade buffer size (trades in the window):
+    trade_append        append + expire one trade
+    trading_intensity   estimate() when nothing changed (the common case)
+    intensity_refit     forced alpha / kappa refit
+    on_tick             AvellanedaStrategy.on_tick, decode to requote on a simulated exchange
+
+Every case runs `repeat` times, results are per operation in ns (best and
+median), written as JSON with the environment so runs can be compared:
+
+python benchmarks/bench.py
+python benchmarks/bench.py --depth 100 1000 10000 --trades 1000 100000 -o base.json
+python benchmarks/bench.py -o new.json --compare base.json --threshold 0.2
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, List
+
+import numpy as np
+from termcolor import cprint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# backtest first for its NullPublisher / SimExchange, limit_order_book before marketmaking for config
+sys.path.extend([os.path.join(ROOT, "backtest"), ROOT,
+                 os.path.join(ROOT, "limit_order_book"), os.path.join(ROOT, "marketmaking")])
+import config
+from orderbook import LunoOrderBook
+from decode import JSON_BACKEND, loads, peek_sequence
+from avellaneda import AvellanedaStrategy
+from backtest import NO_AUTH, NullPublisher, ReplayClock
+from sim_exchange import SimExchange, SimExecutor
+from stream_generator import LunoStreamGenerator
+from common import codec
+
+PAIR = "XBTMYR"
+
+
+def measure(name: str, params: dict, run: Callable, ops: int, setup: Callable = None, repeat: int = 5) -> dict:
+    """Time run(state) `repeat` times, state = setup() is rebuilt before each run"""
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter_ns()
+        run(state)
+        times.append((time.perf_counter_ns() - start) / ops)
+    times.sort()
+    median = times[len(times) // 2]
+    return dict(name=name, params=params, ops=ops, repeat=repeat,
+                best_ns=times[0], median_ns=median, ops_per_s=1e9 / median if median else None)
+
+
+def make_book(fixed_point: bool = False) -> LunoOrderBook:
+    clock = ReplayClock()
+    book = LunoOrderBook(NO_AUTH, PAIR, fixed_point=fixed_point, publisher=NullPublisher(), clock=clock)
+    book.log_trades = False
+    return book
+
+
+def book_cases(depth: int, n: int, repeat: int, fixed_point: bool) -> List[dict]:
+    generator = LunoStreamGenerator(depth=depth, seed=depth)
+    snapshot = generator.snapshot()
+    raw = [json.dumps(msg) for msg in generator.updates(n)]
+    updates = [json.loads(msg) for msg in raw]
+    params = dict(depth=depth, fixed_point=fixed_point)
+
+    def fresh_book():
+        book = make_book(fixed_point)
+        book.clock.now = snapshot["timestamp"] / 1000
+        book.load_snapshot(snapshot)
+        book.build_tick(snapshot["timestamp"])  # handle_trade reads the touch
+        return book
+
+    def process(book):
+        for data in updates:
+            book.process_message(data)
+
+    def peek(_):
+        for msg in raw:
+            peek_sequence(msg)
+
+    def parse(_):
+        for msg in raw:
+            loads(msg)
+
+    results = [
+        measure("peek_sequence", params, peek, n, repeat=repeat),
+        measure("parse", params, parse, n, repeat=repeat),
+        measure("process_message", params, process, n, setup=fresh_book, repeat=repeat),
+    ]
+
+    book = fresh_book()
+    process(book)
+    book.build_tick(updates[-1]["timestamp"])
+    loops = max(10, 200_000 // depth)
+
+    def consolidate(_):
+        for _ in range(loops):
+            book.consolidate(book.levels.orders("BID"), reverse=True)
+
+    def read_top(_):
+        for _ in range(loops * 10):
+            book.read_top(book.levels.bids)
+
+    def calc_vamp(_):
+        for _ in range(loops * 10):
+            book.calc_vamp()
+
+    def calc_order_imbalance(_):
+        for _ in range(loops * 10):
+            book.calc_order_imbalance()
+
+    def calc_analytics(_):
+        for _ in range(loops * 10):
+            book.calc_analytics()
+
+    def build_tick(_):
+        ts = updates[-1]["timestamp"]
+        for i in range(loops * 10):
+            book.build_tick(ts + i)
+
+    results += [
+        measure("consolidate", params, consolidate, loops, repeat=repeat),
+        measure("read_top", params, read_top, loops * 10, repeat=repeat),
+        measure("calc_vamp", params, calc_vamp, loops * 10, repeat=repeat),
+        measure("calc_order_imbalance", params, calc_order_imbalance, loops * 10, repeat=repeat),
+        measure("calc_analytics", params, calc_analytics, loops * 10, repeat=repeat),
+        measure("build_tick", params, build_tick, loops * 10, repeat=repeat),
+    ]
+    return results
+
+
+def fill_trades(book: LunoOrderBook, n_trades: int, now: int, rng: np.random.Generator):
+    """n_trades spread over the trade window, distances in ticks from mid"""
+    window = book.trade_buffer_duration*60*1000
+    ts = np.sort(rng.integers(now - window + 1, now, n_trades))
+    distance = rng.exponential(20, n_trades).round()
+    amount = rng.exponential(0.01, n_trades)
+    for i in range(n_trades):
+        buffer = book.ask_trades if i % 2 else book.bid_trades
+        buffer.append(int(ts[i]), 300000 + distance[i], amount[i], 300000, distance[i])
+
+
+def trade_cases(n_trades: int, n: int, repeat: int) -> List[dict]:
+    params = dict(trades=n_trades)
+    rng = np.random.default_rng(n_trades)
+    now = 1_700_000_000_000
+    book = make_book()
+    fill_trades(book, n_trades, now, rng)
+    book.intensity_estimator.estimate(now, force=True)
+    loops = 1000
+
+    def append(_):
+        for i in range(loops):
+            ts = now + i
+            book.ask_trades.append(ts, 300010.0, 0.01, 300000.0, 10.0)
+            book.ask_trades.expire(ts)
+
+    def cached(_):
+        for _ in range(loops):
+            book.intensity_estimator.estimate(now)
+
+    def refit(_):
+        for _ in range(loops // 10):
+            book.intensity_estimator.estimate(now, force=True)
+
+    results = [
+        measure("trade_append", params, append, loops, repeat=repeat),
+        measure("trading_intensity", params, cached, loops, repeat=repeat),
+        measure("intensity_refit", params, refit, loops // 10, repeat=repeat),
+    ]
+
+    # ticks of a live book with a trade buffer of this size
+    generator = LunoStreamGenerator(depth=500, seed=1)
+    book = make_book()
+    book.load_snapshot(generator.snapshot())
+    book.start_time -= book.trade_buffer_duration*60*1000  # estimators ready from the first tick
+    fill_trades(book, n_trades, now, rng)
+    ticks = []
+    for data in generator.updates(n):
+        book.clock.now = now / 1000
+        book.sequence = int(data["sequence"])
+        book.process_message(data)
+        ticks.append({"data": codec.encode("LOB", book.build_tick(now))})
+        now += 100
+
+    def make_strategy():
+        clock = ReplayClock()
+        exchange = SimExchange(PAIR, {"XBT": 10.0, "MYR": 3_000_000.0}, clock=clock)
+        strategy = AvellanedaStrategy(auth_config=NO_AUTH,
+                                      pair=PAIR,
+                                      trading_rules=config.get_trading_rules(PAIR),
+                                      sub_channels=[f"LOB::{PAIR}"],
+                                      trading_config=dict(order_size=0.001, order_refresh_rate_s=0),
+                                      simulated=False,
+                                      client=exchange,
+                                      executor=SimExecutor(exchange),
+                                      clock=clock)
+        return strategy, exchange, clock
+
+    def on_tick(state):
+        strategy, exchange, clock = state
+        for tick in ticks:
+            clock.now = codec.peek_ts(tick["data"]) / 1000
+            strategy.on_tick(tick)
+            exchange.events.clear()
+
+    results.append(measure("on_tick", params, on_tick, len(ticks), setup=make_strategy, repeat=repeat))
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return dict(python=platform.python_version(),
+                implementation=platform.python_implementation(),
+                platform=platform.platform(),
+                processor=platform.processor(),
+                numpy=np.__version__,
+                json_backend=JSON_BACKEND,
+                commit=commit,
+                ts=int(time.time()*1000))
+
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> List[dict]:
+    """Cases whose median got slower than the baseline by more than `threshold`"""
+    def key(r):
+        return r["name"], json.dumps(r["params"], sort_keys=True)
+    base = {key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None or not b["median_ns"]:
+            continue
+        change = r["median_ns"] / b["median_ns"] - 1
+        r["change"] = change
+        if change > threshold:
+            regressions.append(r)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, nargs="+", default=[100, 1000, 10000], help="Orders per side")
+    parser.add_argument("--trades", type=int, nargs="+", default=[1000, 10000, 100000], help="Trades in the buffer")
+    parser.add_argument("-n", "--messages", type=int, default=20000, help="Updates per run")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--fixed-point", action="store_true", help="Book holds scaled integers")
+    parser.add_argument("-o", "--output", type=str, default="bench_results.json")
+    parser.add_argument("--compare", type=str, help="Baseline results, exits 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed median slowdown")
+    args = parser.parse_args()
+
+    results = []
+    for depth in args.depth:
+        results += book_cases(depth, args.messages, args.repeat, args.fixed_point)
+    for n_trades in args.trades:
+        results += trade_cases(n_trades, min(args.messages, 5000), args.repeat)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+
+    for r in results:
+        params = " ".join(f"{k}={v}" for k, v in r["params"].items())
+        change = f" {r['change']:+.0%}" if "change" in r else ""
+        color = "red" if r in regressions else "blue"
+        cprint(f"{r['name']:>22} {params:<30} {r['median_ns']/1000:>10.2f}us{change}", color)
+
+    with open(args.output, "w") as f:
+        json.dump(dict(environment=environment(), args=vars(args), results=results), f, indent=1)
+    cprint(f"{len(results)} results -> {args.output}", "green")
+    if regressions:
+        cprint(f"{len(regressions)} regression(s) over {args.threshold:.0%}", "red")
+        sys.exit(1)
@@ -0,0 +1,279 @@
+"""
+Synthetic Luno stream
+
+Generates what wss://ws.luno.com/api/1/stream/<pair> sends: a full order book
+(snapshot) with `depth` orders per side, then create / delete / trade updates
+with consecutive sequence numbers and timestamps at `rate` messages per second.
+
+- prices and volumes are whole multiples of the pair's quanta, formatted
+  like Luno does, so both the Decimal and the fixed point book accept them
+- new orders never cross the book, a trade takes liquidity from the touch
+  of one side (possibly several makers in one message), makers that are
+  fully filled leave the book like on Luno
+- the number of orders per side stays around `depth`, the reference price
+  follows a random walk of `volatility` ticks per message
+- the same seed gives the same stream
+
+python benchmarks/stream_generator.py -n 100000 --depth 1000 -o data/synthetic.jsonl.gz
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import random
+from decimal import Decimal
+from typing import Dict, Iterator, List
+
+ACTIONS = ("create", "delete", "trade")
+
+
+class LunoStreamGenerator:
+    """
+    Args:
+        depth (int): resting orders per side. Defaults to 1000.
+        rate (float): messages per second. Defaults to 10.
+        create_weight (float): share of create updates. Defaults to 0.5.
+        delete_weight (float): share of delete updates. Defaults to 0.4.
+        trade_weight (float): share of trade updates. Defaults to 0.1.
+        mid_price (float): starting mid price. Defaults to 300000.
+        price_quantum (float): tick size. Defaults to 1.
+        volume_quantum (float): order size step. Defaults to 0.000001.
+        max_volume (float): largest order. Defaults to 0.5.
+        orders_per_level (float): average orders resting on a price level. Defaults to 2.
+        volatility (float): std of the reference price walk, in ticks per message. Defaults to 0.3.
+        max_makers (int): makers one trade message can fill. Defaults to 3.
+        seed (int): random seed. Defaults to 0.
+        start_ts (int): timestamp of the snapshot, ms. Defaults to 1700000000000.
+        start_sequence (int): sequence of the snapshot. Defaults to 1000.
+    """
+
+    def __init__(self,
+                 depth: int = 1000,
+                 rate: float = 10,
+                 create_weight: float = 0.5,
+                 delete_weight: float = 0.4,
+                 trade_weight: float = 0.1,
+                 mid_price: float = 300000,
+                 price_quantum: float = 1,
+                 volume_quantum: float = 0.000001,
+                 max_volume: float = 0.5,
+                 orders_per_level: float = 2,
+                 volatility: float = 0.3,
+                 max_makers: int = 3,
+                 seed: int = 0,
+                 start_ts: int = 1_700_000_000_000,
+                 start_sequence: int = 1000):
+        self.depth = depth
+        self.rate = rate
+        self.weights = (create_weight, delete_weight, trade_weight)
+        self.price_quantum = Decimal(str(price_quantum))
+        self.volume_quantum = Decimal(str(volume_quantum))
+        self.max_volume_units = max(1, int(Decimal(str(max_volume)) / self.volume_quantum))
+        # mean distance from the touch, in ticks, that keeps `depth` orders on ~depth/orders_per_level levels
+        self.mean_distance = max(1.0, depth / orders_per_level / 2)
+        self.volatility = volatility
+        self.max_makers = max_makers
+        self.rng = random.Random(seed)
+        self.ts = start_ts
+        self.sequence = start_sequence
+        self.reference = int(Decimal(str(mid_price)) / self.price_quantum)  # ticks
+
+        self._orders: Dict[str, list] = {}  # id -> [side, price ticks, volume units]
+        self._ids: List[str] = []  # for O(1) random picks
+        self._pos: Dict[str, int] = {}
+        self._levels = {"BID": {}, "ASK": {}}  # side -> price -> [ids], oldest first
+        self._prices = {"BID": [], "ASK": []}  # sorted ascending
+        self._next_id = 0
+        self._snapshot = self._build_snapshot()
+
+    # book state
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return f"BX{self._next_id:010d}"
+
+    def _add(self, order_id: str, side: str, price: int, volume: int):
+        self._orders[order_id] = [side, price, volume]
+        self._pos[order_id] = len(self._ids)
+        self._ids.append(order_id)
+        level = self._levels[side].get(price)
+        if level is None:
+            self._levels[side][price] = [order_id]
+            bisect.insort(self._prices[side], price)
+        else:
+            level.append(order_id)
+
+    def _remove(self, order_id: str):
+        side, price, _ = self._orders.pop(order_id)
+        index = self._pos.pop(order_id)
+        last = self._ids.pop()
+        if last != order_id:
+            self._ids[index] = last
+            self._pos[last] = index
+        level = self._levels[side][price]
+        level.remove(order_id)
+        if not level:
+            del self._levels[side][price]
+            prices = self._prices[side]
+            del prices[bisect.bisect_left(prices, price)]
+
+    def best(self, side: str):
+        prices = self._prices[side]
+        if not prices:
+            return None
+        return prices[-1] if side == "BID" else prices[0]
+
+    def count(self, side: str) -> int:
+        return sum(len(ids) for ids in self._levels[side].values())
+
+    def _price(self, ticks: int) -> str:
+        return str(ticks * self.price_quantum)
+
+    def _volume(self, units: int) -> str:
+        return str(units * self.volume_quantum)
+
+    def _random_volume(self) -> int:
+        # many small orders, a few large ones
+        return max(1, int(self.max_volume_units * self.rng.random() ** 3))
+
+    def _quote_price(self, side: str) -> int:
+        """Distance from the reference drawn from an exponential, never crossing"""
+        distance = 1 + int(self.rng.expovariate(1 / self.mean_distance))
+        if side == "BID":
+            price = self.reference - distance
+            best_ask = self.best("ASK")
+            if best_ask is not None and price >= best_ask:
+                price = best_ask - 1
+        else:
+            price = self.reference + distance
+            best_bid = self.best("BID")
+            if best_bid is not None and price <= best_bid:
+                price = best_bid + 1
+        return price
+
+    def _build_snapshot(self) -> dict:
+        for side in ("BID", "ASK"):
+            for _ in range(self.depth):
+                self._add(self._new_id(), side, self._quote_price(side), self._random_volume())
+        return self.snapshot()
+
+    # messages
+    def snapshot(self) -> dict:
+        """Full order book message of the current state"""
+        def side(name):
+            return [{"id": order_id, "price": self._price(price), "volume": self._volume(self._orders[order_id][2])}
+                    for price in self._prices[name]
+                    for order_id in self._levels[name][price]]
+        return {
+            "sequence": str(self.sequence),
+            "asks": side("ASK"),
+            "bids": side("BID"),
+            "status": "ACTIVE",
+            "timestamp": self.ts,
+        }
+
+    def _message(self) -> dict:
+        return {
+            "sequence": str(self.sequence),
+            "trade_updates": None,
+            "create_update": None,
+            "delete_update": None,
+            "status_update": None,
+            "timestamp": self.ts,
+        }
+
+    def _pick_action(self) -> str:
+        action = self.rng.choices(ACTIONS, self.weights)[0]
+        # keep the book around `depth` orders per side
+        if action == "delete" and len(self._orders) <= self.depth:
+            return "create"
+        if action == "create" and len(self._orders) >= 3 * self.depth:
+            return "delete"
+        return action
+
+    def update(self) -> dict:
+        """Next update message"""
+        self.sequence += 1
+        self.ts += max(1, int(self.rng.expovariate(self.rate / 1000)))
+        self.reference += round(self.rng.gauss(0, self.volatility))
+        msg = self._message()
+        action = self._pick_action()
+        if action == "create":
+            side = "BID" if self.rng.random() < 0.5 else "ASK"
+            order_id, price, volume = self._new_id(), self._quote_price(side), self._random_volume()
+            self._add(order_id, side, price, volume)
+            msg["create_update"] = {
+                "order_id": order_id,
+                "type": side,
+                "price": self._price(price),
+                "volume": self._volume(volume),
+            }
+        elif action == "delete":
+            order_id = self._ids[self.rng.randrange(len(self._ids))]
+            self._remove(order_id)
+            msg["delete_update"] = {"order_id": order_id}
+        else:
+            msg["trade_updates"] = self._trade()
+        return msg
+
+    def _trade(self) -> list:
+        """A taker against the touch of a random side"""
+        side = "BID" if self.rng.random() < 0.5 else "ASK"
+        if not self._prices[side]:
+            side = "ASK" if side == "BID" else "BID"
+        taker_id = self._new_id()
+        remaining = self._random_volume()
+        updates = []
+        while remaining > 0 and len(updates) < self.max_makers and self._prices[side]:
+            price = self.best(side)
+            maker_id = self._levels[side][price][0]
+            maker = self._orders[maker_id]
+            base = min(remaining, maker[2])
+            remaining -= base
+            maker[2] -= base
+            if maker[2] == 0:
+                self._remove(maker_id)
+            updates.append({
+                "base": self._volume(base),
+                "counter": str(base * self.volume_quantum * price * self.price_quantum),
+                "maker_order_id": maker_id,
+                "taker_order_id": taker_id,
+                "order_id": maker_id,
+            })
+        # the taker moves the reference with it
+        self.reference = self.best(side) or self.reference
+        return updates
+
+    def updates(self, n: int) -> Iterator[dict]:
+        for _ in range(n):
+            yield self.update()
+
+    def messages(self, n: int) -> Iterator[str]:
+        """Raw messages: the snapshot taken at construction, then n updates"""
+        yield json.dumps(self._snapshot)
+        for msg in self.updates(n):
+            yield json.dumps(msg)
+
+    def write(self, path: str, n: int):
+        """JSON lines, gzipped for .gz, readable by backtest.read_messages"""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "wt") as f:
+            for msg in self.messages(n):
+                f.write(msg)
+                f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--messages", type=int, default=100_000, help="Updates after the snapshot")
+    parser.add_argument("--depth", type=int, default=1000, help="Orders per side")
+    parser.add_argument("--rate", type=float, default=10, help="Messages per second")
+    parser.add_argument("--weights", type=float, nargs=3, default=(0.5, 0.4, 0.1), help="create delete trade")
+    parser.add_argument("--mid-price", type=float, default=300000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=str, required=True, help=".jsonl or .jsonl.gz")
+    args = parser.parse_args()
+
+    create, delete, trade = args.weights
+    LunoStreamGenerator(depth=args.depth, rate=args.rate, create_weight=create, delete_weight=delete,
+                        trade_weight=trade, mid_price=args.mid_price, seed=args.seed).write(args.output, args.messages)
@@ -0,0 +1 @@
+"""Helpers shared by the orderbook, order gateway and strategy services"""
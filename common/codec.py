@@ -0,0 +1,206 @@
+"""
+Wire format for LOB::<pair>, TRADES::<pair>, BOOK_STATUS::<pair> and ORDER_UPDATES
+
+Binary layout (little endian), version 1
+    header:  magic 0xB1 | version | message type       (3 x uint8)
+    numbers: fixed struct of the schema's numeric fields
+    strings: uint16 length + utf-8 bytes, in schema order
+
+Missing numeric fields are sent as nan (floats), 0 (ints) or False (bools).
+Set WIRE_FORMAT = "json" in .env to publish plain JSON for debugging, decode()
+reads either format so consumers do not need to know which one is used.
+"""
+
+import json
+import math
+import struct
+from typing import Dict, List, Tuple, Union
+
+MAGIC = 0xB1
+VERSION = 1
+HEADER = struct.Struct("<BBB")
+LENGTH = struct.Struct("<H")
+
+DEFAULTS = {"d": math.nan, "q": 0, "?": False}
+
+
+class Schema:
+    def __init__(self, type_id: int, name: str, fields: List[Tuple[str, str]]):
+        """fields: (name, kind), kind is a struct code d/q/? or s for str"""
+        self.type_id = type_id
+        self.name = name
+        self.fields = fields
+        self.numeric = [(n, k) for n, k in fields if k != "s"]
+        self.strings = [n for n, k in fields if k == "s"]
+        self.struct = struct.Struct("<" + "".join(k for _, k in self.numeric))
+        self._header = HEADER.pack(MAGIC, VERSION, type_id)
+
+    def encode(self, msg: dict) -> bytes:
+        values = []
+        for name, kind in self.numeric:
+            value = msg.get(name)
+            values.append(DEFAULTS[kind] if value is None else _convert(value, kind))
+        parts = [self._header, self.struct.pack(*values)]
+        for name in self.strings:
+            raw = str(msg.get(name, "")).encode()
+            parts.append(LENGTH.pack(len(raw)))
+            parts.append(raw)
+        return b"".join(parts)
+
+    def decode(self, payload: bytes, offset: int = HEADER.size) -> dict:
+        msg = dict(zip((n for n, _ in self.numeric), self.struct.unpack_from(payload, offset)))
+        offset += self.struct.size
+        for name in self.strings:
+            (length,) = LENGTH.unpack_from(payload, offset)
+            offset += LENGTH.size
+            msg[name] = payload[offset:offset + length].decode()
+            offset += length
+        return msg
+
+    def coerce(self, msg: dict) -> dict:
+        """Give JSON (or old stringified) messages the same types as binary ones"""
+        for name, kind in self.fields:
+            if name in msg and msg[name] is not None:
+                msg[name] = _convert(msg[name], kind)
+        return msg
+
+
+def _convert(value, kind: str):
+    if kind == "d":
+        if hasattr(value, "timestamp"):
+            return value.timestamp()
+        return float(value)
+    if kind == "q":
+        return int(value)
+    if kind == "?":
+        if isinstance(value, str):
+            return value == "True" or value == "true"
+        return bool(value)
+    return str(value)
+
+
+LOB_FIELDS = [
+    ("ts", "d"),
+    ("mid_price", "d"),
+    ("spread", "d"),
+    ("best_bid", "d"),
+    ("best_ask", "d"),
+    ("best_bid_size", "d"),
+    ("best_ask_size", "d"),
+    ("vamp", "d"),
+    ("order_imbalance", "d"),
+    ("volatility", "d"),
+    ("alpha", "d"),
+    ("kappa", "d"),
+    ("microprice", "d"),
+    ("imbalance_1", "d"),
+    ("imbalance_5", "d"),
+    ("imbalance_10", "d"),
+    ("weighted_depth_bid", "d"),
+    ("weighted_depth_ask", "d"),
+    ("slope_bid", "d"),
+    ("slope_ask", "d"),
+    ("buffer_ready", "?"),
+]
+
+TRADE_FIELDS = [
+    ("ts", "d"),
+    ("price", "d"),
+    ("amount", "d"),
+    ("mid_price", "d"),
+    ("distance", "d"),
+    ("best_bid", "d"),
+    ("best_ask", "d"),
+    ("bidask", "s"),
+]
+
+ORDER_STATUS_FIELDS = [
+    ("msg_type", "s"),
+    ("order_id", "s"),
+    ("exchange_order_id", "s"),
+    ("full_symbol", "s"),
+    ("symbol", "s"),
+    ("exchange", "s"),
+    ("order_status", "s"),
+]
+
+FILL_FIELDS = [
+    ("fill_price", "d"),
+    ("fill_size", "d"),
+    ("fill_time", "d"),
+    ("commission", "d"),
+    ("msg_type", "s"),
+    ("order_id", "s"),
+    ("exchange_order_id", "s"),
+    ("full_symbol", "s"),
+    ("symbol", "s"),
+    ("exchange", "s"),
+]
+
+BALANCE_FIELDS = [
+    ("row_index", "q"),
+    ("balance", "d"),
+    ("balance_delta", "d"),
+    ("available", "d"),
+    ("available_delta", "d"),
+    ("ts", "d"),
+    ("msg_type", "s"),
+    ("account_id", "s"),
+    ("exchange", "s"),
+]
+
+BOOK_STATUS_FIELDS = [
+    ("ts", "d"),
+    ("sequence", "q"),
+    ("valid", "?"),
+    ("msg_type", "s"),
+    ("pair", "s"),
+    ("reason", "s"),
+]
+
+SCHEMAS: Dict[str, Schema] = {
+    schema.name: schema for schema in (
+        Schema(1, "LOB", LOB_FIELDS),
+        Schema(2, "TRADE", TRADE_FIELDS),
+        Schema(3, "ORDER_STATUS", ORDER_STATUS_FIELDS),
+        Schema(4, "FILL", FILL_FIELDS),
+        Schema(5, "BALANCE", BALANCE_FIELDS),
+        Schema(6, "BOOK_STATUS", BOOK_STATUS_FIELDS),
+    )
+}
+SCHEMAS_BY_ID: Dict[int, Schema] = {schema.type_id: schema for schema in SCHEMAS.values()}
+
+
+def encode(schema: str, msg: dict, fmt: str = "binary") -> Union[bytes, str]:
+    """Encode a message, unknown schemas and fmt="json" fall back to JSON"""
+    if schema in SCHEMAS:
+        if fmt == "binary":
+            return SCHEMAS[schema].encode(msg)
+        # same field types as binary, e.g. a datetime becomes epoch seconds not its str()
+        msg = SCHEMAS[schema].coerce(dict(msg))
+    return json.dumps(msg, default=str)
+
+
+TS = struct.Struct("<d")
+
+
+def peek_ts(payload: Union[bytes, str]) -> float:
+    """ts of a LOB/TRADE message without decoding the rest (binary only, JSON is parsed)"""
+    if isinstance(payload, (bytes, bytearray, memoryview)) and payload[:1] == b"\xb1":
+        return TS.unpack_from(payload, HEADER.size)[0]
+    return float(json.loads(payload).get("ts", math.nan))
+
+
+def decode(payload: Union[bytes, str], schema: str = None) -> dict:
+    """Decode a binary or JSON message. For JSON, `schema` restores the field types"""
+    if isinstance(payload, (bytes, bytearray, memoryview)) and payload[:1] == b"\xb1":
+        magic, version, type_id = HEADER.unpack_from(payload)
+        if version != VERSION:
+            raise ValueError(f"Unsupported wire format version {version}")
+        return SCHEMAS_BY_ID[type_id].decode(payload)
+    msg = json.loads(payload)
+    if schema is None:
+        schema = msg.get("msg_type")
+    if schema in SCHEMAS:
+        SCHEMAS[schema].coerce(msg)
+    return msg
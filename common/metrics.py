@@ -0,0 +1,281 @@
+"""
+Hot path instrumentation
+
+Per-stage latency histograms and counters, cheap enough to leave in the
+websocket and tick loops:
+- stages are timed with chained laps on one monotonic clock read each
+      t = metrics.now()
+      ...parse...
+      t = metrics.lap("parse", t)
+      ...apply...
+      t = metrics.lap("apply", t)
+  now() returns 0 while disabled and lap() then returns straight away
+- LatencyHistogram: HDR-style log-linear buckets over nanoseconds, fixed
+  memory and < 1% relative error on every percentile
+- counters (incr) and gauges (set_gauge), rates are per export interval
+
+MetricsExporter writes a snapshot (p50/p90/p99/p999 per stage in µs, counters,
+rates) to the Redis key METRICS::<service> every interval and serves it over
+HTTP when given a port. Metrics are toggled at runtime through the Redis key
+METRICS::<service>::enabled ("1"/"0") or GET /enable, /disable on the endpoint,
+whichever changed last wins (the Redis key is applied when its value changes).
+"""
+
+import asyncio
+import json
+import threading
+import time
+from typing import Callable, Dict, List
+
+from termcolor import cprint
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    Args:
+        sub_bucket_bits (int): 2**bits linear buckets per power of two. Defaults to 7 (< 1% error).
+        max_value (int): largest value kept exactly, above is clamped. Defaults to ~18 min in ns.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7, max_value: int = 1 << 40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub = 1 << sub_bucket_bits
+        self._half = self._sub >> 1
+        self.max_value = max_value
+        self.counts: List[int] = [0] * (self._index(max_value) + 1)
+        self.count = 0
+        self.total = 0
+
+    def _index(self, value: int) -> int:
+        if value < self._sub:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self._sub + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _value(self, index: int) -> int:
+        """Midpoint of a bucket"""
+        if index < self._sub:
+            return index
+        shift, offset = divmod(index - self._sub, self._half)
+        shift += 1
+        return ((offset + self._half) << shift) + (1 << (shift - 1))
+
+    def record(self, value: int):
+        # _index() inlined, this runs once per stage per message
+        if value >= self._sub:
+            if value > self.max_value:
+                value = self.max_value
+            shift = value.bit_length() - self.sub_bucket_bits
+            index = self._sub + (shift - 1) * self._half + (value >> shift) - self._half
+        elif value > 0:
+            index = value
+        else:
+            index = value = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, p: float) -> int:
+        if not self.count:
+            return 0
+        target = max(1, int(self.count * p / 100 + 0.5))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self._value(index)
+        return self.max_value
+
+    @property
+    def min(self) -> int:
+        return next((self._value(i) for i, n in enumerate(self.counts) if n), 0)
+
+    @property
+    def max(self) -> int:
+        return next((self._value(i) for i in range(len(self.counts) - 1, -1, -1) if self.counts[i]), 0)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, n in enumerate(other.counts):
+            if n:
+                self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+
+    def summary(self, scale: float = 1e-3) -> dict:
+        """count, mean, min, max and PERCENTILES, in µs by default"""
+        if not self.count:
+            return dict(count=0)
+        stats = dict(count=self.count,
+                     mean=self.total / self.count * scale,
+                     min=self.min * scale,
+                     max=self.max * scale)
+        for p in PERCENTILES:
+            stats[f"p{p:g}"] = self.percentile(p) * scale
+        return stats
+
+
+class Metrics:
+    """
+    Args:
+        service (str): name used by the exporter, e.g. "lob" or "avellaneda"
+        enabled (bool): start recording straight away. Defaults to False.
+    """
+
+    def __init__(self, service: str, enabled: bool = False):
+        self.service = service
+        self.enabled = enabled
+        self._stages: Dict[str, LatencyHistogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()  # snapshot swap vs. first record of a stage
+        self._interval_start = time.monotonic()
+
+    def now(self) -> int:
+        """Start of a timed section, 0 while disabled"""
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def lap(self, stage: str, start: int) -> int:
+        """Record the time since `start` for `stage`, returns the start of the next stage"""
+        if not start:
+            return 0
+        now = time.perf_counter_ns()
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._new_stage(stage)
+        histogram.record(now - start)
+        return now
+
+    def _new_stage(self, stage: str) -> LatencyHistogram:
+        with self._lock:
+            return self._stages.setdefault(stage, LatencyHistogram())
+
+    def record(self, stage: str, value_ns: int):
+        """Record a duration measured elsewhere, e.g. tick publish -> receive"""
+        if not self.enabled:
+            return
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._new_stage(stage)
+        histogram.record(value_ns)
+
+    def incr(self, name: str, n: int = 1):
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def set_gauge(self, name: str, read: Callable[[], float]):
+        """`read` is called on every snapshot, e.g. lambda: publisher.dropped"""
+        self._gauges[name] = read
+
+    def snapshot(self, reset: bool = True) -> dict:
+        """Stats since the last reset: latency per stage (µs), counters, rates (/s) and gauges"""
+        with self._lock:
+            stages, counters = self._stages, self._counters
+            if reset:
+                self._stages, self._counters = {}, {}
+        now = time.monotonic()
+        elapsed = max(now - self._interval_start, 1e-9)
+        if reset:
+            self._interval_start = now
+        gauges = {}
+        for name, read in self._gauges.items():
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = repr(e)
+        return dict(
+            service=self.service,
+            ts=int(time.time()*1000),
+            interval_s=elapsed,
+            enabled=self.enabled,
+            latency_us={stage: h.summary() for stage, h in stages.items()},
+            counters=dict(counters),
+            rates={name: n / elapsed for name, n in counters.items()},
+            gauges=gauges,
+        )
+
+
+class MetricsExporter:
+    """
+    Args:
+        metrics (Metrics): registry to export
+        redis_client (redis.asyncio.Redis): writes METRICS::<service>, None to skip Redis
+        interval_s (float): export interval. Defaults to 10.
+        port (int): serve GET /metrics, /enable, /disable on localhost. Defaults to None (off).
+        log (bool): print the per stage p50/p99/p999 on every export. Defaults to False.
+    """
+
+    def __init__(self,
+                 metrics: Metrics,
+                 redis_client=None,
+                 interval_s: float = 10,
+                 port: int = None,
+                 log: bool = False):
+        self.metrics = metrics
+        self._redis = redis_client
+        self.interval_s = interval_s
+        self.port = port
+        self.log = log
+        self.key = f"METRICS::{metrics.service}"
+        self.last = None
+        self._server = None
+        self._toggle = None  # last METRICS::<service>::enabled value seen
+
+    async def run(self):
+        if self.port:
+            self._server = await asyncio.start_server(self._serve, "127.0.0.1", self.port)
+        try:
+            while True:
+                await asyncio.sleep(self.interval_s)
+                await self.export()
+        finally:
+            if self._server is not None:
+                self._server.close()
+
+    async def export(self):
+        if self._redis is not None:
+            try:
+                toggle = await self._redis.get(f"{self.key}::enabled")
+                # only a change is applied, so /enable and /disable are not undone every export
+                if toggle is not None and toggle != self._toggle:
+                    self.metrics.enabled = toggle in (b"1", "1")
+                self._toggle = toggle
+            except Exception as e:
+                cprint(f"Metrics toggle: {e!r}", "red")
+        if not self.metrics.enabled and self.last is not None and not self.last["enabled"]:
+            return
+        self.last = self.metrics.snapshot()
+        if self._redis is not None:
+            try:
+                await self._redis.set(self.key, json.dumps(self.last), ex=max(1, int(self.interval_s * 6)))
+            except Exception as e:
+                cprint(f"Metrics export: {e!r}", "red")
+        if self.log:
+            for stage, s in self.last["latency_us"].items():
+                if s["count"]:
+                    cprint(f"{stage:>16} n={s['count']:<8} p50={s['p50']:.1f}us "
+                           f"p99={s['p99']:.1f}us p999={s['p99.9']:.1f}us", "blue")
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            parts = request.decode(errors="replace").split()
+            path = parts[1] if len(parts) > 1 else "/"
+            status = "200 OK"
+            if path == "/enable":
+                self.metrics.enabled = True
+                body = {"enabled": True}
+            elif path == "/disable":
+                self.metrics.enabled = False
+                body = {"enabled": False}
+            elif path == "/metrics":
+                body = self.last or {}
+            else:
+                status, body = "404 Not Found", {"error": path}
+            payload = json.dumps(body).encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        finally:
+            writer.close()
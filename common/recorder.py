@@ -0,0 +1,294 @@
+"""
+Raw websocket recorder
+
+Appends every raw message with its receive time (ms) and sequence number
+(-1 when the stream has none, e.g. the user stream) to rotating segment files:
+
+    <directory>/<name>-<first receive ts>.lseg
+
+Segment layout: magic b"LSEG" + version, then blocks of
+    header:  compressed length | first ts | last ts | min seq | max seq | count
+    payload: zlib of records (recv ts int64 | seq int64 | length uint32 | bytes)
+
+- record() only appends to an in-memory block, a writer thread compresses,
+  writes and rotates (by size or age), so the event loop never touches disk.
+  run() flushes a block that waited flush_interval_s while no new message came
+- the block headers are the index: SegmentReader reads headers only and
+  decompresses just the blocks a time / sequence range needs. A segment cut
+  short by a crash is read up to its last complete block.
+"""
+
+import asyncio
+import bisect
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, Tuple, Union
+
+from termcolor import cprint
+
+MAGIC = b"LSEG"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sB")
+BLOCK = struct.Struct("<IqqqqI")
+RECORD = struct.Struct("<qqI")
+SUFFIX = ".lseg"
+
+
+class StreamRecorder:
+    """
+    Args:
+        directory (str): where segments are written, created if missing
+        name (str): segment file prefix, e.g. the pair or "userstream"
+        block_bytes (int): uncompressed size of one block. Defaults to 256 KiB.
+        segment_bytes (int): rotate once a segment is this large. Defaults to 128 MiB.
+        segment_seconds (float): rotate once a segment is this old. Defaults to 1 hour.
+        flush_interval_s (float): max time a message stays buffered. Defaults to 1.
+        level (int): zlib level. Defaults to 6.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 name: str,
+                 block_bytes: int = 256 * 1024,
+                 segment_bytes: int = 128 * 1024 * 1024,
+                 segment_seconds: float = 3600,
+                 flush_interval_s: float = 1.0,
+                 level: int = 6):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.block_bytes = block_bytes
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_interval_s = flush_interval_s
+        self.level = level
+        self._block = []
+        self._block_size = 0
+        self._first_ts = self._last_ts = None
+        self._min_seq = self._max_seq = -1
+        self._last_flush = time.monotonic()
+        self._queue = queue.Queue()
+        self._file = None
+        self._segment_start = None
+        self._writer = threading.Thread(target=self._write_loop, name=f"recorder-{name}", daemon=True)
+        self._writer.start()
+        self._closed = False
+        # stats
+        self.messages = 0
+        self.blocks = 0
+        self.bytes_written = 0
+        self.segments = 0
+        self.failed_blocks = 0
+
+    def record(self, message: Union[str, bytes], seq: int = -1, ts: int = None):
+        """Buffer one raw message, cheap enough for the receive loop"""
+        if self._closed:
+            return
+        if ts is None:
+            ts = int(time.time()*1000)
+        if isinstance(message, str):
+            message = message.encode()
+        self._block.append(RECORD.pack(ts, seq, len(message)))
+        self._block.append(message)
+        self._block_size += RECORD.size + len(message)
+        if self._first_ts is None:
+            self._first_ts = ts
+        self._last_ts = ts
+        if seq >= 0:
+            if self._min_seq < 0 or seq < self._min_seq:
+                self._min_seq = seq
+            if seq > self._max_seq:
+                self._max_seq = seq
+        self.messages += 1
+        if self._block_size >= self.block_bytes or time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flush a block that has been buffered for flush_interval_s"""
+        if self._block and time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    async def run(self):
+        """Periodic flush_if_due() on the event loop that records, so a quiet
+        stream's last messages reach disk without waiting for the next one"""
+        while not self._closed:
+            await asyncio.sleep(self.flush_interval_s / 4)
+            self.flush_if_due()
+
+    def flush(self):
+        """Hand the current block to the writer thread"""
+        self._last_flush = time.monotonic()
+        if not self._block:
+            return
+        self._queue.put((self._first_ts, self._last_ts, self._min_seq, self._max_seq,
+                         len(self._block) // 2, b"".join(self._block)))
+        self._block = []
+        self._block_size = 0
+        self._first_ts = self._last_ts = None
+        self._min_seq = self._max_seq = -1
+
+    def close(self):
+        """Flush, wait for the writer and close the segment"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def _rotate(self, first_ts: int):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"{self.name}-{first_ts:013d}{SUFFIX}")
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self._segment_start = first_ts
+        self.segments += 1
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            first_ts, last_ts, min_seq, max_seq, count, payload = item
+            try:
+                data = zlib.compress(payload, self.level)
+                if (self._file is None
+                        or self._file.tell() >= self.segment_bytes
+                        or first_ts - self._segment_start >= self.segment_seconds*1000):
+                    self._rotate(first_ts)
+                self._file.write(BLOCK.pack(len(data), first_ts, last_ts, min_seq, max_seq, count) + data)
+                self._file.flush()
+                self.blocks += 1
+                self.bytes_written += BLOCK.size + len(data)
+            except OSError as e:
+                self.failed_blocks += 1
+                cprint(f"Recorder {self.name}: {e}, {count} messages lost", "red")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _Block:
+    __slots__ = ("path", "offset", "length", "first_ts", "last_ts", "min_seq", "max_seq", "count")
+
+    def __init__(self, path, offset, length, first_ts, last_ts, min_seq, max_seq, count):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.min_seq = min_seq
+        self.max_seq = max_seq
+        self.count = count
+
+
+class SegmentReader:
+    """Indexed reader over a recorder directory
+
+    Args:
+        directory (str): recorder directory
+        name (str): segment prefix, defaults to every segment in the directory
+    """
+
+    def __init__(self, directory: str, name: str = None):
+        self.directory = directory
+        self.name = name
+        self.blocks: List[_Block] = []
+        self.refresh()
+
+    @property
+    def segments(self) -> List[str]:
+        prefix = f"{self.name}-" if self.name else ""
+        return sorted(os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                      if f.endswith(SUFFIX) and f.startswith(prefix))
+
+    def refresh(self):
+        """(Re)build the block index from the segment headers"""
+        blocks = []
+        for path in self.segments:
+            blocks.extend(self._scan(path))
+        self.blocks = blocks
+        self._last_ts = [b.last_ts for b in blocks]
+        self._max_seq = [b.max_seq for b in blocks]
+
+    @staticmethod
+    def _scan(path: str) -> List[_Block]:
+        blocks = []
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                return blocks
+            magic, version = FILE_HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} recorder segment")
+            offset = FILE_HEADER.size
+            while offset + BLOCK.size <= size:
+                f.seek(offset)
+                length, first_ts, last_ts, min_seq, max_seq, count = BLOCK.unpack(f.read(BLOCK.size))
+                start = offset + BLOCK.size
+                if start + length > size:
+                    break  # cut short by a crash
+                blocks.append(_Block(path, start, length, first_ts, last_ts, min_seq, max_seq, count))
+                offset = start + length
+        return blocks
+
+    def __len__(self) -> int:
+        return sum(b.count for b in self.blocks)
+
+    @property
+    def start_ts(self) -> int:
+        return self.blocks[0].first_ts if self.blocks else None
+
+    @property
+    def end_ts(self) -> int:
+        return self.blocks[-1].last_ts if self.blocks else None
+
+    @staticmethod
+    def _records(block: _Block) -> Iterator[Tuple[int, int, bytes]]:
+        with open(block.path, "rb") as f:
+            f.seek(block.offset)
+            data = zlib.decompress(f.read(block.length))
+        view = memoryview(data)
+        offset = 0
+        unpack = RECORD.unpack_from
+        size = RECORD.size
+        while offset < len(data):
+            ts, seq, length = unpack(data, offset)
+            offset += size
+            yield ts, seq, bytes(view[offset:offset + length])
+            offset += length
+
+    def read(self,
+             start_ts: int = None,
+             end_ts: int = None,
+             start_seq: int = None) -> Iterator[Tuple[int, int, bytes]]:
+        """(recv ts, seq, raw message) from start_ts / start_seq (inclusive) up to end_ts"""
+        first = 0
+        if start_ts is not None:
+            first = bisect.bisect_left(self._last_ts, start_ts)
+        if start_seq is not None:
+            # sequence numbers only grow within one stream
+            first = max(first, bisect.bisect_left(self._max_seq, start_seq))
+        for block in self.blocks[first:]:
+            if end_ts is not None and block.first_ts > end_ts:
+                return
+            for ts, seq, message in self._records(block):
+                if start_ts is not None and ts < start_ts:
+                    continue
+                if start_seq is not None and 0 <= seq < start_seq:
+                    continue
+                if end_ts is not None and ts > end_ts:
+                    return
+                yield ts, seq, message
+
+    def messages(self, start_ts: int = None, end_ts: int = None, start_seq: int = None) -> Iterator[str]:
+        """Raw messages only, e.g. for backtest replay"""
+        for _, _, message in self.read(start_ts, end_ts, start_seq):
+            yield message.decode()
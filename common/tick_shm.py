@@ -0,0 +1,231 @@
+"""
+Shared memory ticks
+
+Same-host alternative to Redis for LOB::<pair> ticks: the book writes every
+tick into a fixed layout memory mapped file per pair, strategies on the same
+host read it without a socket, serialisation or lock.
+
+Layout (little endian), version 1
+    header:  magic "LOBT" | version uint16 | levels uint16 | seqlock uint64
+    payload: LOB numeric fields (codec.LOB_FIELDS) | book sequence int64 | valid bool
+             | bid count, ask count (2 x uint16) | bids, asks: levels x (price, size) float64
+
+Seqlock: the writer makes the counter odd, writes the payload with one
+pack_into and makes it even again. A reader retries while the counter is odd
+or changed during its unpack_from, so it never sees a half written tick and
+never blocks the writer. One writer per pair (the process running its book).
+The counter doubles as a version, read_new() only decodes when it moved.
+
+A writer clears the valid flag of whatever it finds when it attaches (and on
+close), so the last tick of a crashed or stopped book is never read as valid.
+Readers with max_age_ms also flag ticks older than that invalid, a writer that
+died without closing leaves its last tick behind.
+
+Files live in /dev/shm (memory backed) when it exists, the temp dir otherwise.
+"""
+
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Callable, Optional, Sequence
+
+from common.codec import DEFAULTS, SCHEMAS
+
+MAGIC = b"LOBT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQ")
+SEQLOCK = struct.Struct("<Q")
+SEQLOCK_OFFSET = 8
+NAN = math.nan
+
+LOB_NUMERIC = SCHEMAS["LOB"].numeric  # [(name, kind)], ts first
+_LOB_DEFAULTS = [(name, DEFAULTS[kind]) for name, kind in LOB_NUMERIC]
+
+
+def default_directory() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "market_making")
+
+
+def tick_path(pair: str, directory: str = None) -> str:
+    return os.path.join(directory or default_directory(), f"LOB_{pair.upper()}")
+
+
+def _payload_struct(levels: int) -> struct.Struct:
+    numeric = "".join(kind for _, kind in LOB_NUMERIC)
+    return struct.Struct("<" + numeric + "q?HH" + "d" * (4 * levels))
+
+
+# the valid flag follows the LOB fields and the book sequence
+VALID = struct.Struct("<?")
+VALID_OFFSET = HEADER.size + struct.calcsize("<" + "".join(kind for _, kind in LOB_NUMERIC) + "q")
+
+
+class TickWriter:
+    """
+    Args:
+        pair (str): e.g. XBTMYR
+        levels (int): book levels kept per side. Defaults to 10.
+        directory (str): where the file is created. Defaults to /dev/shm/market_making.
+    """
+
+    def __init__(self, pair: str, levels: int = 10, directory: str = None):
+        self.pair = pair.upper()
+        self.levels = levels
+        self.path = tick_path(self.pair, directory)
+        self._payload = _payload_struct(levels)
+        size = HEADER.size + self._payload.size
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # reuse the file (same inode) so readers that mapped it keep working after a restart
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._seq = SEQLOCK.unpack_from(self._mm, SEQLOCK_OFFSET)[0] if self._valid_header() else 0
+        self._seq += self._seq & 1  # a writer that died mid write left it odd
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, levels, self._seq)
+        self._last = None  # values of the last write, for set_valid()
+        # stats
+        self.writes = 0
+        # the tick left by a previous writer is not ours to vouch for
+        self._invalidate()
+
+    def _valid_header(self) -> bool:
+        magic, version, levels, _ = HEADER.unpack_from(self._mm, 0)
+        return magic == MAGIC and version == VERSION and levels == self.levels
+
+    def write(self, tick: dict, bids: Sequence, asks: Sequence, sequence: int = 0, valid: bool = True):
+        """tick: LOB:: fields (build_tick()), bids / asks: [[price, size], ...] best first,
+        readers get them back as (price, size) tuples"""
+        levels = self.levels
+        values = [default if tick.get(name) is None else tick[name] for name, default in _LOB_DEFAULTS]
+        n_bids, n_asks = min(len(bids), levels), min(len(asks), levels)
+        values += (sequence, valid, n_bids, n_asks)
+        for side, n in ((bids, n_bids), (asks, n_asks)):
+            for i in range(n):
+                values.append(float(side[i][0]))
+                values.append(float(side[i][1]))
+            values += (NAN,) * (2 * (levels - n))
+        self._publish(values)
+        self._valid = valid
+
+    def set_valid(self, valid: bool):
+        """Flag the last tick (in)valid, e.g. while the book resyncs"""
+        if self._last is None or valid == self._valid:
+            return
+        values = self._last
+        values[len(LOB_NUMERIC) + 1] = valid
+        self._publish(values)
+        self._valid = valid
+
+    def _invalidate(self):
+        """Clear the valid flag of the tick in the file, whoever wrote it"""
+        self._valid = False
+        if not self._seq:
+            return  # nothing written yet, readers get None
+        mm = self._mm
+        SEQLOCK.pack_into(mm, SEQLOCK_OFFSET, self._seq + 1)
+        VALID.pack_into(mm, VALID_OFFSET, False)
+        self._seq += 2
+        SEQLOCK.pack_into(mm, SEQLOCK_OFFSET, self._seq)
+        if self._last is not None:
+            self._last[len(LOB_NUMERIC) + 1] = False
+
+    def _publish(self, values: list):
+        mm = self._mm
+        SEQLOCK.pack_into(mm, SEQLOCK_OFFSET, self._seq + 1)  # odd: write in progress
+        self._payload.pack_into(mm, HEADER.size, *values)
+        self._seq += 2
+        SEQLOCK.pack_into(mm, SEQLOCK_OFFSET, self._seq)
+        self._last = values
+        self.writes += 1
+
+    def close(self):
+        self._invalidate()
+        self._mm.close()
+
+
+class TickReader:
+    """
+    Args:
+        pair (str): e.g. XBTMYR
+        directory (str): see TickWriter
+        max_retries (int): attempts of one read while the writer is busy. Defaults to 10k.
+        max_age_ms (float): ticks older than this (by their ts) are flagged invalid,
+            e.g. left by a book that died. None keeps every tick as written.
+        clock (Callable): time in seconds for max_age_ms. Defaults to time.time.
+
+    Raises:
+        FileNotFoundError: no book has written the pair yet
+    """
+
+    def __init__(self,
+                 pair: str,
+                 directory: str = None,
+                 max_retries: int = 10_000,
+                 max_age_ms: float = None,
+                 clock: Callable[[], float] = None):
+        self.pair = pair.upper()
+        self.path = tick_path(self.pair, directory)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, levels, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} tick file")
+        self.levels = levels
+        self._payload = _payload_struct(levels)
+        self._names = [name for name, _ in LOB_NUMERIC]
+        self.max_retries = max_retries
+        self.max_age_ms = max_age_ms
+        self.clock = clock or time.time
+        self.version = 0  # seqlock value of the last tick read
+        # stats
+        self.retries = 0
+        self.stale = 0
+
+    def read(self) -> Optional[dict]:
+        """Latest tick, None when there is none yet (or the writer kept it busy for max_retries)"""
+        mm = self._mm
+        for _ in range(self.max_retries):
+            start = SEQLOCK.unpack_from(mm, SEQLOCK_OFFSET)[0]
+            if not start & 1:
+                values = self._payload.unpack_from(mm, HEADER.size)
+                if SEQLOCK.unpack_from(mm, SEQLOCK_OFFSET)[0] == start:
+                    if not start:
+                        return None
+                    self.version = start
+                    tick = self._to_tick(values)
+                    if (self.max_age_ms is not None and tick["valid"]
+                            and self.clock()*1000 - tick["ts"] > self.max_age_ms):
+                        tick["valid"] = False
+                        self.stale += 1
+                    return tick
+            self.retries += 1
+        return None
+
+    def read_new(self) -> Optional[dict]:
+        """Latest tick if it changed since the last read, else None (one 8 byte read)"""
+        if SEQLOCK.unpack_from(self._mm, SEQLOCK_OFFSET)[0] == self.version:
+            return None
+        return self.read()
+
+    def _to_tick(self, values: tuple) -> dict:
+        n = len(self._names)
+        tick = dict(zip(self._names, values))
+        tick["sequence"], tick["valid"], n_bids, n_asks = values[n:n + 4]
+        bids_start = n + 4
+        asks_start = bids_start + 2 * self.levels
+        bids = values[bids_start:bids_start + 2 * n_bids]
+        asks = values[asks_start:asks_start + 2 * n_asks]
+        # (price, size) tuples, best first
+        tick["bids"] = list(zip(bids[::2], bids[1::2]))
+        tick["asks"] = list(zip(asks[::2], asks[1::2]))
+        return tick
+
+    def close(self):
+        self._mm.close()
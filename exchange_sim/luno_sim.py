@@ -0,0 +1,586 @@
+"""
+Local Luno exchange
+
+Serves, on one port, what the services expect from Luno:
+- market stream   ws  /api/1/stream/<pair>   auth message, full order book, then updates
+- user stream     ws  /api/1/userstream      order_status / order_fill / balance_update
+- REST            POST /api/1/postorder, POST /api/1/stoporder, GET /api/1/balance
+
+Each pair has a matching engine (matching.py) driven by simulated order flow
+(creates around a random-walk reference price, deletes, market orders) at
+`rate` messages per second. Our limit orders rest in the same book, so flow
+takers fill them and they show up in the market stream like anyone's.
+
+Accounts are created per API key on first use with `balances`. Injected faults:
+latency_ms on every stream message, rest_latency_ms on REST calls,
+gap_probability drops market stream messages (sequence gaps) and
+disconnect_interval_s closes stream connections after a random time.
+
+python exchange_sim/luno_sim.py -s XBTMYR:300000 ETHMYR:12000 --rate 100 --port 8765
+then in .env: LUNO_WS_URL = "ws://127.0.0.1:8765", LUNO_API_URL = "http://127.0.0.1:8765"
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from termcolor import cprint
+
+from matching import Fill, MatchingEngine, RestingOrder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "limit_order_book"))
+import config
+
+STREAM_CLOSE_CODE = 1011  # abnormal close, clients reconnect
+
+
+def _plain(amount: Decimal) -> str:
+    """Decimal without an exponent, like Luno's amounts"""
+    return f"{amount:f}"
+
+
+class Market:
+    """Book, sequence and stream subscribers of one pair"""
+
+    def __init__(self, pair: str, engine: MatchingEngine, mid_price: float):
+        self.pair = pair
+        self.base_asset, self.quote_asset = pair[:3], pair[3:]
+        self.engine = engine
+        self.sequence = 0
+        self.reference = engine.to_ticks(mid_price)
+        self.flow_ids: List[str] = []  # resting flow orders, may hold filled ones until picked
+        self.subscribers = set()
+        # stats
+        self.messages = 0
+
+
+class Account:
+    __slots__ = ("key", "balances", "reserved", "account_ids", "row_index", "subscribers", "counter_filled")
+
+    def __init__(self, key: str, balances: Dict[str, Decimal], first_account_id: int):
+        self.key = key
+        self.balances = dict(balances)
+        self.reserved = {asset: Decimal(0) for asset in balances}
+        self.account_ids = {asset: str(first_account_id + i) for i, asset in enumerate(balances)}
+        self.row_index = {asset: 0 for asset in balances}
+        self.subscribers = set()
+        self.counter_filled: Dict[str, Decimal] = {}  # order_id -> cumulative counter
+
+
+class LunoSimulator:
+    """
+    Args:
+        markets (dict): pair -> starting mid price
+        balances (dict): asset -> starting balance of every new account
+        depth (int): flow orders resting per side. Defaults to 500.
+        rate (float): flow messages per second per pair. Defaults to 10.
+        weights (tuple): create / delete / market order shares. Defaults to (0.5, 0.4, 0.1).
+        volatility (float): std of the reference walk, ticks per message. Defaults to 0.3.
+        max_volume (float): largest flow order, base units. Defaults to 0.1.
+        maker_fee (float): fee rate charged to accounts on fills. Defaults to 0.
+        latency_ms (float): delay of every stream message. Defaults to 0.
+        rest_latency_ms (float): delay of every REST call. Defaults to 0.
+        gap_probability (float): chance a market stream message is not sent. Defaults to 0.
+        disconnect_interval_s (float): mean time before a stream connection is
+            closed, 0 to never close. Defaults to 0.
+        seed (int): random seed of the flow and the faults. Defaults to 0.
+    """
+
+    def __init__(self,
+                 markets: Dict[str, float],
+                 balances: Dict[str, float],
+                 depth: int = 500,
+                 rate: float = 10,
+                 weights: tuple = (0.5, 0.4, 0.1),
+                 volatility: float = 0.3,
+                 max_volume: float = 0.1,
+                 maker_fee: float = 0.0,
+                 latency_ms: float = 0,
+                 rest_latency_ms: float = 0,
+                 gap_probability: float = 0.0,
+                 disconnect_interval_s: float = 0,
+                 seed: int = 0):
+        self.markets: Dict[str, Market] = {}
+        for pair, mid_price in markets.items():
+            rules = config.get_trading_rules(pair)
+            engine = MatchingEngine(rules["price_quantum"] or 1, rules["order_size_quantum"] or 0.000001)
+            self.markets[pair] = Market(pair, engine, mid_price)
+        self.balances = {asset: Decimal(str(v)) for asset, v in balances.items()}
+        for market in self.markets.values():
+            self.balances.setdefault(market.base_asset, Decimal(0))
+            self.balances.setdefault(market.quote_asset, Decimal(0))
+        self.accounts: Dict[str, Account] = {}
+        self._orders: Dict[str, tuple] = {}  # account order_id -> (market, account)
+        self.depth = depth
+        self.rate = rate
+        self.weights = weights
+        self.volatility = volatility
+        self.max_volume = max_volume
+        self.maker_fee = Decimal(str(maker_fee))
+        self.latency_ms = latency_ms
+        self.rest_latency_ms = rest_latency_ms
+        self.gap_probability = gap_probability
+        self.disconnect_interval_s = disconnect_interval_s
+        self.rng = random.Random(seed)
+        self._tasks = []
+        # stats
+        self.gaps_injected = 0
+        self.disconnects_injected = 0
+        self.rest_calls = 0
+
+        for market in self.markets.values():
+            self._seed_book(market)
+
+    # app
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/1/stream/{pair}", self._market_stream)
+        app.router.add_get("/api/1/userstream", self._user_stream)
+        app.router.add_post("/api/1/postorder", self._post_order)
+        app.router.add_post("/api/1/stoporder", self._stop_order)
+        app.router.add_get("/api/1/balance", self._get_balances)
+        app.on_startup.append(self._start_flow)
+        app.on_cleanup.append(self._stop_flow)
+        return app
+
+    async def _start_flow(self, app):
+        self._tasks = [asyncio.create_task(self._flow_loop(m)) for m in self.markets.values()]
+
+    async def _stop_flow(self, app):
+        for task in self._tasks:
+            task.cancel()
+
+    # simulated flow
+    def _flow_volume(self, engine: MatchingEngine) -> int:
+        # many small orders, a few large ones
+        return max(1, engine.to_units(self.max_volume * self.rng.random() ** 3))
+
+    def _flow_price(self, market: Market, side: str) -> int:
+        distance = 1 + int(self.rng.expovariate(2 / max(1, self.depth)))
+        price = market.reference - distance if side == "BID" else market.reference + distance
+        engine = market.engine
+        if engine.crosses(side, price):
+            opposite = engine.best("ASK" if side == "BID" else "BID")
+            price = opposite - 1 if side == "BID" else opposite + 1
+        return price
+
+    def _flow_create(self, market: Market):
+        side = "BID" if self.rng.random() < 0.5 else "ASK"
+        order, fills, update = market.engine.place(side, self._flow_price(market, side), self._flow_volume(market.engine))
+        market.flow_ids.append(order.order_id)
+        self._publish(market, update)
+
+    def _flow_delete(self, market: Market):
+        ids = market.flow_ids
+        while ids:
+            index = self.rng.randrange(len(ids))
+            ids[index], ids[-1] = ids[-1], ids[index]
+            order_id = ids.pop()
+            order, update = market.engine.cancel(order_id)
+            if order is not None:
+                self._publish(market, update)
+                return
+
+    def _flow_trade(self, market: Market):
+        side = "BID" if self.rng.random() < 0.5 else "ASK"
+        fills, update = market.engine.market(side, self._flow_volume(market.engine))
+        if update is not None:
+            self._publish(market, update)
+            self._on_fills(market, fills)
+
+    def _seed_book(self, market: Market):
+        for _ in range(self.depth):
+            for side in ("BID", "ASK"):
+                order, _, _ = market.engine.place(side, self._flow_price(market, side), self._flow_volume(market.engine))
+                market.flow_ids.append(order.order_id)
+
+    def flow_step(self, market: Market):
+        market.reference += round(self.rng.gauss(0, self.volatility))
+        action = self.rng.choices(("create", "delete", "trade"), self.weights)[0]
+        # keep the flow around `depth` orders per side
+        if action == "delete" and len(market.flow_ids) <= self.depth:
+            action = "create"
+        elif action == "create" and len(market.flow_ids) >= 3 * self.depth:
+            action = "delete"
+        getattr(self, f"_flow_{action}")(market)
+        best_bid, best_ask = market.engine.best("BID"), market.engine.best("ASK")
+        if action == "trade" and best_bid is not None and best_ask is not None:
+            market.reference = (best_bid + best_ask) // 2
+
+    async def _flow_loop(self, market: Market):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        done = 0
+        while True:
+            due = int((loop.time() - start) * self.rate)
+            for _ in range(due - done):
+                self.flow_step(market)
+            done = max(done, due)
+            await asyncio.sleep(max(0.001, 1 / self.rate))
+
+    # market stream
+    def _publish(self, market: Market, update: Optional[dict]):
+        if not update:
+            return
+        market.sequence += 1
+        market.messages += 1
+        msg = {
+            "sequence": str(market.sequence),
+            "trade_updates": None,
+            "create_update": None,
+            "delete_update": None,
+            "status_update": None,
+            "timestamp": int(time.time()*1000),
+        }
+        msg.update(update)
+        self._send(market.subscribers, json.dumps(msg), droppable=True)
+
+    def _send(self, subscribers, payload: str, droppable: bool = False):
+        if not subscribers:
+            return
+        send_at = asyncio.get_running_loop().time() + self.latency_ms / 1000
+        for queue in subscribers:
+            if droppable and self.gap_probability and self.rng.random() < self.gap_probability:
+                self.gaps_injected += 1
+                continue
+            queue.put_nowait((send_at, payload))
+
+    def snapshot(self, market: Market) -> dict:
+        asks, bids = market.engine.snapshot()
+        return {
+            "sequence": str(market.sequence),
+            "asks": asks,
+            "bids": bids,
+            "status": "ACTIVE",
+            "timestamp": int(time.time()*1000),
+        }
+
+    async def _accept(self, request: web.Request) -> tuple:
+        """Open the websocket and read the auth message, (ws, api key)"""
+        ws = web.WebSocketResponse(max_msg_size=2**22)
+        await ws.prepare(request)
+        auth = await ws.receive()  # {"api_key_id": ..., "api_key_secret": ...}
+        try:
+            key = json.loads(auth.data).get("api_key_id", "")
+        except (TypeError, ValueError, AttributeError):
+            key = ""
+        return ws, key
+
+    async def _stream(self, ws: web.WebSocketResponse, subscribers: set, first_message: Callable[[], str] = None):
+        """Send what is queued for `subscribers` to ws until either side closes"""
+        queue = asyncio.Queue()
+        # subscribe and take the snapshot without an await in between, updates continue from its sequence
+        subscribers.add(queue)
+        if first_message is not None:
+            queue.put_nowait((0, first_message()))
+        closer = None
+        if self.disconnect_interval_s:
+            closer = asyncio.create_task(self._disconnect_later(ws))
+        reader = asyncio.create_task(self._drain(ws, queue))
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                send_at, payload = await queue.get()
+                if payload is None or ws.closed:
+                    break
+                delay = send_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await ws.send_str(payload)
+        except (ConnectionResetError, aiohttp.ClientConnectionResetError, RuntimeError):
+            pass  # client went away
+        finally:
+            subscribers.discard(queue)
+            reader.cancel()
+            if closer is not None:
+                closer.cancel()
+        return ws
+
+    @staticmethod
+    async def _drain(ws: web.WebSocketResponse, queue: asyncio.Queue):
+        """Read (and ignore) client messages so close frames are handled, then stop the sender"""
+        async for _ in ws:
+            pass
+        queue.put_nowait((0, None))
+
+    async def _disconnect_later(self, ws: web.WebSocketResponse):
+        await asyncio.sleep(self.rng.expovariate(1 / self.disconnect_interval_s))
+        self.disconnects_injected += 1
+        await ws.close(code=STREAM_CLOSE_CODE, message=b"injected disconnect")
+
+    async def _market_stream(self, request: web.Request) -> web.WebSocketResponse:
+        market = self.markets.get(request.match_info["pair"].upper())
+        if market is None:
+            raise web.HTTPNotFound()
+        ws, _ = await self._accept(request)
+        return await self._stream(ws, market.subscribers, lambda: json.dumps(self.snapshot(market)))
+
+    async def _user_stream(self, request: web.Request) -> web.WebSocketResponse:
+        ws, key = await self._accept(request)
+        return await self._stream(ws, self._account(key).subscribers)
+
+    # accounts
+    def _account(self, key: str) -> Account:
+        account = self.accounts.get(key)
+        if account is None:
+            account = Account(key, self.balances, 1000 * (len(self.accounts) + 1))
+            self.accounts[key] = account
+        return account
+
+    def _user_event(self, account: Account, type: str, body: dict):
+        # order_status_update / order_fill_update / balance_update
+        key = type if type.endswith("_update") else f"{type}_update"
+        msg = {"type": type, "timestamp": int(time.time()*1000), key: body}
+        self._send(account.subscribers, json.dumps(msg))
+
+    def _order_status(self, account: Account, market: Market, order: RestingOrder, status: str):
+        self._user_event(account, "order_status", {
+            "order_id": order.order_id,
+            "client_order_id": order.client_order_id,
+            "market_id": market.pair,
+            "status": status,
+        })
+
+    def _balance(self, account: Account, asset: str, delta: Decimal, available_delta: Decimal):
+        account.row_index[asset] += 1
+        balance = account.balances[asset]
+        self._user_event(account, "balance_update", {
+            "account_id": account.account_ids[asset],
+            "row_index": account.row_index[asset],
+            "balance": _plain(balance),
+            "balance_delta": _plain(delta),
+            "available": _plain(balance - account.reserved[asset]),
+            "available_delta": _plain(available_delta),
+        })
+
+    def _reserve(self, account: Account, market: Market, order: RestingOrder, volume: int, price: int = None):
+        """Reserve (volume > 0) or release the funds `volume` units of `order` need"""
+        engine = market.engine
+        if order.side == "BID":
+            asset, amount = market.quote_asset, engine.counter(price if price is not None else order.price, volume)
+        else:
+            asset, amount = market.base_asset, volume * engine.volume_quantum
+        account.reserved[asset] += amount
+        self._balance(account, asset, Decimal(0), -amount)
+
+    def _on_fills(self, market: Market, fills: List[Fill]):
+        """Balances, order_fill and order_status of account orders on either side of the fills"""
+        for fill in fills:
+            for order in (fill.maker, fill.taker):
+                if order.owner is None:
+                    continue
+                self._account_fill(self.accounts[order.owner], market, order, fill)
+
+    def _account_fill(self, account: Account, market: Market, order: RestingOrder, fill: Fill):
+        engine = market.engine
+        base, quote = market.base_asset, market.quote_asset
+        size = fill.volume * engine.volume_quantum
+        notional = engine.counter(fill.price, fill.volume)
+        if order.side == "BID":
+            # reserved at the order's price, paid at the fill price
+            released = engine.counter(order.price, fill.volume)
+            fee = size * self.maker_fee
+            account.reserved[quote] -= released
+            account.balances[quote] -= notional
+            account.balances[base] += size - fee
+            self._balance(account, quote, -notional, released - notional)
+            self._balance(account, base, size - fee, size - fee)
+            base_fee, counter_fee = fee, Decimal(0)
+        else:
+            fee = notional * self.maker_fee
+            account.reserved[base] -= size
+            account.balances[base] -= size
+            account.balances[quote] += notional - fee
+            self._balance(account, base, -size, Decimal(0))
+            self._balance(account, quote, notional - fee, notional - fee)
+            base_fee, counter_fee = Decimal(0), fee
+        counter_filled = account.counter_filled.get(order.order_id, Decimal(0)) + notional
+        account.counter_filled[order.order_id] = counter_filled
+        self._user_event(account, "order_fill", {
+            "order_id": order.order_id,
+            "client_order_id": order.client_order_id,
+            "market_id": market.pair,
+            "base_fill": _plain(order.filled * engine.volume_quantum),
+            "counter_fill": _plain(counter_filled),
+            "base_delta": _plain(size),
+            "counter_delta": _plain(notional),
+            "base_fee": _plain(base_fee),
+            "counter_fee": _plain(counter_fee),
+            "base_fee_delta": _plain(base_fee),
+            "counter_fee_delta": _plain(counter_fee),
+        })
+        if order.volume == 0:
+            self._order_status(account, market, order, "COMPLETE")
+            self._orders.pop(order.order_id, None)
+            account.counter_filled.pop(order.order_id, None)
+
+    # REST
+    @staticmethod
+    def _error(code: str, message: str, status: int = 400) -> web.Response:
+        return web.json_response({"error": message, "error_code": code}, status=status)
+
+    async def _request(self, request: web.Request) -> tuple:
+        """(account, params) after the injected latency"""
+        self.rest_calls += 1
+        if self.rest_latency_ms:
+            await asyncio.sleep(self.rest_latency_ms / 1000)
+        params = dict(request.query)
+        if request.method == "POST" and request.can_read_body:
+            params.update(await request.post())
+        key = ""
+        header = request.headers.get("Authorization")
+        if header:
+            try:
+                key = aiohttp.BasicAuth.decode(header).login
+            except ValueError:
+                pass
+        return self._account(key), params
+
+    async def _post_order(self, request: web.Request) -> web.Response:
+        account, params = await self._request(request)
+        market = self.markets.get(params.get("pair", "").upper())
+        if market is None:
+            return self._error("ErrMarketUnavailable", f"Unknown pair {params.get('pair')}")
+        side = params.get("type")
+        if side not in ("BID", "ASK"):
+            return self._error("ErrInvalidArguments", f"Invalid order type {side}")
+        engine = market.engine
+        try:
+            price = engine.to_ticks(params["price"])
+            volume = engine.to_units(params["volume"])
+        except (KeyError, ArithmeticError, ValueError):
+            return self._error("ErrInvalidArguments", "price and volume are required")
+        if price <= 0 or volume <= 0:
+            return self._error("ErrInvalidArguments", "price and volume must be positive")
+        post_only = str(params.get("post_only", "")).lower() == "true"
+        if side == "BID":
+            asset, needed = market.quote_asset, engine.counter(price, volume)
+        else:
+            asset, needed = market.base_asset, volume * engine.volume_quantum
+        if needed > account.balances[asset] - account.reserved[asset]:
+            return self._error("ErrInsufficientBalance", f"Insufficient {asset} balance")
+
+        order_id = engine.new_order_id()
+        pending = RestingOrder(order_id, params.get("client_order_id", ""), account.key, side, price, volume)
+        if post_only and engine.crosses(side, price):
+            # not placed, like Luno cancels a post-only order that would cross
+            self._order_status(account, market, pending, "COMPLETE")
+            return web.json_response({"order_id": order_id})
+        self._orders[order_id] = (market, account)
+        self._reserve(account, market, pending, volume)
+        self._order_status(account, market, pending, "PENDING")
+        order, fills, update = engine.place(side, price, volume, owner=account.key,
+                                            client_order_id=pending.client_order_id, order_id=order_id)
+        self._publish(market, update)
+        self._on_fills(market, fills)
+        return web.json_response({"order_id": order_id})
+
+    async def _stop_order(self, request: web.Request) -> web.Response:
+        account, params = await self._request(request)
+        order_id = params.get("order_id", "")
+        owner = self._orders.get(order_id)
+        if owner is None or owner[1] is not account:
+            return self._error("ErrOrderNotFound", f"Order {order_id} not found", status=404)
+        market, _ = owner
+        order, update = market.engine.cancel(order_id)
+        del self._orders[order_id]
+        if order is None:
+            return web.json_response({"success": False})
+        self._reserve(account, market, order, -order.volume)
+        self._publish(market, update)
+        self._order_status(account, market, order, "COMPLETE")
+        account.counter_filled.pop(order_id, None)
+        return web.json_response({"success": True})
+
+    async def _get_balances(self, request: web.Request) -> web.Response:
+        account, _ = await self._request(request)
+        # assets=XBT&assets=MYR or assets=XBT,MYR
+        assets = [a for value in request.query.getall("assets", []) for a in value.split(",") if a]
+        return web.json_response({"balance": [
+            {
+                "account_id": account.account_ids[asset],
+                "asset": asset,
+                "balance": _plain(balance),
+                "reserved": _plain(account.reserved[asset]),
+                "unconfirmed": "0",
+            }
+            for asset, balance in account.balances.items()
+            if not assets or asset in assets
+        ]})
+
+    def stats(self) -> dict:
+        return dict(
+            messages={pair: m.messages for pair, m in self.markets.items()},
+            book_orders={pair: len(m.engine) for pair, m in self.markets.items()},
+            trades={pair: m.engine.trades for pair, m in self.markets.items()},
+            gaps_injected=self.gaps_injected,
+            disconnects_injected=self.disconnects_injected,
+            rest_calls=self.rest_calls,
+        )
+
+
+async def _log_stats(sim: LunoSimulator, interval_s: float):
+    while True:
+        await asyncio.sleep(interval_s)
+        cprint(sim.stats(), "blue")
+
+
+def parse_markets(items: List[str]) -> Dict[str, float]:
+    """XBTMYR:300000 -> {"XBTMYR": 300000.0}"""
+    markets = {}
+    for item in items:
+        pair, _, mid_price = item.partition(":")
+        markets[pair.upper()] = float(mid_price or 1000)
+    return markets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--symbols", type=str, nargs="+", default=["XBTMYR:300000"], help="PAIR:mid_price")
+    parser.add_argument("--balance", type=str, nargs="+", default=["MYR=1000000", "XBT=10"], help="ASSET=amount")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--depth", type=int, default=500, help="Flow orders per side")
+    parser.add_argument("--rate", type=float, default=10, help="Messages per second per pair")
+    parser.add_argument("--weights", type=float, nargs=3, default=(0.5, 0.4, 0.1), help="create delete trade")
+    parser.add_argument("--maker-fee", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Stream message delay")
+    parser.add_argument("--rest-latency-ms", type=float, default=0, help="REST call delay")
+    parser.add_argument("--gap-prob", type=float, default=0.0, help="Chance a market message is dropped")
+    parser.add_argument("--disconnect-s", type=float, default=0, help="Mean time before a stream is closed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stats-s", type=float, default=10, help="Print stats every N seconds")
+    args = parser.parse_args()
+
+    balances = {}
+    for item in args.balance:
+        asset, _, amount = item.partition("=")
+        balances[asset.upper()] = float(amount)
+
+    sim = LunoSimulator(parse_markets(args.symbols), balances,
+                        depth=args.depth,
+                        rate=args.rate,
+                        weights=tuple(args.weights),
+                        maker_fee=args.maker_fee,
+                        latency_ms=args.latency_ms,
+                        rest_latency_ms=args.rest_latency_ms,
+                        gap_probability=args.gap_prob,
+                        disconnect_interval_s=args.disconnect_s,
+                        seed=args.seed)
+    app = sim.app()
+
+    async def start_stats(app):
+        app["stats"] = asyncio.create_task(_log_stats(sim, args.stats_s))
+
+    app.on_startup.append(start_stats)
+    cprint(f"Luno simulator on ws://{args.host}:{args.port} / http://{args.host}:{args.port}", "green")
+    web.run_app(app, host=args.host, port=args.port, print=None)
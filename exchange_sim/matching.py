@@ -0,0 +1,212 @@
+"""
+Price-time priority matching engine
+
+One pair, prices and volumes held as integers in units of the pair's quanta.
+Every change to the book is returned as the Luno stream update it produces
+(create_update / delete_update / trade_updates), the server gives them
+sequence numbers and sends them to the market stream.
+
+- a limit order first matches against the opposite side (best price, then
+  oldest first), the remainder rests. post_only orders that would cross are
+  not placed at all.
+- a fully filled maker leaves the book without a delete_update, like on Luno
+"""
+
+import bisect
+import itertools
+from collections import deque
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+
+class RestingOrder:
+    __slots__ = ("order_id", "client_order_id", "owner", "side", "price", "volume", "filled")
+
+    def __init__(self, order_id: str, client_order_id: str, owner: Optional[str], side: str, price: int, volume: int):
+        self.order_id = order_id
+        self.client_order_id = client_order_id
+        self.owner = owner  # api key of an account, None for simulated flow
+        self.side = side
+        self.price = price
+        self.volume = volume  # remaining
+        self.filled = 0
+
+
+class Fill:
+    __slots__ = ("maker", "taker", "price", "volume")
+
+    def __init__(self, maker: RestingOrder, taker: RestingOrder, price: int, volume: int):
+        self.maker = maker
+        self.taker = taker
+        self.price = price
+        self.volume = volume
+
+
+class MatchingEngine:
+    """
+    Args:
+        price_quantum (float): tick size
+        volume_quantum (float): order size step
+    """
+
+    def __init__(self, price_quantum: float, volume_quantum: float):
+        self.price_quantum = Decimal(str(price_quantum))
+        self.volume_quantum = Decimal(str(volume_quantum))
+        self._orders: Dict[str, RestingOrder] = {}
+        self._levels = {"BID": {}, "ASK": {}}  # side -> price -> deque of orders, oldest first
+        self._prices = {"BID": [], "ASK": []}  # sorted ascending
+        self._ids = itertools.count(1)
+        # stats
+        self.trades = 0
+        self.volume_traded = 0
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._orders
+
+    def get(self, order_id: str) -> Optional[RestingOrder]:
+        return self._orders.get(order_id)
+
+    def new_order_id(self) -> str:
+        return f"BXSIM{next(self._ids):012d}"
+
+    # units
+    def to_ticks(self, price) -> int:
+        return int((Decimal(str(price)) / self.price_quantum).to_integral_value())
+
+    def to_units(self, volume) -> int:
+        return int((Decimal(str(volume)) / self.volume_quantum).to_integral_value())
+
+    def price_str(self, ticks: int) -> str:
+        return str(ticks * self.price_quantum)
+
+    def volume_str(self, units: int) -> str:
+        return str(units * self.volume_quantum)
+
+    def counter(self, price: int, volume: int) -> Decimal:
+        return price * self.price_quantum * volume * self.volume_quantum
+
+    # book
+    def best(self, side: str) -> Optional[int]:
+        prices = self._prices[side]
+        if not prices:
+            return None
+        return prices[-1] if side == "BID" else prices[0]
+
+    def crosses(self, side: str, price: int) -> bool:
+        best = self.best("ASK" if side == "BID" else "BID")
+        if best is None:
+            return False
+        return price >= best if side == "BID" else price <= best
+
+    def orders(self, side: str) -> List[RestingOrder]:
+        """Resting orders of one side, best price first then oldest first"""
+        prices = self._prices[side]
+        ordered = reversed(prices) if side == "BID" else prices
+        return [o for price in ordered for o in self._levels[side][price]]
+
+    def owned_by(self, owner: Optional[str]) -> List[RestingOrder]:
+        return [o for o in self._orders.values() if o.owner == owner]
+
+    def _rest(self, order: RestingOrder):
+        self._orders[order.order_id] = order
+        level = self._levels[order.side].get(order.price)
+        if level is None:
+            self._levels[order.side][order.price] = deque([order])
+            bisect.insort(self._prices[order.side], order.price)
+        else:
+            level.append(order)
+
+    def _unlink(self, order: RestingOrder):
+        del self._orders[order.order_id]
+        level = self._levels[order.side][order.price]
+        level.remove(order)
+        if not level:
+            del self._levels[order.side][order.price]
+            prices = self._prices[order.side]
+            del prices[bisect.bisect_left(prices, order.price)]
+
+    def place(self,
+              side: str,
+              price: int,
+              volume: int,
+              owner: Optional[str] = None,
+              client_order_id: str = "",
+              post_only: bool = False,
+              order_id: str = None) -> Tuple[RestingOrder, List[Fill], Optional[dict]]:
+        """Match then rest a limit order
+
+        Returns:
+            tuple: (order, fills, stream update) the update is None when nothing
+                changed (rejected post_only order). order.volume is what rests.
+        """
+        order = RestingOrder(order_id or self.new_order_id(), client_order_id, owner, side, price, volume)
+        if post_only and self.crosses(side, price):
+            return order, [], None
+        fills = self._match(order)
+        update = {}
+        if fills:
+            update["trade_updates"] = [self._trade_update(f) for f in fills]
+        if order.volume > 0:
+            self._rest(order)
+            update["create_update"] = {
+                "order_id": order.order_id,
+                "type": side,
+                "price": self.price_str(price),
+                "volume": self.volume_str(order.volume),
+            }
+        return order, fills, update
+
+    def market(self, side: str, volume: int, owner: Optional[str] = None) -> Tuple[List[Fill], Optional[dict]]:
+        """Taker for `volume` units against the opposite side, nothing rests"""
+        price = 10**18 if side == "BID" else 0
+        order = RestingOrder(self.new_order_id(), "", owner, side, price, volume)
+        fills = self._match(order)
+        if not fills:
+            return fills, None
+        return fills, {"trade_updates": [self._trade_update(f) for f in fills]}
+
+    def cancel(self, order_id: str) -> Tuple[Optional[RestingOrder], Optional[dict]]:
+        order = self._orders.get(order_id)
+        if order is None:
+            return None, None
+        self._unlink(order)
+        return order, {"delete_update": {"order_id": order_id}}
+
+    def _match(self, taker: RestingOrder) -> List[Fill]:
+        fills = []
+        opposite = "ASK" if taker.side == "BID" else "BID"
+        while taker.volume > 0:
+            best = self.best(opposite)
+            if best is None or (best > taker.price if taker.side == "BID" else best < taker.price):
+                break
+            maker = self._levels[opposite][best][0]
+            volume = min(taker.volume, maker.volume)
+            maker.volume -= volume
+            maker.filled += volume
+            taker.volume -= volume
+            taker.filled += volume
+            if maker.volume == 0:
+                self._unlink(maker)
+            fills.append(Fill(maker, taker, best, volume))
+            self.trades += 1
+            self.volume_traded += volume
+        return fills
+
+    def _trade_update(self, fill: Fill) -> dict:
+        return {
+            "base": self.volume_str(fill.volume),
+            "counter": str(self.counter(fill.price, fill.volume)),
+            "maker_order_id": fill.maker.order_id,
+            "taker_order_id": fill.taker.order_id,
+            "order_id": fill.maker.order_id,
+        }
+
+    def snapshot(self) -> Tuple[list, list]:
+        """(asks, bids) as in a Luno order book message"""
+        def side(name):
+            return [{"id": o.order_id, "price": self.price_str(o.price), "volume": self.volume_str(o.volume)}
+                    for o in self.orders(name)]
+        return side("ASK"), side("BID")
@@ -0,0 +1,118 @@
+"""
+Top-N book analytics
+
+The top levels of both sides are read once per update (bid_sorted /
+ask_sorted) and every feature is accumulated in a single pass over them.
+At the depths we use (10-100 levels) a fused loop over floats is cheaper
+than the fixed per-call overhead of numpy on such small arrays.
+
+Features
+- mid_price, spread
+- vamp: (bid vwap + ask vwap)/2 over `levels`
+- imbalance: Q_b/(Q_a + Q_b) at each depth in imbalance_levels, 1 -> buy pressure
+- microprice: (ask * Q_b + bid * Q_a)/(Q_a + Q_b) at the touch
+- weighted_depth: volume with linearly decaying level weights, 1 at the touch
+- slope: cumulative volume per unit distance from mid (least squares through 0)
+"""
+
+import math
+from typing import Iterable, Optional, Sequence
+
+FEATURES = ("mid_price", "spread", "vamp", "imbalance", "microprice", "weighted_depth", "slope")
+
+
+class BookAnalytics:
+    """
+    Args:
+        levels (int): levels used for vamp, depth and slope. Defaults to 10.
+        imbalance_levels (Sequence[int]): depths for order imbalance. Defaults to (1, 5, 10).
+        features (Iterable[str]): subset of FEATURES to compute. Defaults to all.
+    """
+
+    def __init__(self,
+                 levels: int = 10,
+                 imbalance_levels: Sequence[int] = (1, 5, 10),
+                 features: Iterable[str] = FEATURES):
+        features = tuple(features)
+        unknown = set(features) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"Unknown features {unknown}, use any of {FEATURES}")
+        self.levels = levels
+        self.imbalance_levels = tuple(sorted(d for d in imbalance_levels if 0 < d <= levels))
+        self.features = features
+        self._vamp = "vamp" in features
+        self._imbalance = "imbalance" in features
+        self._microprice = "microprice" in features
+        self._depth = "weighted_depth" in features
+        self._slope = "slope" in features
+        # level weights for weighted depth: 1, (n-1)/n, ..., 1/n
+        self._weights = [(levels - i) / levels for i in range(levels)]
+        self.values = {}
+
+    def update(self, bids, asks) -> Optional[dict]:
+        """bids/asks: top levels as [[price, volume], ...] best first.
+        None when a side is empty, the features need both"""
+        if not bids or not asks:
+            return None
+        values = self.values
+        best_bid = float(bids[0][0])
+        best_ask = float(asks[0][0])
+        q_b = float(bids[0][1])
+        q_a = float(asks[0][1])
+        mid = (best_bid + best_ask) / 2
+        values["mid_price"] = mid
+        values["spread"] = best_ask - best_bid
+        values["best_bid"] = best_bid
+        values["best_ask"] = best_ask
+        values["best_bid_size"] = q_b
+        values["best_ask_size"] = q_a
+        if self._microprice:
+            values["microprice"] = (best_ask * q_b + best_bid * q_a) / (q_a + q_b)
+
+        bid_stats = self._side(bids, mid)
+        ask_stats = self._side(asks, mid)
+
+        if self._vamp:
+            values["vamp"] = (bid_stats[0] + ask_stats[0]) / 2
+        if self._imbalance:
+            for level, q_b, q_a in zip(self.imbalance_levels, bid_stats[1], ask_stats[1]):
+                values[f"imbalance_{level}"] = q_b / (q_a + q_b)
+        if self._depth:
+            values["weighted_depth_bid"] = bid_stats[2]
+            values["weighted_depth_ask"] = ask_stats[2]
+        if self._slope:
+            values["slope_bid"] = bid_stats[3]
+            values["slope_ask"] = ask_stats[3]
+        return values
+
+    def _side(self, orders, mid: float):
+        """(vwap, cumulative volume at each imbalance depth, weighted depth, slope) of one side"""
+        weights = self._weights
+        depths = self.imbalance_levels
+        n_depths = len(depths)
+        cum = 0.0
+        notional = 0.0
+        weighted = 0.0
+        dist_cum = 0.0
+        dist_sq = 0.0
+        cum_at_depth = []
+        j = 0
+        i = 0
+        for i, (price, volume) in enumerate(orders[:self.levels]):
+            price = float(price)
+            volume = float(volume)
+            cum += volume
+            notional += price * volume
+            weighted += volume * weights[i]
+            distance = abs(price - mid)
+            dist_cum += distance * cum
+            dist_sq += distance * distance
+            if j < n_depths and i + 1 == depths[j]:
+                cum_at_depth.append(cum)
+                j += 1
+        # fewer levels than a depth: use the whole side
+        while j < n_depths:
+            cum_at_depth.append(cum)
+            j += 1
+        slope = dist_cum / dist_sq if dist_sq else math.nan
+        return notional / cum, cum_at_depth, weighted, slope
@@ -1,3 +1,6 @@
+import os
+import yaml
+import redis.asyncio as aioredis
 from dotenv import dotenv_values
 
 
@@ -5,4 +8,39 @@ def get_redis_host_and_port():
     config = dotenv_values(".env")
     host = config["REDIS_HOST"]
     port = config["REDIS_PORT"]
-    return dict(host=host, port=port)
\ No newline at end of file
+    return dict(host=host, port=port)
+
+
+def get_async_redis_pool(max_connections: int = 16) -> aioredis.ConnectionPool:
+    """asyncio connection pool, create one per process and share it"""
+    return aioredis.ConnectionPool(**get_redis_host_and_port(), max_connections=max_connections)
+
+
+def get_trading_rules(pair: str) -> dict:
+    """min order size, size and price quantum of a pair from symbols.yaml"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "symbols.yaml"), "r") as f:
+        all_trading_rules = yaml.safe_load(f)
+    return dict(
+        min_order_size = all_trading_rules['min_order_size'].get(pair),
+        order_size_quantum = all_trading_rules['order_size_quantum'].get(pair),
+        price_quantum = all_trading_rules['price_quantum'].get(pair),
+    )
+
+
+def get_wire_format() -> str:
+    """binary (default) or json, see common/codec.py"""
+    config = dotenv_values(".env")
+    return config.get("WIRE_FORMAT", "binary")
+
+def get_metrics_config(port_key: str) -> dict:
+    """METRICS = "on" records from the start (toggle at runtime, see common/metrics.py),
+    port_key e.g. METRICS_PORT_LOB serves the local endpoint"""
+    config = dotenv_values(".env")
+    port = config.get(port_key)
+    return dict(enabled=config.get("METRICS", "off") == "on", port=int(port) if port else None)
+
+def get_luno_urls() -> dict:
+    """websocket and REST base urls, point both at exchange_sim/luno_sim.py for load tests"""
+    config = dotenv_values(".env")
+    return dict(ws_url=config.get("LUNO_WS_URL") or "wss://ws.luno.com",
+                api_url=config.get("LUNO_API_URL") or "https://api.luno.com")
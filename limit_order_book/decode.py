@@ -0,0 +1,33 @@
+"""
+Stream message decoding
+
+- loads: orjson when it is installed (several times faster on Luno updates),
+  json otherwise
+- peek_sequence reads the sequence number straight from the raw text, Luno
+  sends it as the first key, so duplicates and gaps are handled before any
+  parsing work is spent on the message
+"""
+
+import json
+from typing import Optional
+
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    loads = json.loads
+    JSON_BACKEND = "json"
+
+SEQUENCE_KEY = '"sequence"'
+
+
+def peek_sequence(msg: str) -> Optional[int]:
+    """'{"sequence":"24352",...' -> 24352, None when the key is not at the start
+    of the message or the value is not a quoted integer (parse it instead)"""
+    start = msg.find(SEQUENCE_KEY, 0, 32)
+    if start < 0:
+        return None
+    start = msg.find('"', start + len(SEQUENCE_KEY)) + 1
+    value = msg[start:msg.find('"', start)]
+    return int(value) if value.isdigit() else None
@@ -0,0 +1,52 @@
+"""
+Recent deltas by sequence number
+
+Filled by the standby connection of an orderbook (a second websocket on the
+same stream). Luno does not resend missed messages, so when the main
+connection skips a sequence the book looks the missing deltas up here and
+carries on, and only falls back to a new snapshot when they are not there.
+"""
+
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class DeltaBuffer:
+    """
+    Args:
+        size (int): deltas kept, oldest are dropped first. Defaults to 10k.
+    """
+
+    def __init__(self, size: int = 10_000):
+        self.size = size
+        self._deltas = OrderedDict()  # sequence -> raw message, arrives in order
+        # stats
+        self.filled = 0
+        self.missed = 0
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    def add(self, sequence: int, msg: str):
+        deltas = self._deltas
+        if sequence in deltas:
+            return
+        deltas[sequence] = msg
+        if len(deltas) > self.size:
+            deltas.popitem(last=False)
+
+    def get_range(self, start: int, end: int) -> Optional[List[str]]:
+        """Messages start..end (inclusive) in order, None unless all of them are buffered"""
+        deltas = self._deltas
+        if end - start + 1 > len(deltas):
+            return None
+        messages = []
+        for sequence in range(start, end + 1):
+            msg = deltas.get(sequence)
+            if msg is None:
+                return None
+            messages.append(msg)
+        return messages
+
+    def clear(self):
+        self._deltas.clear()
@@ -0,0 +1,177 @@
+"""
+Multi-pair orderbook engine
+
+Runs many LunoOrderBooks on one event loop. They share one Redis connection
+pool, one batched publisher and one reconnection scheduler, so 20+ pairs cost
+a single interpreter instead of a process each. Pairs can also be sharded
+across worker processes, each running its own engine.
+
+python limit_order_book/engine.py -s XBTMYR ETHMYR SOLMYR --workers 2
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import sys
+from typing import List
+
+import redis.asyncio as aioredis
+import websockets
+import yaml
+from dotenv import dotenv_values
+from termcolor import cprint
+
+import config
+from orderbook import LunoOrderBook
+from publisher import BatchedPublisher
+from reconnect import ReconnectScheduler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.recorder import StreamRecorder
+from common.metrics import Metrics, MetricsExporter
+
+
+class OrderBookManager:
+    """
+    Args:
+        auth_config (dict): LUNO_KEY_ID / LUNO_KEY_SECRET
+        pairs (list[str]): pairs to stream
+        fixed_point (bool): see LunoOrderBook. Defaults to False.
+        max_redis_connections (int): size of the shared pool. Defaults to 16.
+        max_concurrent_connects (int): websocket handshakes in flight. Defaults to 5.
+        record_dir (str): record raw messages to <record_dir>/<pair>/. Defaults to None.
+        standby (bool): second connection per pair to fill sequence gaps, counts
+            against Luno's 50 sessions. Defaults to False.
+        metrics_port (int): local metrics endpoint, see common/metrics.py. Defaults to None.
+        shm (bool): also write ticks to shared memory, see common/tick_shm.py. Defaults to False.
+    """
+
+    def __init__(self,
+                 auth_config: dict,
+                 pairs: List[str],
+                 fixed_point: bool = False,
+                 max_redis_connections: int = 16,
+                 max_concurrent_connects: int = 5,
+                 record_dir: str = None,
+                 standby: bool = False,
+                 metrics_port: int = None,
+                 shm: bool = False):
+        self._redis = aioredis.Redis(connection_pool=config.get_async_redis_pool(max_redis_connections))
+        self.publisher = BatchedPublisher(self._redis, flush_interval_ms=5, max_batch=500)
+        self.scheduler = ReconnectScheduler(min_interval_s=10, max_concurrent=max_concurrent_connects)
+        # one set of stage histograms for every pair of this process
+        metrics_config = config.get_metrics_config("METRICS_PORT_LOB")
+        self.metrics = Metrics(f"lob-{os.getpid()}", enabled=metrics_config["enabled"])
+        for name in ("published", "conflated", "dropped", "batches"):
+            self.metrics.set_gauge(f"publisher.{name}", lambda name=name: getattr(self.publisher, name))
+        self.metrics.set_gauge("reconnects", lambda: self.scheduler.reconnects)
+        self.exporter = MetricsExporter(self.metrics, self._redis, interval_s=10,
+                                        port=metrics_port if metrics_port is not None else metrics_config["port"])
+        self.recorders = {
+            pair.upper(): StreamRecorder(os.path.join(record_dir, pair.upper()), pair.upper())
+            for pair in pairs
+        } if record_dir else {}
+        self.books = {
+            pair.upper(): LunoOrderBook(auth_config,
+                                        pair,
+                                        fixed_point=fixed_point,
+                                        redis_client=self._redis,
+                                        publisher=self.publisher,
+                                        scheduler=self.scheduler,
+                                        recorder=self.recorders.get(pair.upper()),
+                                        standby=standby,
+                                        metrics=self.metrics,
+                                        shm=shm)
+            for pair in pairs
+        }
+
+    async def run(self):
+        self.publisher.start()
+        exporter = asyncio.create_task(self.exporter.run())
+        try:
+            await asyncio.gather(*(self._supervise(book) for book in self.books.values()))
+        finally:
+            exporter.cancel()
+            await self.publisher.stop()
+            for recorder in self.recorders.values():
+                recorder.close()
+
+    async def _supervise(self, book: LunoOrderBook):
+        """Keep one book running, a crash only restarts that pair"""
+        while True:
+            try:
+                await book.run()
+            except asyncio.CancelledError:
+                raise
+            except (OSError, websockets.WebSocketException) as e:
+                # failed (re)connect, the scheduler spaces out the next attempt
+                cprint(f"{book.pair}: {e!r}, retrying", "red")
+                book.set_status(False, f"connection failed: {e!r}")
+            except Exception as e:
+                cprint(f"{book.pair} stopped: {e!r}, restarting", "red")
+                book.set_status(False, f"stopped: {e!r}")
+                book.ws = None
+
+
+def shard(pairs: List[str], workers: int) -> List[List[str]]:
+    """Round robin pairs over workers"""
+    workers = max(1, min(workers, len(pairs)))
+    return [pairs[i::workers] for i in range(workers)]
+
+
+def _run_shard(pairs: List[str],
+               fixed_point: bool,
+               record_dir: str = None,
+               standby: bool = False,
+               metrics_port: int = None,
+               shm: bool = False):
+    auth_config = dotenv_values(".env")
+    asyncio.run(OrderBookManager(auth_config, pairs, fixed_point=fixed_point, record_dir=record_dir,
+                                 standby=standby, metrics_port=metrics_port, shm=shm).run())
+
+
+def run_sharded(pairs: List[str],
+                workers: int = 1,
+                fixed_point: bool = False,
+                record_dir: str = None,
+                standby: bool = False,
+                shm: bool = False):
+    shards = shard(pairs, workers)
+    if len(shards) == 1:
+        return _run_shard(shards[0], fixed_point, record_dir, standby, shm=shm)
+
+    # one metrics endpoint per worker, METRICS_PORT_LOB + worker index
+    base_port = config.get_metrics_config("METRICS_PORT_LOB")["port"]
+    processes = [mp.Process(target=_run_shard,
+                            args=(s, fixed_point, record_dir, standby, base_port + i if base_port else None, shm),
+                            name=f"lob-{i}")
+                 for i, s in enumerate(shards)]
+    for p, pairs_in_shard in zip(processes, shards):
+        p.start()
+        cprint(f"{p.name}: {', '.join(pairs_in_shard)}", "blue")
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    # python limit_order_book/engine.py -s XBTMYR ETHMYR --workers 2
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--symbols", type=str, nargs="+", help="Symbols, defaults to all supported")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--fixed-point", action="store_true", help="Store prices/volumes as scaled integers")
+    parser.add_argument("--record", type=str, help="Directory to record raw messages to, one subdirectory per pair")
+    parser.add_argument("--standby", action="store_true", help="Second connection per pair to fill sequence gaps")
+    parser.add_argument("--shm", action="store_true", help="Also write ticks to shared memory for same-host strategies")
+    args = parser.parse_args()
+
+    with open('./limit_order_book/symbols.yaml', 'r') as f:
+        VALID_SYMBOLS = yaml.safe_load(f)['Supported']
+
+    symbols = args.symbols or VALID_SYMBOLS
+    for symbol in symbols:
+        if symbol not in VALID_SYMBOLS:
+            raise ValueError(f"Symbol {symbol} not supported")
+
+    run_sharded(symbols, workers=args.workers, fixed_point=args.fixed_point, record_dir=args.record,
+                standby=args.standby, shm=args.shm)
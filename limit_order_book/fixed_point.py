@@ -0,0 +1,73 @@
+"""
+Number codecs for the orderbook hot path
+
+DecimalCodec keeps the original behaviour (Decimal everywhere).
+FixedPoint stores prices / volumes as integers scaled by the pair's
+price_quantum / order_size_quantum from symbols.yaml, e.g. XBTMYR volumes in
+units of 0.000001. Equality stays exact (remaining volume == 0 after a fill)
+and Decimal / str only show up at the edges: parse on the way in, to_float /
+to_str on the way out.
+"""
+
+from decimal import Decimal
+
+
+class DecimalCodec:
+    scale = 1
+
+    @staticmethod
+    def parse(value: str) -> Decimal:
+        return Decimal(value)
+
+    @staticmethod
+    def to_float(value) -> float:
+        return float(value)
+
+    @staticmethod
+    def to_decimal(value) -> Decimal:
+        return value
+
+    @staticmethod
+    def to_str(value) -> str:
+        return str(value)
+
+
+class FixedPoint:
+    """Integer representation with `quantum` as the smallest unit
+
+    Args:
+        quantum (float | str): price or size quantum, e.g. 0.0001
+    """
+
+    def __init__(self, quantum):
+        self.quantum = Decimal(str(quantum)).normalize()
+        self.decimals = max(0, -self.quantum.as_tuple().exponent)
+        self.scale = 10**self.decimals
+        self._decimal_scale = Decimal(self.scale)
+
+    def parse(self, value: str) -> int:
+        """'123.4500' -> 1234500 for 4 decimals, without going through Decimal"""
+        if "e" in value or "E" in value:
+            return self.from_decimal(Decimal(value))
+        whole, _, frac = value.partition(".")
+        decimals = self.decimals
+        if len(frac) > decimals:
+            if frac[decimals:].strip("0"):
+                raise ValueError(f"{value} is finer than the quantum {self.quantum}")
+            frac = frac[:decimals]
+        return int(whole + frac.ljust(decimals, "0"))
+
+    def from_decimal(self, value: Decimal) -> int:
+        scaled = value * self._decimal_scale
+        if scaled != scaled.to_integral_value():
+            raise ValueError(f"{value} is finer than the quantum {self.quantum}")
+        return int(scaled)
+
+    def to_float(self, value: int) -> float:
+        return value / self.scale
+
+    def to_decimal(self, value: int) -> Decimal:
+        return Decimal(value) / self._decimal_scale
+
+    def to_str(self, value: int) -> str:
+        return str(self.to_decimal(value))
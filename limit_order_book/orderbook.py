@@ -9,12 +9,14 @@ https://github.com/PacktPublishing/Learn-Algorithmic-Trading/blob/master/Chapter
 https://www.luno.com/en/developers/api#tag/Streaming-API
 """
 
+import os
+import sys
 import websockets
 import asyncio
 import json
 import time
 import yaml
-import redis
+import redis.asyncio as aioredis
 import config
 import argparse
 import pandas as pd
@@ -23,154 +25,418 @@ from dotenv import dotenv_values
 from decimal import Decimal
 from termcolor import cprint
 from collections import defaultdict
-from scipy.optimize import curve_fit
-from typing import Tuple
-
-class BackOffException(Exception):
-    ...
+from typing import Callable, Optional, Tuple
+from price_levels import PriceLevelBook
+from volatility import VolatilityEstimator
+from trade_intensity import TradeIntensityEstimator
+from trade_buffer import TradeBuffer
+from fixed_point import DecimalCodec, FixedPoint
+from analytics import BookAnalytics
+from publisher import BatchedPublisher
+from reconnect import ReconnectScheduler
+from delta_buffer import DeltaBuffer
+from decode import loads, peek_sequence
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import codec
+from common.recorder import StreamRecorder
+from common.metrics import Metrics, MetricsExporter
+from common.tick_shm import TickWriter
 
 class LunoOrderBook:
-    def __init__(self, auth_config: dict, pair: str):
-        
+    def __init__(self, 
+                 auth_config: dict, 
+                 pair: str, 
+                 fixed_point: bool = False, 
+                 redis_client: aioredis.Redis = None,
+                 publisher: BatchedPublisher = None,
+                 scheduler: ReconnectScheduler = None,
+                 clock: Callable[[], float] = None,
+                 recorder: StreamRecorder = None,
+                 standby: bool = False,
+                 metrics: Metrics = None,
+                 ws_url: str = None,
+                 shm: bool = False):
+        """redis_client, publisher and scheduler can be shared by many books, see engine.py.
+        clock returns the time in seconds (time.time by default), a replay passes
+        the recorded message time instead. recorder keeps every raw message.
+        standby opens a second connection whose deltas fill sequence gaps.
+        metrics times each stage of the message loop (off unless enabled).
+        ws_url overrides LUNO_WS_URL, e.g. a local exchange_sim/luno_sim.py.
+        shm also writes every tick to shared memory for strategies on the same host."""
+
         self.pair = pair.upper()
         self.auth = {
             "api_key_id": auth_config["LUNO_KEY_ID"],
             "api_key_secret": auth_config["LUNO_KEY_SECRET"],
         }
-        self._redis = redis.Redis(**config.get_redis_host_and_port())
+        self.clock = clock or time.time
+        self.recorder = recorder
+        if redis_client is None and publisher is None:
+            redis_client = aioredis.Redis(connection_pool=config.get_async_redis_pool())
+        self._redis = redis_client
+        # events are batched into pipelines, LOB:: snapshots are latest-wins
+        if publisher is None:
+            publisher = BatchedPublisher(self._redis, flush_interval_ms=5, max_batch=500)
+        self.publisher = publisher
+        # avoid rate limiting: spaces out (re)connection attempts
+        if scheduler is None:
+            scheduler = ReconnectScheduler(min_interval_s=10)
+        self.scheduler = scheduler
+        self.wire_format = config.get_wire_format()
+        self.trading_rules = config.get_trading_rules(self.pair)
+        # fixed_point: book holds prices/volumes as integers in units of the
+        # pair's quanta, converted to float only for the top levels and publishing
+        self.fixed_point = fixed_point
+        if fixed_point:
+            missing = [k for k in ('price_quantum', 'order_size_quantum') if self.trading_rules[k] is None]
+            if missing:
+                raise ValueError(f"{self.pair} has no {' / '.join(missing)} in symbols.yaml, run it without fixed_point")
+            self.price_codec = FixedPoint(self.trading_rules['price_quantum'])
+            self.volume_codec = FixedPoint(self.trading_rules['order_size_quantum'])
+        else:
+            self.price_codec = self.volume_codec = DecimalCodec()
 
         # buffer
-        self.bid_trades = list()
-        self.ask_trades = list()
         self.trade_buffer_duration = 20 # mins
         self.trade_buffer_ready = False
+        distance_bucket = float(self.trading_rules['price_quantum'] or 1)
+        self.bid_trades = TradeBuffer(self.trade_buffer_duration*60*1000, distance_bucket)
+        self.ask_trades = TradeBuffer(self.trade_buffer_duration*60*1000, distance_bucket)
+        # alpha/kappa refit at most once a second and only when trades changed
+        self.intensity_estimator = TradeIntensityEstimator(
+            bucket_size=distance_bucket,
+            window_ms=self.trade_buffer_duration*60*1000,
+            refit_interval_ms=1000,
+            method="curve_fit",
+            buffers=[self.ask_trades, self.bid_trades],
+        )
         # instantaneous volatility ~0.05% 
         self.vol_buffer_size = 200 # ticks
         self.vol_buffer_ready = False
-        self.vol_buffer = list()
+        # close_to_close / parkinson / ewma, set window_ms for a wall-clock window
+        self.vol_estimator = VolatilityEstimator(method="close_to_close", window=self.vol_buffer_size)
         self.vol = np.nan
         self.alpha = np.nan
         self.kappa = np.nan
 
         self.ws = None
         self.sequence = None
-        self.bids = {}
-        self.asks = {}
-        self.url = f"wss://ws.luno.com/api/1/stream/{self.pair}"
-        self.time_last_connection_attempt = None
+        self.levels = PriceLevelBook(clock=self.clock) # price levels + order_id index for both sides
+        self.top_levels = 10 # levels kept in bid_sorted / ask_sorted
+        # features and depths computed on every update, see analytics.FEATURES
+        self.analytics = BookAnalytics(levels=self.top_levels, imbalance_levels=(1, 5, 10))
+        self.url = f"{ws_url or config.get_luno_urls()['ws_url']}/api/1/stream/{self.pair}"
         self.bid_sorted = None
         self.ask_sorted = None
         self.vamp = 0
         self.mid_price = 0
         self.order_imbalance = 0
-        self.start_time = int(time.time()*1000)
+        self.microprice = 0
+        self.start_time = int(self.clock()*1000)
+        self.log_trades = True # print trades as they happen
+        # same-host strategies read ticks lock-free from here instead of Redis, see common/tick_shm.py
+        self.shm = TickWriter(self.pair, levels=self.top_levels) if shm else None
+
+        # book status on BOOK_STATUS::<pair>: valid once a snapshot is loaded,
+        # invalid from a sequence gap / disconnect until the resync, strategies stop quoting
+        self.valid = False
+        self.standby = standby
+        self.delta_buffer = DeltaBuffer(size=10_000)
+        self.gap_wait_ms = 200 # how long a gap waits for the standby connection to catch up
+        # with a recorder, the book is also written as a snapshot message every
+        # checkpoint_interval messages / checkpoint_interval_s so replays can start anywhere
+        self.checkpoint_interval = 5000
+        self.checkpoint_interval_s = 60
+        self._last_checkpoint_seq = None
+        self._last_checkpoint_ts = None
+        # stats
+        self.gaps = 0
+        self.gaps_filled = 0
+        self.resyncs = 0
+        self.resync_ms = 0 # last invalid -> valid time
+        self.one_sided_ticks = 0 # updates that left a side empty, no tick published
+        # per stage latency: parse, apply, top_levels, intensity, analytics, volatility, publish, message
+        self.metrics = metrics or Metrics(f"lob-{self.pair}")
+        for name in ("gaps", "gaps_filled", "resyncs", "resync_ms", "one_sided_ticks"):
+            self.metrics.set_gauge(f"{self.pair}.{name}", lambda name=name: getattr(self, name))
         
 
-    def check_backoff(self):
-        """avoid rate limiting"""
-        if self.time_last_connection_attempt is not None:
-            delta = time.time() - self.time_last_connection_attempt
-            if delta < 10:
-                raise BackOffException()
-
     async def connect(self):
         if self.ws is not None:
             await self.ws.close()
-        try:
-            self.check_backoff()
-        except BackOffException:
-            await asyncio.sleep(10)
-        self.time_last_connection_attempt = time.time()
 
-        self.ws = await websockets.connect(self.url, ping_interval=1)
+        async with self.scheduler.attempt(self.pair):
+            self.ws = await websockets.connect(self.url, ping_interval=1)
+
+            await self.ws.send(json.dumps(self.auth))
+
+            msg = await self.ws.recv()
+        self.load_snapshot(loads(msg))
+        self._last_checkpoint_seq = self.sequence
+        self._last_checkpoint_ts = self.clock()
+        if self.recorder is not None:
+            self.recorder.record(msg, self.sequence)
+        cprint("Orderbook received", "blue")
+        self.set_status(True, "snapshot")
 
-        await self.ws.send(json.dumps(self.auth))
+    async def resync(self, reason: str):
+        """Mark the book invalid and reload it from a new snapshot"""
+        start = self.clock()
+        self.set_status(False, reason)
+        await self.connect()
+        self.resyncs += 1
+        self.resync_ms = (self.clock() - start)*1000
+        cprint(f"{self.pair} resynced in {self.resync_ms:.0f}ms", "green")
+
+    def set_status(self, valid: bool, reason: str = ""):
+        """Publish a BOOK_STATUS:: message when the book becomes valid or invalid"""
+        if valid == self.valid:
+            return
+        self.valid = valid
+        if self.shm is not None:
+            self.shm.set_valid(valid)
+        if not valid:
+            cprint(f"{self.pair} book invalid: {reason}", "red")
+        msg = {
+            'ts': self.clock()*1000,
+            'sequence': self.sequence or 0,
+            'valid': valid,
+            'msg_type': "BOOK_STATUS",
+            'pair': self.pair,
+            'reason': reason,
+        }
+        self.publisher.publish(f"BOOK_STATUS::{self.pair}", codec.encode("BOOK_STATUS", msg, self.wire_format))
 
-        msg = await self.ws.recv()
-        initial_msg_data = json.loads(msg)
+    def load_snapshot(self, initial_msg_data: dict):
+        """Rebuild the book from a full order book message"""
         self.sequence = int(initial_msg_data["sequence"])
 
+        try:
+            self._load_levels(initial_msg_data)
+        except ValueError as e:
+            if not self.fixed_point:
+                raise
+            self.use_decimal(str(e))
+            self._load_levels(initial_msg_data)
+        # handle_trade reads the touch, the first delta can come before the next build_tick
+        self.bid_sorted = self.read_top(self.levels.bids)
+        self.ask_sorted = self.read_top(self.levels.asks)
+
+    def _load_levels(self, data: dict):
         ## CREATE BID ASK TREES HERE
-        self.asks = {
-            x["id"]: [Decimal(x["price"]), Decimal(x["volume"])]
-            for x in initial_msg_data["asks"]
-        }
-        self.bids = {
-            x["id"]: [Decimal(x["price"]), Decimal(x["volume"])]
-            for x in initial_msg_data["bids"]
+        self.levels.clear()
+        for x in data["asks"]:
+            self.levels.add_order(x["id"], "ASK", self.price_codec.parse(x["price"]), self.volume_codec.parse(x["volume"]))
+        for x in data["bids"]:
+            self.levels.add_order(x["id"], "BID", self.price_codec.parse(x["price"]), self.volume_codec.parse(x["volume"]))
+
+    def use_decimal(self, reason: str):
+        """Leave fixed point for good, e.g. the pair's tick size is finer than
+        symbols.yaml says. The levels have to be reloaded afterwards."""
+        cprint(f"{self.pair} fixed point off ({reason}), fix its quanta in symbols.yaml", "red")
+        self.fixed_point = False
+        self.price_codec = self.volume_codec = DecimalCodec()
+
+    def snapshot_message(self, ts: int) -> dict:
+        """The book as a Luno order book message, load_snapshot() reads it back"""
+        def side(name):
+            return [{
+                "id": o.order_id,
+                "price": self.price_codec.to_str(o.price),
+                "volume": self.volume_codec.to_str(o.volume),
+            } for o in self.levels.resting(name)]
+        return {
+            "sequence": str(self.sequence),
+            "asks": side("ASK"),
+            "bids": side("BID"),
+            "status": "ACTIVE",
+            "timestamp": int(ts),
         }
 
-        cprint("Orderbook received", "blue")
+    def checkpoint(self):
+        """Record the book as a snapshot message, see checkpoint_interval"""
+        ts = int(self.clock()*1000)
+        self.recorder.record(json.dumps(self.snapshot_message(ts)), self.sequence, ts)
+        self._last_checkpoint_seq = self.sequence
+        self._last_checkpoint_ts = ts / 1000
 
     async def run(self):
         """first msg is always a full order book"""
         await self.connect()
+        self.publisher.start()
+        standby = asyncio.create_task(self.run_standby()) if self.standby else None
+        flusher = asyncio.create_task(self.recorder.run()) if self.recorder is not None else None
         cprint("Streaming starts","green")
 
         # async for msg in self.ws:
+        try:
+            while True:
+                try:
+                    msg = await self.ws.recv()
+                    if msg == '""':
+                        continue
+                    start = self.metrics.now()
+                    await self.handle_message(msg)
+                    if not self.valid:
+                        continue
+
+                    processed_msg = self.build_tick(self.clock()*1000)
+                    if processed_msg is None:
+                        continue
+                    t = self.metrics.now()
+                    if self.shm is not None:
+                        self.shm.write(processed_msg, self.bid_sorted, self.ask_sorted, self.sequence)
+                        t = self.metrics.lap("shm", t)
+                    self.publisher.publish_latest(f"LOB::{self.pair}", codec.encode("LOB", processed_msg, self.wire_format))
+                    self.metrics.lap("publish", t)
+                    self.metrics.lap("message", start)
+                except websockets.ConnectionClosedError as e:
+                    cprint("Reconnecting...", "green")
+                    await self.resync(f"disconnected: {e}")
+                    continue
+        finally:
+            for task in (standby, flusher):
+                if task is not None:
+                    task.cancel()
+
+    async def run_standby(self):
+        """Second connection to the same stream, it only keeps recent deltas
+        (sequence numbers are the same on every connection) for fill_gap()"""
+        key = f"{self.pair}:standby"
         while True:
             try:
-                msg = await self.ws.recv()
-                if msg == '""':
-                    continue
-                await self.handle_message(msg)
-                
-
-                ts = time.time()*1000
-                #print(self.print_aggregated_lob())
-                self.bid_sorted = self.consolidate(self.bids.values(), reverse=True)
-                self.ask_sorted = self.consolidate(self.asks.values())
-
-                if ts > self.start_time + self.trade_buffer_duration*60*1000:
-                    if self.ask_trades and self.bid_trades:
-                        # do not update if there are no trades in the buffer
-                        self.trade_buffer_ready = True
-                        self.alpha, self.kappa = self.trading_intensity()
-                
-                # calculate prices
-                self.calc_vamp(levels = 10)
-                self.calc_midprice()
-                self.calc_spread()
-                self.calc_order_imbalance(levels = 10)
-                # use your own definition of fair price for volatility calculation
-                # VAMP is used here
-                self.vol_buffer.append(self.vamp)
-                if len(self.vol_buffer) > self.vol_buffer_size:
-                    self.vol_buffer.pop(0)
-                    self.volatility_buffer_ready = True
-                    self.vol = np.sqrt(np.sum(np.square(np.diff(np.array(self.vol_buffer))/np.array(self.vol_buffer)[:-1]*100))/self.vol_buffer_size)
-                
-                processed_msg = dict(
-                    ts=ts,
-                    mid_price=str(self.mid_price),
-                    spread=str(self.spread),
-                    best_bid=str(self.bid_sorted[0][0]),
-                    best_ask=str(self.ask_sorted[0][0]),
-                    best_bid_size=str(self.bid_sorted[0][1]),
-                    best_ask_size=str(self.ask_sorted[0][1]),
-                    vamp=str(self.vamp),
-                    order_imbalance=str(self.order_imbalance),
-                    buffer_ready = str(self.trade_buffer_ready),
-                    volatility = str(self.vol), # in pct
-                    alpha = str(self.alpha),
-                    kappa = str(self.kappa),
-                )
-                self._redis.publish(f"LOB::{self.pair}", json.dumps(processed_msg))
-            except websockets.ConnectionClosedError as e:
-                cprint(e, "red")
-                await self.connect()
-                cprint("Reconnecting...", "green")
-                continue
+                async with self.scheduler.attempt(key):
+                    ws = await websockets.connect(self.url, ping_interval=1)
+                    await ws.send(json.dumps(self.auth))
+                    await ws.recv() # snapshot, the book comes from the main connection
+                try:
+                    async for msg in ws:
+                        if msg == '""':
+                            continue
+                        # kept raw, only the deltas fill_gap() needs get parsed
+                        sequence = peek_sequence(msg)
+                        if sequence is None:
+                            sequence = int(loads(msg)["sequence"])
+                        self.delta_buffer.add(sequence, msg)
+                finally:
+                    await ws.close()
+            except asyncio.CancelledError:
+                raise
+            except (OSError, websockets.WebSocketException) as e:
+                cprint(f"{self.pair} standby: {e!r}", "red")
+
+    def build_tick(self, ts: float) -> Optional[dict]:
+        """Update the estimators and return the LOB:: message for the current book,
+        None while one side is empty (no mid price, the last tick stands)"""
+        #print(self.print_aggregated_lob())
+        t = self.metrics.now()
+        self.bid_sorted = self.read_top(self.levels.bids)
+        self.ask_sorted = self.read_top(self.levels.asks)
+        t = self.metrics.lap("top_levels", t)
+        if not self.bid_sorted or not self.ask_sorted:
+            self.one_sided_ticks += 1
+            return None
+
+        if ts > self.start_time + self.trade_buffer_duration*60*1000:
+            if self.ask_trades and self.bid_trades:
+                # do not update if there are no trades in the buffer
+                self.trade_buffer_ready = True
+                self.alpha, self.kappa = self.trading_intensity()
+                t = self.metrics.lap("intensity", t)
+        
+        # calculate prices
+        features = self.calc_analytics()
+        t = self.metrics.lap("analytics", t)
+        # use your own definition of fair price for volatility calculation
+        # VAMP is used here
+        self.vol = self.vol_estimator.update(
+            price=float(self.vamp),
+            bid=float(self.bid_sorted[0][0]),
+            ask=float(self.ask_sorted[0][0]),
+            ts=int(ts),
+        )
+        self.vol_buffer_ready = self.vol_estimator.ready
+        self.metrics.lap("volatility", t)
+        
+        # best bid/ask, sizes and extra book features (microprice,
+        # multi-depth imbalance, depth, slope) come from the analytics
+        return dict(
+            features,
+            ts=ts,
+            order_imbalance=self.order_imbalance,
+            buffer_ready = self.trade_buffer_ready,
+            volatility = self.vol, # in pct
+            alpha = self.alpha,
+            kappa = self.kappa,
+        )
 
     async def handle_message(self, msg):
         """Call individual handlers depending on order type"""
-        data = json.loads(msg)
-        new_sequence = int(data["sequence"])
+        t = self.metrics.now()
+        # sequence first: duplicates and gaps cost no parsing
+        data = None
+        new_sequence = peek_sequence(msg)
+        if new_sequence is None:
+            data = loads(msg)
+            new_sequence = int(data["sequence"])
+        self.metrics.incr("messages")
+        if self.recorder is not None:
+            self.recorder.record(msg, new_sequence)
+        if new_sequence <= self.sequence:
+            return # already applied
         if new_sequence != self.sequence + 1:
-            return await self.connect()
+            self.gaps += 1
+            if not await self.fill_gap(new_sequence - 1):
+                return await self.resync(f"sequence gap {self.sequence} -> {new_sequence}")
+            t = self.metrics.now()
+        if data is None:
+            data = loads(msg)
+        t = self.metrics.lap("parse", t)
 
         self.sequence = new_sequence
-        self.process_message(data)
+        try:
+            self.process_message(data)
+        except ValueError as e:
+            # a price finer than the fixed point quantum, a resync alone would hit it again
+            if not self.fixed_point:
+                raise
+            self.use_decimal(str(e))
+            return await self.resync(f"unreadable update {new_sequence}: {e}")
+        self.metrics.lap("apply", t)
+        if (self.recorder is not None
+                and (self.sequence - self._last_checkpoint_seq >= self.checkpoint_interval
+                     or self.clock() - self._last_checkpoint_ts >= self.checkpoint_interval_s)):
+            self.checkpoint()
+
+    async def fill_gap(self, end: int) -> bool:
+        """Apply the missing deltas up to `end` from the standby connection,
+        waiting up to gap_wait_ms for it to receive them"""
+        if not self.standby:
+            return False
+        deadline = time.monotonic() + self.gap_wait_ms / 1000
+        while True:
+            missing = self.delta_buffer.get_range(self.sequence + 1, end)
+            if missing is not None:
+                break
+            if time.monotonic() >= deadline:
+                self.delta_buffer.missed += 1
+                return False
+            await asyncio.sleep(0.005)
+        for sequence, msg in zip(range(self.sequence + 1, end + 1), missing):
+            if self.recorder is not None:
+                self.recorder.record(msg, sequence)
+            self.sequence = sequence
+            try:
+                self.process_message(loads(msg))
+            except ValueError as e:
+                if not self.fixed_point:
+                    raise
+                self.use_decimal(str(e))
+                return False  # caller resyncs
+        self.delta_buffer.filled += 1
+        self.gaps_filled += 1
+        return True
 
     def process_message(self, data):
         if data["delete_update"]:
@@ -182,112 +448,119 @@ class LunoOrderBook:
 
     def handle_create(self, data):
         order = data["create_update"]
-        price = Decimal(order["price"])
-        volume = Decimal(order["volume"])
+        price = self.price_codec.parse(order["price"])
+        volume = self.volume_codec.parse(order["volume"])
         key = order["order_id"]
-        book = self.bids if order["type"] == "BID" else self.asks
-        book[key] = [price, volume]
-        ts = int(time.time()*1000)
+        ts = int(self.clock()*1000)
+        self.levels.add_order(key, order["type"], price, volume, ts)
         msg = {
             'ts': ts, 
-            'price': float(price),
-            'volume': float(volume),
+            'price': self.price_codec.to_float(price),
+            'volume': self.volume_codec.to_float(volume),
             'order_id': str(key),
             }
-        self._redis.publish(f"ORDER::{self.pair}", json.dumps(msg))
+        self.publisher.publish(f"ORDER::{self.pair}", json.dumps(msg))
 
     def handle_delete(self, data):
-        """delete_update only has an order id key, so still have to traverse entire dict on both side to find"""
+        """delete_update only has an order id key, side and price come from the order index"""
         order_id = data["delete_update"]["order_id"]
-        ts = int(time.time()*1000)
+        ts = int(self.clock()*1000)
         msg = {
             'ts': ts, 
             'order_id': str(order_id),
             }
-        self._redis.publish(f"CANCEL::{self.pair}", json.dumps(msg))
-        try:
-            del self.bids[order_id]
-        except KeyError:
-            pass
-        try:
-            del self.asks[order_id]
-        except KeyError:
-            pass
-        return
+        self.publisher.publish(f"CANCEL::{self.pair}", json.dumps(msg))
+        self.levels.remove_order(order_id)
 
     def handle_trade(self, data):
         """
         list[dict]
         keys: ["base", "counter"," maker_order_id","taker_order_id","order_id"]
+        the updates are read only, the price (counter / base) is only needed as a float
         """
-        ts = int(time.time()*1000)
+        ts = int(self.clock()*1000)
+        mid_price = float(self.mid_price)
+        channel = f"TRADES::{self.pair}"
         for update in data["trade_updates"]:
-            update["price"] = Decimal(update["counter"]) / Decimal(update["base"])
-            maker_order_id = update["maker_order_id"]
-            if maker_order_id in self.bids:
+            maker_order = self.levels.get(update["maker_order_id"])
+            if maker_order is None:
+                continue
+            base = update["base"]
+            self.update_existing_order(maker_order, self.volume_codec.parse(base))
+            amount = float(base)
+            price = float(update["counter"]) / amount
+            distance = abs(price - mid_price)
+            if maker_order.side == "BID":
                 # sell orders
-                self.update_existing_order(key="bids", update=update)
                 msg = {
                     'ts': ts, 
-                    'price': float(update['price']), 
-                    'amount': float(update['base']),
-                    'mid_price': float(self.mid_price),
-                    'distance': abs(float(update['price']- self.mid_price))
+                    'price': price, 
+                    'amount': amount,
+                    'mid_price': mid_price,
+                    'distance': distance,
+                    'bidask': "ask",
                     }
-                self._redis.publish(f"TRADES::{self.pair}", json.dumps(dict(**msg, bidask="ask")))
-            
-                self.ask_trades.append(msg)
-                if ts - self.trade_buffer_duration*60*1000>self.ask_trades[0]['ts']:
-                    self.ask_trades.pop(0)
-                cprint(update, "red")
-            elif maker_order_id in self.asks:
+                trades, color = self.ask_trades, "red"
+            else:
                 # buy orders
-                self.update_existing_order(key="asks", update=update)
                 msg = {
                     'ts': ts, 
-                    'price': float(update['price']), 
-                    'amount': float(update['base']),
-                    'mid_price': float(self.mid_price),
-                    'best_bid': float(self.bid_sorted[0][0]), # needed for wash trades detection
-                    'best_ask': float(self.ask_sorted[0][0]), # needed for wash trades detection
-                    'distance': abs(float(update['price'] - self.mid_price))
+                    'price': price, 
+                    'amount': amount,
+                    'mid_price': mid_price,
+                    'best_bid': float(self.bid_sorted[0][0]) if self.bid_sorted else np.nan, # needed for wash trades detection
+                    'best_ask': float(self.ask_sorted[0][0]) if self.ask_sorted else np.nan, # needed for wash trades detection
+                    'distance': distance,
+                    'bidask': "bid",
                     }
-                self._redis.publish(f"TRADES::{self.pair}", json.dumps(dict(**msg, bidask="bid")))
-                self.bid_trades.append(msg)
-
-                if ts - self.trade_buffer_duration*60*1000>self.bid_trades[0]['ts']:
-                    self.bid_trades.pop(0)
-                cprint(update, "green")
-
-    def update_existing_order(self, key:str, update:dict):
-        book = getattr(self, key)
-        order_id = update["maker_order_id"]
-        existing_order = book[order_id]
-        existing_volume = existing_order[1]
-        new_volume = existing_volume - Decimal(update["base"])
-        if new_volume == Decimal("0"):
-            del book[order_id]
-        else:
-            existing_order[1] -= Decimal(update["base"])
+                trades, color = self.bid_trades, "green"
+            self.publisher.publish(channel, codec.encode("TRADE", msg, self.wire_format))
+            trades.append(ts, price, amount, mid_price, distance)
+            trades.expire(ts)
+            if self.log_trades:
+                cprint(dict(update, price=price), color)
+
+    def update_existing_order(self, order, volume):
+        """Fill a resting maker order (volume in the book's units), removed from the book once fully filled"""
+        self.levels.fill_order(order, volume)
+
+    def read_top(self, side):
+        """Top levels of one side, in real units"""
+        top = side.top(self.top_levels)
+        if self.fixed_point:
+            price_scale = self.price_codec.scale
+            volume_scale = self.volume_codec.scale
+            return [[p / price_scale, v / volume_scale] for p, v in top]
+        return top
+
+    def queue_position(self, order_id: str):
+        """(volume ahead, orders ahead) of a resting order at its price level"""
+        return self.levels.queue_position(order_id)
+
+    def order_age_ms(self, order_id: str):
+        return self.levels.order_age_ms(order_id)
+
+    @staticmethod
+    def compute_cdf(trades: TradeBuffer) -> Tuple[np.ndarray, np.ndarray]:
+        """Volume traded at or beyond each distance from mid
+
+        Args:
+            trades (TradeBuffer): e.g. self.bid_trades, read through column views
 
-    def compute_cdf(self, trades):
-        raise NotImplementedError("This method is not implemented yet.")
+        Returns:
+            distances (sorted, unique) and the tail volume at each distance
+        """
+        if not trades:
+            return np.empty(0), np.empty(0)
+        distance = trades.column('distance')
+        amount = trades.column('amount')
+        unique_distance, inverse = np.unique(distance, return_inverse=True)
+        volume = np.bincount(inverse, weights=amount)
+        return unique_distance, np.cumsum(volume[::-1])[::-1]
     
     def trading_intensity(self) -> Tuple[float, float]:
-        """Return alpha and kappa"""
-        trades = pd.DataFrame(self.ask_trades + self.bid_trades)
-        sorted_trades = (trades.groupby('distance')
-                         .agg({'amount':'sum'})
-                         .reset_index()
-                         .sort_values('distance'))
-        params = curve_fit(lambda t, a,b: a*np.exp(-b*t), 
-                   sorted_trades['distance'].to_list(), 
-                   sorted_trades['amount'].to_list(),
-                   p0 = (0,0),
-                   method = "dogbox", 
-                   bounds = ([0,0], [np.inf, np.inf]))
-
-        return params[0][0], params[0][1]
+        """Return alpha and kappa from the streaming estimator"""
+        return self.intensity_estimator.estimate(int(self.clock()*1000))
 
     @staticmethod
     def consolidate(orders, reverse:bool=False):
@@ -310,6 +583,17 @@ class LunoOrderBook:
             }
         )
     
+    def calc_analytics(self) -> dict:
+        """All book features from one read of the top levels, see BookAnalytics"""
+        features = self.analytics.update(self.bid_sorted, self.ask_sorted)
+        self.mid_price = features["mid_price"]
+        self.spread = features["spread"]
+        self.vamp = features.get("vamp", self.mid_price)
+        self.microprice = features.get("microprice", self.mid_price)
+        deepest = max(self.analytics.imbalance_levels, default=None)
+        self.order_imbalance = features.get(f"imbalance_{deepest}", self.order_imbalance)
+        return features
+
     def calc_vamp(self, levels:int= 10):
         # BIDS
         bid_orders = self.bid_sorted[:levels]
@@ -328,7 +612,12 @@ class LunoOrderBook:
         self.spread = self.ask_sorted[0][0] - self.bid_sorted[0][0]
         
     def calc_microprice(self):
-        raise NotImplementedError("Microprice not implemented")
+        """Touch prices weighted by the opposite side's size
+        (P_a * Q_b + P_b * Q_a)/(Q_a + Q_b)
+        """
+        best_bid, q_b = self.bid_sorted[0]
+        best_ask, q_a = self.ask_sorted[0]
+        self.microprice = (best_ask * q_b + best_bid * q_a)/(q_a + q_b)
     
     def calc_order_imbalance(self, levels:int=10):
         """Order imbalance
@@ -350,6 +639,10 @@ if __name__ == "__main__":
     # python limit_order_book/orderbook.py -s XBTMYR
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--symbol",type = str, help="Symbol")
+    parser.add_argument("--fixed-point", action="store_true", help="Store prices/volumes as scaled integers")
+    parser.add_argument("--record", type=str, help="Directory to record raw messages to")
+    parser.add_argument("--standby", action="store_true", help="Second connection to fill sequence gaps")
+    parser.add_argument("--shm", action="store_true", help="Also write ticks to shared memory for same-host strategies")
     args = parser.parse_args()
 
     with open('./limit_order_book/symbols.yaml', 'r') as f:
@@ -360,6 +653,23 @@ if __name__ == "__main__":
     
     auth_config = dotenv_values(".env")
     
-    ob = LunoOrderBook(auth_config, args.symbol)
-    asyncio.run(ob.run())
+    recorder = StreamRecorder(os.path.join(args.record, args.symbol), args.symbol) if args.record else None
+    metrics_config = config.get_metrics_config("METRICS_PORT_LOB")
+    metrics = Metrics(f"lob-{args.symbol}", enabled=metrics_config["enabled"])
+    ob = LunoOrderBook(auth_config, args.symbol, fixed_point=args.fixed_point, recorder=recorder,
+                       standby=args.standby, metrics=metrics, shm=args.shm)
+
+    async def main():
+        exporter = MetricsExporter(metrics, ob._redis, port=metrics_config["port"])
+        task = asyncio.create_task(exporter.run())
+        try:
+            await ob.run()
+        finally:
+            task.cancel()
+
+    try:
+        asyncio.run(main())
+    finally:
+        if recorder is not None:
+            recorder.close()
     
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+Price level book
+
+Aggregated volume per price level, kept sorted as the stream comes in so the
+orderbook never has to re-consolidate every resting order on each tick.
+
+- prices are kept ascending in a SortedList, levels in a dict: a new or
+  emptied level is O(log L), best and top(n) read the ends without a search
+- bids read from the end of the list, asks from the start
+- one order_id -> Order index holding side, price, remaining volume and
+  creation time, so creates, deletes and fills are a single lookup
+- each level keeps its orders in arrival order (time priority), which gives
+  queue position for free
+"""
+
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+
+class Order:
+    __slots__ = ("order_id", "side", "price", "volume", "ts")
+
+    def __init__(self, order_id: str, side: str, price, volume, ts: int):
+        self.order_id = order_id
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.ts = ts  # ms, when the order was seen on the book
+
+    def __repr__(self) -> str:
+        return f"Order({self.order_id}, {self.side}, {self.price}, {self.volume})"
+
+
+class PriceLevel:
+    __slots__ = ("volume", "orders")
+
+    def __init__(self):
+        self.volume = 0
+        self.orders: Dict[str, Order] = {}  # insertion ordered = queue order
+
+
+class PriceLevels:
+    """One side of the book"""
+
+    def __init__(self, reverse: bool = False):
+        # reverse=True for bids: best level is the highest price
+        self.reverse = reverse
+        self._prices = SortedList()
+        self._levels: Dict[object, PriceLevel] = {}
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def __bool__(self) -> bool:
+        return bool(self._prices)
+
+    def add(self, order: Order):
+        level = self._levels.get(order.price)
+        if level is None:
+            self._prices.add(order.price)
+            level = self._levels[order.price] = PriceLevel()
+        level.volume += order.volume
+        level.orders[order.order_id] = order
+
+    def reduce(self, order: Order, volume):
+        """Partial fill of one order, it keeps its place in the queue"""
+        self._levels[order.price].volume -= volume
+
+    def remove(self, order: Order):
+        """Remove one order from its level, drop the level if empty"""
+        level = self._levels[order.price]
+        del level.orders[order.order_id]
+        if not level.orders:
+            del self._levels[order.price]
+            self._prices.remove(order.price)
+        else:
+            level.volume -= order.volume
+
+    def clear(self):
+        self._prices.clear()
+        self._levels.clear()
+
+    def best(self) -> Tuple:
+        """Best (price, volume), O(1)"""
+        price = self._prices[-1] if self.reverse else self._prices[0]
+        return price, self._levels[price].volume
+
+    def top(self, n: int) -> List[list]:
+        """Top n levels as [[price, volume], ...] from best to worst, O(n)"""
+        prices = self._prices[-n:][::-1] if self.reverse else self._prices[:n]
+        levels = self._levels
+        return [[p, levels[p].volume] for p in prices]
+
+    def volume_at(self, price):
+        level = self._levels.get(price)
+        return level.volume if level is not None else 0
+
+    def level(self, price) -> Optional[PriceLevel]:
+        return self._levels.get(price)
+
+
+class PriceLevelBook:
+    """Bid and ask price levels plus the order_id -> Order index
+
+    Args:
+        clock (Callable): time in seconds for order ages, the orderbook's clock
+            (recorded message time in a replay). Defaults to time.time.
+    """
+
+    def __init__(self, clock: Callable[[], float] = None):
+        self.clock = clock or time.time
+        self.bids = PriceLevels(reverse=True)
+        self.asks = PriceLevels()
+        self._orders: Dict[str, Order] = {}
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._orders
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def side(self, side: str) -> PriceLevels:
+        return self.bids if side == "BID" else self.asks
+
+    def get(self, order_id: str) -> Optional[Order]:
+        return self._orders.get(order_id)
+
+    def orders(self, side: str):
+        """[price, volume] of every resting order on one side, for consolidate()"""
+        return ([o.price, o.volume] for o in self._orders.values() if o.side == side)
+
+    def resting(self, side: str):
+        """Every resting Order of one side, in arrival order"""
+        return (o for o in self._orders.values() if o.side == side)
+
+    def add_order(self, order_id: str, side: str, price, volume, ts: Optional[int] = None) -> Order:
+        if order_id in self._orders:
+            # re-sent order id, treat as replace
+            self.remove_order(order_id)
+        if ts is None:
+            ts = int(self.clock()*1000)
+        order = Order(order_id, side, price, volume, ts)
+        self._orders[order_id] = order
+        self.side(side).add(order)
+        return order
+
+    def fill_order(self, order: Order, volume) -> bool:
+        """Reduce a resting order by a fill, return True if it is fully filled and removed"""
+        remaining = order.volume - volume
+        if remaining <= 0:
+            del self._orders[order.order_id]
+            self.side(order.side).remove(order)
+            return True
+        order.volume = remaining
+        self.side(order.side).reduce(order, volume)
+        return False
+
+    def remove_order(self, order_id: str) -> Optional[Order]:
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self.side(order.side).remove(order)
+        return order
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._orders.clear()
+
+    def queue_position(self, order_id: str) -> Optional[Tuple[object, int]]:
+        """(volume ahead, number of orders ahead) of an order at its price level"""
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+        volume_ahead = 0
+        orders_ahead = 0
+        for other in self.side(order.side).level(order.price).orders.values():
+            if other is order:
+                break
+            volume_ahead += other.volume
+            orders_ahead += 1
+        return volume_ahead, orders_ahead
+
+    def order_age_ms(self, order_id: str, now: Optional[int] = None) -> Optional[int]:
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+        if now is None:
+            now = int(self.clock()*1000)
+        return now - order.ts
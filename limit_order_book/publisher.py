@@ -0,0 +1,163 @@
+"""
+Batched Redis publisher
+
+publish() queues an event (ORDER::, CANCEL::, TRADES::), every event is sent.
+publish_latest() keeps only the newest payload per channel (LOB:: snapshots),
+older unsent snapshots are dropped.
+
+A background task flushes everything queued in one pipeline every
+flush_interval_ms, or straight away once max_batch events are waiting, so the
+websocket loop never waits on Redis.
+
+Backpressure: publishing never blocks the book. If Redis falls behind, events
+queue up to max_pending; past that the oldest events are dropped and counted
+in `dropped` (snapshots are conflated so they never pile up). A batch that
+fails to send is put back in front of the queue, a LOB:: snapshot only if no
+newer one arrived meanwhile, and the flush loop retries with a backoff.
+"""
+
+import asyncio
+from collections import deque
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+from termcolor import cprint
+
+
+class BatchedPublisher:
+    """
+    Args:
+        client (redis.asyncio.Redis): redis client
+        flush_interval_ms (float): max time an event waits before it is sent. Defaults to 5.
+        max_batch (int): flush early once this many events are queued. Defaults to 500.
+        max_pending (int): events kept while Redis is behind. Defaults to 100k.
+        max_backoff_s (float): longest wait between retries while Redis is failing. Defaults to 1.
+    """
+
+    def __init__(self,
+                 client: aioredis.Redis,
+                 flush_interval_ms: float = 5,
+                 max_batch: int = 500,
+                 max_pending: int = 100_000,
+                 max_backoff_s: float = 1):
+        self._redis = client
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_backoff_s = max_backoff_s
+        self._events = deque()  # (channel, payload), lossless unless over max_pending
+        self._latest = {}  # channel -> payload, latest wins
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        # stats
+        self.published = 0
+        self.conflated = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def publish(self, channel: str, payload):
+        events = self._events
+        events.append((channel, payload))
+        n = len(events)
+        if n >= self.max_batch and self._wakeup is not None:
+            self._wakeup.set()
+            if n > self.max_pending:
+                self._drop(1)
+
+    def _drop(self, n: int):
+        """Drop the n oldest events"""
+        events = self._events
+        for _ in range(n):
+            events.popleft()
+        before = self.dropped
+        self.dropped += n
+        if before // 10_000 != self.dropped // 10_000 or before == 0:
+            cprint(f"Publisher behind, {self.dropped} events dropped", "red")
+
+    def publish_latest(self, channel: str, payload):
+        if channel in self._latest:
+            self.conflated += 1
+        self._latest[channel] = payload
+
+    @property
+    def pending(self) -> int:
+        return len(self._events) + len(self._latest)
+
+    def start(self) -> asyncio.Task:
+        """Start the flush loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Flush what is queued and stop the flush loop"""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        interval = self.flush_interval_ms / 1000
+        backoff = 0
+        while not self._closing:
+            if backoff:
+                await asyncio.sleep(backoff)  # full batches must not cut the backoff short
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                backoff = 0
+            except Exception as e:
+                # keep streaming, the batch was requeued and the next flush retries it
+                self.failures += 1
+                backoff = min(self.max_backoff_s, max(interval, backoff * 2))
+                level = "Redis publish failed" if isinstance(e, redis.RedisError) else "Publisher error"
+                cprint(f"{level}: {e!r}, retrying in {backoff*1000:.0f}ms", "red")
+
+    def _take_batch(self) -> tuple:
+        events = self._events
+        batch = [events.popleft() for _ in range(len(events))]
+        latest = self._latest
+        self._latest = {}
+        return batch, latest
+
+    def _requeue(self, batch: list, latest: dict):
+        """Put a batch that failed to send back in front of what was queued since"""
+        self._events.extendleft(reversed(batch))
+        for channel, payload in latest.items():
+            # a newer snapshot queued meanwhile supersedes the failed one
+            if channel in self._latest:
+                self.conflated += 1
+            else:
+                self._latest[channel] = payload
+        excess = len(self._events) - self.max_pending
+        if excess > 0:
+            self._drop(excess)
+
+    async def flush(self):
+        batch, latest = self._take_batch()
+        if not batch and not latest:
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for channel, payload in batch:
+                    pipe.publish(channel, payload)
+                for channel, payload in latest.items():
+                    pipe.publish(channel, payload)
+                await pipe.execute()
+        except BaseException:
+            self._requeue(batch, latest)
+            raise
+        self.published += len(batch) + len(latest)
+        self.batches += 1
@@ -0,0 +1,91 @@
+"""
+Reconnection scheduler
+
+Shared by every orderbook on an event loop so connection attempts respect
+Luno's limits as a whole:
+- at most max_concurrent handshakes in flight at once
+- at least min_interval_s between two attempts for the same pair, doubling
+  (with jitter) on consecutive failures up to max_interval_s
+- a pair that stayed connected reconnects straight away
+"""
+
+import asyncio
+import random
+import time
+from typing import Dict
+
+
+class ReconnectScheduler:
+    """
+    Args:
+        min_interval_s (float): minimum time between attempts of one pair. Defaults to 10.
+        max_interval_s (float): cap of the exponential backoff. Defaults to 120.
+        max_concurrent (int): handshakes in flight at once. Defaults to 5.
+    """
+
+    def __init__(self, min_interval_s: float = 10, max_interval_s: float = 120, max_concurrent: int = 5):
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.max_concurrent = max_concurrent
+        self._semaphore = None
+        self._last_attempt: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        self.reconnects = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # created lazily so it binds to the loop that actually runs the books
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def delay(self, key: str) -> float:
+        """Seconds to wait before the next attempt of `key`"""
+        last = self._last_attempt.get(key)
+        if last is None:
+            return 0.0
+        interval = min(self.min_interval_s * 2**self._failures.get(key, 0), self.max_interval_s)
+        interval *= random.uniform(0.8, 1.0) if self._failures.get(key) else 1.0
+        return max(0.0, last + interval - time.time())
+
+    def attempt(self, key: str) -> "_Attempt":
+        """Wait for our turn and hold a handshake slot:
+
+        async with scheduler.attempt(pair):
+            ...connect...
+
+        An exception inside the block counts as a failed attempt.
+        """
+        return _Attempt(self, key)
+
+    async def _start(self, key: str):
+        wait = self.delay(key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self._get_semaphore().acquire()
+        if key in self._last_attempt:
+            self.reconnects += 1
+        self._last_attempt[key] = time.time()
+
+    def success(self, key: str):
+        self._failures.pop(key, None)
+
+    def failure(self, key: str):
+        self._failures[key] = self._failures.get(key, 0) + 1
+
+
+class _Attempt:
+    def __init__(self, scheduler: ReconnectScheduler, key: str):
+        self._scheduler = scheduler
+        self._key = key
+
+    async def __aenter__(self):
+        await self._scheduler._start(self._key)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._scheduler._get_semaphore().release()
+        if exc_type is None:
+            self._scheduler.success(self._key)
+        else:
+            self._scheduler.failure(self._key)
+        return False
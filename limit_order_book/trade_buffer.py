@@ -0,0 +1,204 @@
+"""
+Time windowed trade buffer
+
+Trades are stored column-wise in numpy arrays. The live window is always the
+contiguous slice [head:tail], so
+- expiry moves head forward past every stale trade, amortised O(1)
+- appends write at tail; when the arrays are full the live slice is moved back
+  to the start (or the arrays doubled), amortised O(1)
+- column(name) is a view of the live slice, numpy reads it without copying
+
+Running aggregates (count, volume, notional for VWAP and a distance
+histogram) are updated on append/expire so nothing downstream rescans it.
+"""
+
+import math
+from typing import Dict, Tuple
+
+import numpy as np
+
+COLUMNS = {
+    "ts": np.int64,
+    "price": np.float64,
+    "amount": np.float64,
+    "mid_price": np.float64,
+    "distance": np.float64,
+    "bucket": np.int64,
+}
+
+
+class DistanceHistogram:
+    """Traded volume per distance bucket"""
+
+    def __init__(self, bucket_size: float):
+        self.bucket_size = bucket_size
+        self._volumes = {}  # bucket index -> volume
+        self.count = 0
+        self.volume = 0.0
+
+    def __len__(self) -> int:
+        return len(self._volumes)
+
+    def bucket(self, distance: float) -> int:
+        # half up, round() would send half way distances to the even bucket
+        return math.floor(distance / self.bucket_size + 0.5)
+
+    def add(self, bucket: int, amount: float):
+        self._volumes[bucket] = self._volumes.get(bucket, 0.0) + amount
+        self.count += 1
+        self.volume += amount
+
+    def remove(self, bucket: int, amount: float):
+        remaining = self._volumes[bucket] - amount
+        if remaining <= 1e-12:
+            del self._volumes[bucket]
+        else:
+            self._volumes[bucket] = remaining
+        self.count -= 1
+        self.volume -= amount
+
+    def clear(self):
+        self._volumes.clear()
+        self.count = 0
+        self.volume = 0.0
+
+    def items(self):
+        return self._volumes.items()
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(distance, volume) sorted by distance"""
+        return self.merged_arrays([self])
+
+    def cdf(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(distance, volume traded at or beyond distance), i.e. the volume that
+        would have reached an order resting at that distance from mid"""
+        return self.merged_cdf([self])
+
+    @staticmethod
+    def merged_arrays(histograms) -> Tuple[np.ndarray, np.ndarray]:
+        """(distance, volume) of several histograms with the same bucket size"""
+        volumes: Dict[int, float] = {}
+        for histogram in histograms:
+            for bucket, volume in histogram.items():
+                volumes[bucket] = volumes.get(bucket, 0.0) + volume
+        if not volumes:
+            return np.empty(0), np.empty(0)
+        buckets = np.fromiter(volumes.keys(), dtype=float, count=len(volumes))
+        amounts = np.fromiter(volumes.values(), dtype=float, count=len(volumes))
+        order = np.argsort(buckets)
+        return buckets[order] * histograms[0].bucket_size, amounts[order]
+
+    @staticmethod
+    def merged_cdf(histograms) -> Tuple[np.ndarray, np.ndarray]:
+        distance, volume = DistanceHistogram.merged_arrays(histograms)
+        return distance, np.cumsum(volume[::-1])[::-1]
+
+
+class TradeBuffer:
+    """Trades of the last window_ms
+
+    Args:
+        window_ms (int): how long trades are kept
+        bucket_size (float): distance bucket of the histogram
+        capacity (int): initial number of rows, grows when needed
+    """
+
+    def __init__(self, window_ms: int, bucket_size: float, capacity: int = 1024):
+        self.window_ms = window_ms
+        self.histogram = DistanceHistogram(bucket_size)
+        self._capacity = capacity
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._head = 0
+        self._tail = 0
+        self.notional = 0.0
+        self.version = 0  # bumped on every change, cheap "did anything change" check
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    def __bool__(self) -> bool:
+        return self._tail > self._head
+
+    @property
+    def count(self) -> int:
+        return self._tail - self._head
+
+    @property
+    def volume(self) -> float:
+        return self.histogram.volume
+
+    @property
+    def vwap(self) -> float:
+        volume = self.histogram.volume
+        return self.notional / volume if volume > 0 else np.nan
+
+    def column(self, name: str) -> np.ndarray:
+        """View (no copy) of one column over the live window, oldest first.
+        Only valid until the next append, which may move the arrays"""
+        return self._columns[name][self._head:self._tail]
+
+    def last(self) -> dict:
+        i = self._tail - 1
+        return {name: col[i].item() for name, col in self._columns.items()}
+
+    def append(self, ts: int, price: float, amount: float, mid_price: float, distance: float):
+        if self._tail == self._capacity:
+            self._make_room()
+        i = self._tail
+        bucket = self.histogram.bucket(distance)
+        columns = self._columns
+        columns["ts"][i] = ts
+        columns["price"][i] = price
+        columns["amount"][i] = amount
+        columns["mid_price"][i] = mid_price
+        columns["distance"][i] = distance
+        columns["bucket"][i] = bucket
+        self._tail = i + 1
+
+        self.notional += price * amount
+        self.histogram.add(bucket, amount)
+        self.version += 1
+
+    def expire(self, now: int):
+        """Drop every trade older than window_ms"""
+        cutoff = now - self.window_ms
+        ts = self._columns["ts"]
+        head = self._head
+        tail = self._tail
+        if head == tail or ts[head] >= cutoff:
+            return
+        # ts is sorted so the first live trade can be found by bisection
+        new_head = head + int(np.searchsorted(ts[head:tail], cutoff, side="left"))
+        price = self._columns["price"]
+        amount = self._columns["amount"]
+        bucket = self._columns["bucket"]
+        for i in range(head, new_head):
+            self.histogram.remove(int(bucket[i]), float(amount[i]))
+        self.notional -= float(np.dot(price[head:new_head], amount[head:new_head]))
+        self._head = new_head
+        if new_head == tail:
+            # empty, restart at 0 and reset the float accumulators
+            self._head = self._tail = 0
+            self.notional = 0.0
+            self.histogram.clear()
+        self.version += 1
+
+    def clear(self):
+        self._head = self._tail = 0
+        self.notional = 0.0
+        self.histogram.clear()
+        self.version += 1
+
+    def _make_room(self):
+        live = self._tail - self._head
+        if live > self._capacity // 2:
+            self._capacity *= 2
+            for name, col in self._columns.items():
+                new_col = np.zeros(self._capacity, dtype=col.dtype)
+                new_col[:live] = col[self._head:self._tail]
+                self._columns[name] = new_col
+        else:
+            for col in self._columns.values():
+                col[:live] = col[self._head:self._tail]
+        self._head = 0
+        self._tail = live
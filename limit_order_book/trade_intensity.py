@@ -0,0 +1,134 @@
+"""
+Trade intensity
+
+lambda(delta) = alpha * exp(-kappa * delta)
+
+Trades are bucketed by distance from mid as they arrive (TradeBuffer keeps the
+histogram up to date), so the 20 min window is a small distance -> volume
+histogram instead of a list of every trade. The fit only runs when the buffers
+changed and at most once per refit_interval_ms, warm-started from the previous
+(alpha, kappa).
+
+Fit methods
+- curve_fit: scipy dogbox least squares, same model as before
+- log_linear: closed form least squares of ln(volume) on distance
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.optimize import curve_fit
+from trade_buffer import DistanceHistogram, TradeBuffer
+
+
+class TradeIntensityEstimator:
+    """Rolling alpha / kappa over the last window_ms of trades
+
+    Args:
+        bucket_size (float): distance bucket, price quantum of the pair works well
+        window_ms (int): trade window. Defaults to 20 mins.
+        refit_interval_ms (int): minimum time between fits. Defaults to 1000.
+        method (str): curve_fit or log_linear. Defaults to curve_fit.
+        fit_on (str): fit per bucket volume ("volume") or tail volume ("cdf").
+        buffers (list[TradeBuffer], optional): trade buffers to read from, e.g.
+            the orderbook's bid and ask trades. Without it the estimator keeps
+            its own buffer fed by add_trade.
+    """
+
+    def __init__(self,
+                 bucket_size: float,
+                 window_ms: int = 20*60*1000,
+                 refit_interval_ms: int = 1000,
+                 method: str = "curve_fit",
+                 fit_on: str = "volume",
+                 buffers: Optional[List[TradeBuffer]] = None):
+        if method not in ("curve_fit", "log_linear"):
+            raise ValueError(f"Unknown fit method {method}")
+        if fit_on not in ("volume", "cdf"):
+            raise ValueError(f"Unknown fit_on {fit_on}")
+        self.window_ms = window_ms
+        self.refit_interval_ms = refit_interval_ms
+        self.method = method
+        self.fit_on = fit_on
+        if buffers is None:
+            buffers = [TradeBuffer(window_ms, bucket_size)]
+        self.buffers = buffers
+        self._fitted_version = None
+        self._last_fit_ts = None
+        self.alpha = np.nan
+        self.kappa = np.nan
+
+    def add_trade(self, ts: int, distance: float, amount: float, price: float = np.nan, mid_price: float = np.nan):
+        """Only for the estimator's own buffer"""
+        self.buffers[0].append(ts, price, amount, mid_price, distance)
+
+    def expire(self, now: int):
+        for buffer in self.buffers:
+            buffer.expire(now)
+
+    def _version(self) -> int:
+        return sum(buffer.version for buffer in self.buffers)
+
+    def estimate(self, now: int, force: bool = False) -> Tuple[float, float]:
+        """Return (alpha, kappa), refitting only if trades changed and the refit interval passed"""
+        if not force:
+            if self._last_fit_ts is not None and now - self._last_fit_ts < self.refit_interval_ms:
+                return self.alpha, self.kappa
+        self.expire(now)
+        version = self._version()
+        if not force and version == self._fitted_version:
+            return self.alpha, self.kappa
+
+        self._last_fit_ts = now
+        self._fitted_version = version
+        histograms = [buffer.histogram for buffer in self.buffers]
+        if self.fit_on == "cdf":
+            distance, volume = DistanceHistogram.merged_cdf(histograms)
+        else:
+            distance, volume = DistanceHistogram.merged_arrays(histograms)
+        if len(distance) == 0:
+            return self.alpha, self.kappa
+        fit = self._fit_log_linear if self.method == "log_linear" else self._fit_curve
+        self.alpha, self.kappa = fit(distance, volume)
+        return self.alpha, self.kappa
+
+    def _fit_curve(self, distance: np.ndarray, volume: np.ndarray) -> Tuple[float, float]:
+        p0 = (0, 0)
+        if np.isfinite(self.alpha) and np.isfinite(self.kappa):
+            # warm start from the previous fit
+            p0 = (self.alpha, self.kappa)
+        try:
+            params = curve_fit(lambda t, a, b: a*np.exp(-b*t),
+                               distance,
+                               volume,
+                               p0=p0,
+                               method="dogbox",
+                               bounds=([0, 0], [np.inf, np.inf]))
+        except (RuntimeError, ValueError):
+            # keep the previous estimate if the solver does not converge
+            return self.alpha, self.kappa
+        return params[0][0], params[0][1]
+
+    def _fit_log_linear(self, distance: np.ndarray, volume: np.ndarray) -> Tuple[float, float]:
+        mask = volume > 0
+        x = distance[mask]
+        y = np.log(volume[mask])
+        if len(x) < 2:
+            return self.alpha, self.kappa
+        x_mean = x.mean()
+        y_mean = y.mean()
+        sxx = np.sum((x - x_mean)**2)
+        if sxx == 0:
+            return self.alpha, self.kappa
+        slope = np.sum((x - x_mean)*(y - y_mean)) / sxx
+        kappa = max(-slope, 0.0)
+        alpha = float(np.exp(y_mean + kappa*x_mean))
+        return alpha, kappa
+
+    def clear(self):
+        for buffer in self.buffers:
+            buffer.clear()
+        self._fitted_version = None
+        self._last_fit_ts = None
+        self.alpha = np.nan
+        self.kappa = np.nan
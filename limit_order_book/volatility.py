@@ -0,0 +1,183 @@
+"""
+Rolling volatility
+
+Per tick samples (squared returns, or squared log bid/ask range) go into a
+window that keeps a running sum, so an update is O(1) whatever the window size.
+
+Windows
+- TickWindow: last n samples, fixed size numpy ring buffer
+- TimeWindow: samples of the last n milliseconds
+
+Estimators (all in pct, same unit as the old vol_buffer calculation)
+- close_to_close: sqrt(mean(r^2)), r = simple return of the fair price * 100
+- parkinson: sqrt(mean(ln(ask/bid)^2) / (4 ln2)) * 100, bid/ask as high/low
+- ewma: RiskMetrics style exponentially weighted variance of r
+
+Warm-up policy is the same for every estimator: value is nan until the window
+is full (n samples, or samples covering the whole duration, or `warmup` ticks
+for ewma).
+"""
+
+import math
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+METHODS = ("close_to_close", "parkinson", "ewma")
+
+
+class TickWindow:
+    """Last `size` samples with a running sum"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._buffer = np.zeros(size)
+        self._pos = 0
+        self._count = 0
+        self._sum = 0.0
+        self._since_resum = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._count >= self.size
+
+    def push(self, x: float, ts: Optional[int] = None):
+        old = self._buffer[self._pos]
+        self._buffer[self._pos] = x
+        self._pos = (self._pos + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+        else:
+            self._sum -= old
+        self._sum += x
+
+        # re-sum once per window to stop floating point drift, amortised O(1)
+        self._since_resum += 1
+        if self._since_resum >= self.size:
+            self._sum = float(self._buffer[:self._count].sum())
+            self._since_resum = 0
+
+    def mean(self) -> float:
+        if not self.ready:
+            return np.nan
+        return self._sum / self.size
+
+    def reset(self):
+        self._buffer[:] = 0
+        self._pos = self._count = self._since_resum = 0
+        self._sum = 0.0
+
+
+class TimeWindow:
+    """Samples of the last `duration_ms` with a running sum"""
+
+    def __init__(self, duration_ms: int):
+        self.duration_ms = duration_ms
+        self._samples = deque()  # (ts, x)
+        self._sum = 0.0
+        self._first_ts = None
+        self._last_ts = None
+        self._since_resum = 0
+
+    @property
+    def ready(self) -> bool:
+        # only ready once we have seen a full duration of samples
+        return (self._first_ts is not None
+                and self._last_ts - self._first_ts >= self.duration_ms)
+
+    def push(self, x: float, ts: int):
+        if self._first_ts is None:
+            self._first_ts = ts
+        self._last_ts = ts
+        self._samples.append((ts, x))
+        self._sum += x
+        cutoff = ts - self.duration_ms
+        samples = self._samples
+        while samples[0][0] <= cutoff:
+            self._sum -= samples.popleft()[1]
+
+        self._since_resum += 1
+        if self._since_resum >= len(samples):
+            self._sum = math.fsum(s[1] for s in samples)
+            self._since_resum = 0
+
+    def mean(self) -> float:
+        if not self.ready or not self._samples:
+            return np.nan
+        return self._sum / len(self._samples)
+
+    def reset(self):
+        self._samples.clear()
+        self._sum = 0.0
+        self._first_ts = self._last_ts = None
+        self._since_resum = 0
+
+
+class VolatilityEstimator:
+    """Rolling volatility in pct
+
+    Args:
+        method (str): close_to_close, parkinson or ewma
+        window (int): window size in ticks. Defaults to 200.
+        window_ms (int, optional): use a wall-clock window instead of ticks.
+        ewma_lambda (float): decay for ewma. Defaults to 0.94.
+    """
+
+    def __init__(self,
+                 method: str = "close_to_close",
+                 window: int = 200,
+                 window_ms: Optional[int] = None,
+                 ewma_lambda: float = 0.94):
+        if method not in METHODS:
+            raise ValueError(f"Unknown volatility method {method}, use one of {METHODS}")
+        self.method = method
+        self.ewma_lambda = ewma_lambda
+        self.warmup = window
+        self._window = TimeWindow(window_ms) if window_ms else TickWindow(window)
+        self._last_price = None
+        self._ewma_var = 0.0
+        self._ticks = 0
+        self.value = np.nan
+
+    @property
+    def ready(self) -> bool:
+        if self.method == "ewma":
+            return self._ticks >= self.warmup
+        return self._window.ready
+
+    def update(self, price: float = None, bid: float = None, ask: float = None, ts: Optional[int] = None) -> float:
+        """Add one tick, return the current estimate (nan while warming up)
+
+        close_to_close / ewma need price, parkinson needs bid and ask
+        """
+        if self.method == "parkinson":
+            if not bid or not ask:
+                return self.value
+            sample = math.log(ask / bid)**2 / (4*math.log(2)) * 1e4
+        else:
+            last_price = self._last_price
+            self._last_price = price
+            if last_price is None or not last_price:
+                return self.value
+            r = (price - last_price) / last_price * 100
+            sample = r*r
+
+        self._ticks += 1
+        if self.method == "ewma":
+            lam = self.ewma_lambda
+            self._ewma_var = sample if self._ticks == 1 else lam*self._ewma_var + (1-lam)*sample
+            self.value = math.sqrt(self._ewma_var) if self.ready else np.nan
+            return self.value
+
+        self._window.push(sample, ts)
+        mean = self._window.mean()
+        self.value = math.sqrt(mean) if not np.isnan(mean) else np.nan
+        return self.value
+
+    def reset(self):
+        self._window.reset()
+        self._last_price = None
+        self._ewma_var = 0.0
+        self._ticks = 0
+        self.value = np.nan
@@ -5,19 +5,42 @@ Luno Client Reference
 https://github.com/luno/luno-python/blob/main/luno_python/client.py
 """
 
-import redis
+import os
+import sys
+import asyncio
+import redis.asyncio as aioredis
 import config
-import json
 import yaml
 import time
 import uuid
 import numpy as np
 from luno_python.client import Client
 from dotenv import dotenv_values
-from typing import Union
+from typing import Callable, Union
 from termcolor import cprint
 from order_tracker import OrderTracker
-import sys
+from inventory import Inventory
+from execution import AsyncLunoClient, LimitOrder, OrderExecutor
+from requote import RequoteDiff
+from tick_consumer import ConflatingConsumer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import codec
+from common.metrics import Metrics, MetricsExporter
+from common.tick_shm import TickReader
+
+# user inputs trading_config can set, see README
+USER_INPUTS = (
+    "order_size",
+    "gamma",
+    "eta",
+    "min_spread",
+    "order_refresh_rate_s",
+    "filled_order_delay_s",
+    "max_order_age_s",
+    "requote_min_ticks",
+    "update_balance_interval_s",
+)
 
 class AvellanedaStrategy:
     def __init__(self, 
@@ -26,7 +49,19 @@ class AvellanedaStrategy:
                  trading_rules: dict,
                  sub_channels:Union[list[str], str], 
                  trading_config: dict,
-                 simulated: bool = True) -> None:
+                 simulated: bool = True,
+                 priority_channels: Union[list[str], str] = "ORDER_UPDATES",
+                 client: Client = None,
+                 redis_client: aioredis.Redis = None,
+                 executor: OrderExecutor = None,
+                 clock: Callable[[], float] = None,
+                 metrics: Metrics = None,
+                 shm_ticks: bool = False) -> None:
+        """client (REST), redis_client, executor and clock (time in seconds) default
+        to the live ones, a backtest injects simulated ones, see backtest/.
+        metrics times the tick-to-quote path (off unless enabled, see common/metrics.py)
+        shm_ticks reads LOB:: ticks from shared memory (book started with --shm on the
+        same host) instead of Redis, see common/tick_shm.py"""
         # connect to orderbook or listen to redis channel
         self._auth = {
             "api_key_id": auth_config["LUNO_KEY_ID"],
@@ -45,18 +80,59 @@ class AvellanedaStrategy:
         self.order_refresh_rate_s = 60
         self.filled_order_delay_s = 60 
         self.max_order_age_s = 1800 
-        self.update_balance_interval_s = 2
+        self.requote_min_ticks = 1 # only replace a side once its price moves this many ticks (or its size changes)
+        self.update_balance_interval_s = 30 # REST reconciliation, inventory follows the user stream in between
         # self.wait_for_cancel_updates = False # not implemented yet
+        for key, value in (trading_config or {}).items():
+            if key not in USER_INPUTS:
+                raise ValueError(f"Unknown trading config {key}, use any of {USER_INPUTS}")
+            setattr(self, key, value)
 
         self._last_update_balance_time_s = None
-        self._redis = redis.Redis(**config.get_redis_host_and_port())
-        self._redis_channels_sub = list(sub_channels)
-        self.client = Client(**self._auth)
+        self.inventory = Inventory(self.assets)
+        self._mid_price = None
+        self._redis = redis_client # created in run() if not given
+        self._clock = clock or time.time
+        self._redis_channels_sub = [sub_channels] if isinstance(sub_channels, str) else list(sub_channels)
+        # fills / order updates, never conflated and handled before ticks
+        self._redis_channels_priority = [priority_channels] if isinstance(priority_channels, str) else list(priority_channels)
+        # BOOK_STATUS::<pair> of every book we quote on
+        self._redis_channels_priority += [f"BOOK_STATUS::{c.split('::', 1)[1]}"
+                                          for c in self._redis_channels_sub if c.startswith("LOB::")]
+        # no quoting while the book is invalid (sequence gap, disconnect), see on_book_status
+        self.book_valid = True
+        self._book_status_ts = 0
+        self.cancel_on_book_invalid = True
+        # act on the latest tick only, ticks that arrive while on_tick runs are dropped
+        self.conflate_ticks = True
+        # ticks waiting for on_tick when conflate_ticks is off, the reader waits when it is full
+        self.tick_queue_size = 1000
+        self.shm_ticks = shm_ticks
+        self.shm_poll_interval_s = 0.0005 # how often the shared memory ticks are checked
+        self.shm_max_tick_age_ms = 5000 # older shared memory ticks are not quoted on (book stopped)
+        self.consumer = None
+        # LUNO_API_URL can point both clients at a local exchange_sim/luno_sim.py
+        api_url = config.get_luno_urls()["api_url"]
+        self.client = client or Client(base_url=api_url, **self._auth)
+        # order placement / cancels go through the async client, see execution.py
+        if executor is None:
+            executor = OrderExecutor(AsyncLunoClient(**self._auth, base_url=api_url), self._pair)
+        self.executor = executor
+        self._loop = None
         self.trading_config = trading_config
         self._simulated = simulated
-        self.orders_tracker = OrderTracker()
+        self.orders_tracker = OrderTracker(clock=self._clock)
+        self.requote_diff = RequoteDiff(self._trading_rules['price_quantum'],
+                                        self._trading_rules['order_size_quantum'],
+                                        self.requote_min_ticks)
         self.q_target = None
         self.q = None
+        # stages: decode, quote (maths), orders (REST), tick_age (LOB:: build -> on_tick), tick_to_quote
+        self.metrics = metrics or Metrics(f"mm-{self._pair}")
+        self.metrics.set_gauge("ticks_dropped", lambda: self.consumer.ticks_dropped if self.consumer else 0)
+        self.metrics.set_gauge("order_failures", lambda: self.executor.failures)
+        self.metrics.set_gauge("requote_kept", lambda: self.requote_diff.kept)
+        self.metrics.set_gauge("requote_replaced", lambda: self.requote_diff.replaced)
         self.time_left_fraction = 1 # no market close
 
         # not implemented yet - for scheduling Bot
@@ -72,48 +148,129 @@ class AvellanedaStrategy:
             cprint("Simulated trading not implemented yet.", "red")
             # sys.exit(1)
 
-    def run(self) -> None:
+    async def run(self) -> None:
+        """Read the subscription and process ticks in separate tasks
+
+        The reader keeps draining Redis while on_tick (REST calls included)
+        runs in a worker thread, so the event loop is never blocked.
+        With conflate_ticks, only the newest tick per pair is kept and older
+        ones are dropped (see tick_consumer). Otherwise ticks go through a
+        bounded queue and the reader waits when it is full.
+        Inventory follows ORDER_UPDATES, REST reconciliation runs in the
+        background every update_balance_interval_s.
+        """
+        self._loop = asyncio.get_running_loop()
+        if self._redis is None:
+            self._redis = aioredis.Redis(connection_pool=config.get_async_redis_pool())
+        reconciler = asyncio.create_task(self._reconcile_balances())
+        metrics_config = config.get_metrics_config("METRICS_PORT_MM")
+        self.metrics.enabled = self.metrics.enabled or metrics_config["enabled"]
+        exporter = asyncio.create_task(MetricsExporter(self.metrics, self._redis, port=metrics_config["port"]).run())
+        # LOB:: ticks from shared memory, everything else (and other tick channels) from Redis
+        shm_channels = [c for c in self._redis_channels_sub if self.shm_ticks and c.startswith("LOB::")]
+        tick_channels = [c for c in self._redis_channels_sub if c not in shm_channels]
+        shm_reader = None
+        try:
+            if self.conflate_ticks:
+                self.consumer = ConflatingConsumer(self._redis,
+                                                   tick_channels,
+                                                   self.on_tick,
+                                                   priority_channels=self._redis_channels_priority,
+                                                   on_priority=self.on_user_stream_update)
+                if shm_channels:
+                    shm_reader = asyncio.create_task(self._poll_shm(shm_channels, self.consumer.put_tick))
+                return await self.consumer.run()
+
+            queue = asyncio.Queue(maxsize=self.tick_queue_size)
+            reader = asyncio.create_task(self._read_ticks(queue, tick_channels))
+            if shm_channels:
+                def put_tick(channel, msg):
+                    if not queue.full(): # shared memory only keeps the latest tick, the next one catches up
+                        queue.put_nowait(msg)
+                shm_reader = asyncio.create_task(self._poll_shm(shm_channels, put_tick))
+            priority = set(self._redis_channels_priority)
+            try:
+                while True:
+                    msg = await queue.get()
+                    channel = msg['channel'].decode() if isinstance(msg['channel'], bytes) else msg['channel']
+                    handler = self.on_user_stream_update if channel in priority else self.on_tick
+                    await asyncio.to_thread(handler, msg)
+            finally:
+                reader.cancel()
+        finally:
+            reconciler.cancel()
+            exporter.cancel()
+            if shm_reader is not None:
+                shm_reader.cancel()
+            await self.executor.client.close()
+
+    async def _read_ticks(self, queue: asyncio.Queue, tick_channels: list):
         pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
-        pubsub.subscribe(*self._redis_channels_sub)
-        for msg in pubsub.listen():
-            self.on_tick(msg)
+        await pubsub.subscribe(*tick_channels, *self._redis_channels_priority)
+        async for msg in pubsub.listen():
+            await queue.put(msg)
+
+    async def _poll_shm(self, channels: list, put_tick: Callable):
+        """Hand new shared memory ticks to put_tick(channel, msg), the decoded tick
+        is under msg['tick']. Waits for books that have not written yet."""
+        readers = {}
+        while True:
+            for channel in channels:
+                reader = readers.get(channel)
+                if reader is None:
+                    try:
+                        reader = readers[channel] = TickReader(channel.split("::", 1)[1],
+                                                               max_age_ms=self.shm_max_tick_age_ms,
+                                                               clock=self._clock)
+                    except (FileNotFoundError, ValueError):
+                        continue
+                    cprint(f"{channel} from shared memory {reader.path}", "green")
+                tick = reader.read_new()
+                if tick is not None:
+                    put_tick(channel, {'channel': channel, 'data': None, 'tick': tick})
+            if len(readers) < len(channels):
+                await asyncio.sleep(1) # book not started yet
+            else:
+                await asyncio.sleep(self.shm_poll_interval_s)
     
     def on_tick(self, message: str):
         """Process Strategy here"""
-        tick = json.loads(message['data'])
+        t = self.metrics.now()
+        tick = message.get('tick') # already decoded from shared memory
+        if tick is None:
+            tick = codec.decode(message['data'], schema="LOB")
+        self.metrics.incr("ticks")
+        if t:
+            self.metrics.record("tick_age", int(self._clock()*1e9 - tick['ts']*1e6))
+        self.metrics.lap("decode", t)
+        self.on_book(tick)
 
-        if tick['buffer_ready'] == "False":
+    def on_book(self, tick: dict):
+        """Quote on a decoded LOB:: tick"""
+        if not tick['buffer_ready']:
+            return
+        if not self.book_valid or not tick.get('valid', True) or tick['ts'] < self._book_status_ts:
+            # book is resyncing or the tick was built before the last status change
             return
         
-        vol = float(tick['volatility'])
-        mid_price = float(tick['mid_price'])
-        vamp = float(tick['vamp']) # unused for now
-        best_ask = float(tick['best_ask'])
-        best_bid = float(tick['best_bid'])
-        alpha = float(tick['alpha'])
-        kappa = float(tick['kappa'])
-        
-        # update balance every update_balance_interval_s
-        if time.time() - self._last_update_balance_time_s > self.update_balance_interval_s:
-            self.update_balance()
+        t = self.metrics.now()
+        vol = tick['volatility']
+        mid_price = tick['mid_price']
+        vamp = tick['vamp'] # unused for now
+        best_ask = tick['best_ask']
+        best_bid = tick['best_bid']
+        alpha = tick['alpha']
+        kappa = tick['kappa']
         
-        # update inventory calculation
-        self.base_in_quote = self.inventory[self._base_asset] * mid_price
-        self.inventory_in_quote = self.base_in_quote + self.inventory[self._quote_asset]
-        self.inventory_in_base = self.inventory_in_quote / mid_price
-        if self.q_target is None:
-            # set to initial q
-            self.q_target = self.inventory[self._base_asset]/ self.inventory_in_base
-        self.target_inventory_in_quote = self.inventory_in_quote * self.q_target
-        self.target_inventory_in_base = self.target_inventory_in_quote / mid_price
-        # current inventory q relative to target q
-        self.q = (self.inventory[self._base_asset] - self.target_inventory_in_base)/self.inventory_in_base
+        self._mid_price = mid_price
+        self._update_q(mid_price)
 
         if (np.isnan(alpha) and np.isnan(kappa)) or kappa == 0:
             return
 
         r_price = mid_price - self.q * self.gamma * vol * self.time_left_fraction
         opt_spread = self.gamma * vol * self.time_left_fraction + 2 * np.log(1+self.gamma / kappa)/self.gamma
+        opt_spread = max(opt_spread, self.min_spread)
         
         ask_quote = self._quantize_price(r_price + opt_spread/2)
         bid_quote = self._quantize_price(r_price - opt_spread/2)
@@ -121,6 +278,7 @@ class AvellanedaStrategy:
         bid_size = self.order_size if self.q < 0 else self.order_size * np.exp(-self.eta * self.q)
         ask_size = max(self._trading_rules['min_order_size'], self._quantize_size(ask_size))
         bid_size = max(self._trading_rules['min_order_size'], self._quantize_size(bid_size))
+        t = self.metrics.lap("quote", t)
         
         if self._simulated:
             # TODO: print values only for now
@@ -138,33 +296,123 @@ class AvellanedaStrategy:
             return
         else:
             # WARNING: ACTUAL TRADING
-            if self.orders_tracker.last_order_time is None:
-                # no last order time, place new order
-                self.place_limit_order(ask_quote, ask_size, 'ASK', post_only=True)
-                self.place_limit_order(bid_quote, bid_size, 'BID', post_only=True)
-            
-            elif self.orders_tracker.last_order_time + self.order_refresh_rate_s*1000 > int(time.time()*1000):
-                # cancel all order and enter new orders
-                self.flat_all()
+            expired = self.orders_tracker.expired(self.max_order_age_s)
+            if expired:
+                self.cancel_orders([o.client_order_id for o in expired])
+
+            if (self.orders_tracker.last_order_time is None
+                    or self.orders_tracker.last_order_time + self.order_refresh_rate_s*1000 <= int(self._clock()*1000)):
+                # replace the sides whose quote moved, in one round trip
                 # if one sided is filled, q changes so new limit orders will be adjusted accordingly
-                self.place_limit_order(ask_quote, ask_size, 'ASK', post_only=True)
-                self.place_limit_order(bid_quote, bid_size, 'BID', post_only=True)
+                self.requote([(ask_quote, ask_size, 'ASK'), (bid_quote, bid_size, 'BID')])
+                if t:
+                    self.metrics.lap("orders", t)
+                    self.metrics.record("tick_to_quote", int(self._clock()*1e9 - tick['ts']*1e6))
+                    self.metrics.incr("requotes")
             else: # don't do anything if order is still fresh
                 return
 
+    def _update_q(self, mid_price: float):
+        """Inventory q relative to target q at mid_price"""
+        balances = self.inventory.snapshot()
+        base = balances[self._base_asset]
+        self.base_in_quote = base * mid_price
+        self.inventory_in_quote = self.base_in_quote + balances[self._quote_asset]
+        self.inventory_in_base = self.inventory_in_quote / mid_price
+        if self.q_target is None:
+            # set to initial q
+            self.q_target = base / self.inventory_in_base
+        self.target_inventory_in_quote = self.inventory_in_quote * self.q_target
+        self.target_inventory_in_base = self.target_inventory_in_quote / mid_price
+        # current inventory q relative to target q
+        self.q = (base - self.target_inventory_in_base)/self.inventory_in_base
+
     def update_balance(self, print = False):
+        """Reconcile inventory with REST balances (blocking, keep it off the quoting path)"""
+        since_seq = self.inventory.seq
         self.balances = self.client.get_balances(self.assets)['balance']
-        self.inventory = {i['asset']: float(i['balance']) for i in self.balances}
-        self._last_update_balance_time_s = time.time()  # update balance time
+        corrected = self.inventory.reconcile(self.balances, since_seq)
+        self._last_update_balance_time_s = self._clock()  # update balance time
+        if corrected:
+            cprint(f"Inventory drift, {corrected} balance(s) corrected from REST", "red")
         if print:
-            cprint(self.inventory, "red")
-  
-    def on_user_stream_update(self, message: str):
-        # TODO: if cancel or fill event, do something here
-        raise NotImplementedError("User stream update handler not implemented yet.")
-        # self.on_cancel(message)
-        # self.on_fill(message)
+            cprint(self.inventory.snapshot(), "red")
+
+    async def _reconcile_balances(self):
+        while True:
+            await asyncio.sleep(self.update_balance_interval_s)
+            try:
+                await asyncio.to_thread(self.update_balance)
+            except Exception as e:
+                # events keep the inventory going, retry on the next interval
+                cprint(f"Balance reconciliation failed: {e!r}", "red")
+
+    def on_user_stream_update(self, message: dict):
+        """Apply ORDER_UPDATES events: ORDER_STATUS / FILL to the order tracker, BALANCE to the inventory,
+        and BOOK_STATUS:: messages"""
+        update = codec.decode(message['data'])
+        msg_type = update.get('msg_type')
+        if msg_type == "ORDER_STATUS":
+            self.orders_tracker.on_order_status(update)
+        elif msg_type == "BALANCE":
+            if self.inventory.on_balance(update) and self._mid_price is not None:
+                # q moves with the fill, not with the next tick
+                self._update_q(self._mid_price)
+        elif msg_type == "FILL":
+            if update.get('symbol') == self._pair:
+                self.orders_tracker.on_fill(update)
+                self.inventory.on_fill(update)
+        elif msg_type == "BOOK_STATUS":
+            self.on_book_status(update)
+
+    def on_book_status(self, status: dict):
+        """Stop quoting while the book is invalid, quotes resting on a book we
+        cannot see are cancelled unless cancel_on_book_invalid is off"""
+        self._book_status_ts = status['ts']
+        if status['valid']:
+            if not self.book_valid:
+                cprint(f"{status['pair']} book valid again, quoting resumes", "green")
+            self.book_valid = True
+            return
+        if self.book_valid:
+            cprint(f"{status['pair']} book invalid ({status['reason']}), quoting stops", "red")
+            self.book_valid = False
+            if self.cancel_on_book_invalid:
+                self.flat_all()
     
+    def _execute(self, coro):
+        """Run an executor coroutine on the strategy loop and wait for it.
+        Called from on_tick's worker thread, never from the loop itself.
+
+        Without a loop (backtest) the executor must complete without
+        suspending, e.g. a simulated exchange, and is driven inline.
+        """
+        if self._loop is None:
+            try:
+                coro.send(None)
+            except StopIteration as done:
+                return done.value
+            coro.close()
+            raise RuntimeError("executor suspended outside of the event loop")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _new_order(self, price: float, volume: float, side: str, post_only: bool = True) -> LimitOrder:
+        oid = str(uuid.uuid4())
+        self.orders_tracker.add_orders(oid, side, price, volume)
+        return LimitOrder(oid, side, price, volume, post_only)
+
+    def _record_placed(self, orders: list, results: list):
+        for order, result in zip(orders, results):
+            if isinstance(result, BaseException):
+                self.orders_tracker.cancel_order(order.client_order_id)
+            else:
+                self.orders_tracker.set_exchange_id(order.client_order_id, result)
+
+    def _record_cancelled(self, order_ids: list, results: list):
+        for oid, result in zip(order_ids, results):
+            if not isinstance(result, BaseException):
+                self.orders_tracker.cancel_order(oid)
+
     def place_limit_order(self, 
                           price: float, 
                           volume: float, 
@@ -177,27 +425,60 @@ class AvellanedaStrategy:
             side (str): 'BID' or 'ASK'
             post_only (bool): If True, the order will only be placed if it passes all applicable post-only checks.
         """
-        oid = str(uuid.uuid4())
-        self.orders_tracker.add_orders(oid, side)
+        self.place_limit_orders([(price, volume, side)], post_only=post_only)
+
+    def place_limit_orders(self, quotes: list, post_only: bool = True):
+        """Place [(price, volume, side), ...] concurrently"""
+        orders = [self._new_order(*quote, post_only=post_only) for quote in quotes]
         if self._simulated:
             return
-        else:
-            self.client.post_limit_order(
-                pair = self._pair,
-                price = price,
-                type = side,
-                volume = volume,
-                client_order_id = oid,
-                post_only = post_only
-            )
+        self._record_placed(orders, self._execute(self.executor.place(orders)))
+
+    def _exchange_ids(self, order_ids) -> dict:
+        """client_order_id -> exchange order_id, for orders Luno acknowledged"""
+        known = {}
+        for oid in order_ids:
+            order = self.orders_tracker.get(oid)
+            if order is not None and order.exchange_order_id is not None:
+                known[oid] = order.exchange_order_id
+        return known
 
     def cancel_order(self, order_id):
-        self.client.stop_order(order_id)
-        self.orders_tracker.cancel_order(order_id)
+        self.cancel_orders([order_id])
+
+    def cancel_orders(self, order_ids: list):
+        """Cancel by client_order_id, concurrently"""
+        order_ids = list(order_ids)
+        if self._simulated:
+            for oid in order_ids:
+                self.orders_tracker.cancel_order(oid)
+            return
+        known = self._exchange_ids(order_ids)
+        results = self._execute(self.executor.cancel(list(known.values())))
+        self._record_cancelled(list(known), results)
     
     def flat_all(self):
-        for oid in self.orders_tracker.active_orders:
-            self.cancel_order(oid)
+        self.cancel_orders(list(self.orders_tracker.active_orders))
+
+    def requote(self, quotes: list, post_only: bool = True):
+        """Move live orders to [(price, volume, side), ...]
+
+        Sides whose live order already matches (see requote.RequoteDiff) are
+        left alone to keep queue priority. The others are cancel-replaced
+        concurrently, about one round trip.
+        """
+        live = {side: self.orders_tracker.live_orders(side) for side in ("BID", "ASK")}
+        cancel_ids, quotes = self.requote_diff.diff(live, quotes)
+        if not cancel_ids and not quotes:
+            return
+        if self._simulated:
+            self.cancel_orders(cancel_ids)
+            return self.place_limit_orders(quotes, post_only=post_only)
+        known = self._exchange_ids(cancel_ids)
+        orders = [self._new_order(*quote, post_only=post_only) for quote in quotes]
+        cancels, places = self._execute(self.executor.cancel_replace(list(known.values()), orders))
+        self._record_cancelled(list(known), cancels)
+        self._record_placed(orders, places)
 
     def _quantize_size(self, amount):
         """Quantize order size to minimum size"""
@@ -221,9 +502,10 @@ if __name__ == "__main__":
         price_quantum = all_trading_rules['price_quantum'][pair],
     )
 
-    AvellanedaStrategy(auth_config = auth_config, 
+    strategy = AvellanedaStrategy(auth_config = auth_config, 
                     pair = "MATICMYR", 
                     trading_rules= trading_rules,
                     sub_channels = ["LOB::XBTMYR"], 
-                    trading_config = None).run()
+                    trading_config = None)
+    asyncio.run(strategy.run())
     
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+Async order execution
+
+- AsyncLunoClient: the Luno order endpoints over one pooled aiohttp session
+  (keep-alive connections, no handshake per request)
+- TokenBucket: client side rate limit, requests wait for a token instead of
+  hitting Luno's limit and getting 429s
+- OrderExecutor: fans out cancels and places concurrently, so a requote costs
+  about one round trip instead of 2 + N sequential ones
+
+https://www.luno.com/en/developers/api#tag/Orders
+"""
+
+import asyncio
+import time
+from typing import Iterable, List, Optional
+
+import aiohttp
+from luno_python.error import APIError
+from termcolor import cprint
+
+DEFAULT_BASE_URL = "https://api.luno.com"
+
+
+class TokenBucket:
+    """
+    Args:
+        rate (float): tokens added per second
+        capacity (float): burst size
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = None
+        self.waits = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self, tokens: float = 1):
+        if self._lock is None:
+            # created lazily so it binds to the running loop
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                self.waits += 1
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+
+class AsyncLunoClient:
+    """
+    Args:
+        api_key_id (str): Luno key id
+        api_key_secret (str): Luno key secret
+        base_url (str): API url. Defaults to https://api.luno.com.
+        timeout (float): request timeout in seconds. Defaults to 10.
+        max_connections (int): pooled connections. Defaults to 10.
+        rate_limiter (TokenBucket): shared limiter. Defaults to 5 req/s, burst 10.
+    """
+
+    def __init__(self,
+                 api_key_id: str,
+                 api_key_secret: str,
+                 base_url: str = DEFAULT_BASE_URL,
+                 timeout: float = 10,
+                 max_connections: int = 10,
+                 rate_limiter: TokenBucket = None):
+        self._auth = aiohttp.BasicAuth(api_key_id, api_key_secret)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.rate_limiter = rate_limiter or TokenBucket(rate=5, capacity=10)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                auth=self._auth,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def _params(req: dict) -> dict:
+        params = {}
+        for k, v in req.items():
+            if v is None:
+                continue
+            if isinstance(v, bool):
+                v = "true" if v else "false"
+            params[k] = str(v)
+        return params
+
+    async def do(self, method: str, path: str, req: dict = None) -> dict:
+        await self.rate_limiter.acquire()
+        self.requests += 1
+        async with self._get_session().request(method,
+                                               self.base_url + path,
+                                               params=self._params(req or {})) as res:
+            try:
+                e = await res.json(content_type=None)
+            except ValueError:
+                raise Exception(f"luno: unknown API error ({res.status})")
+        if isinstance(e, dict) and "error" in e and "error_code" in e:
+            raise APIError(e["error_code"], e["error"])
+        return e
+
+    async def post_limit_order(self,
+                               pair: str,
+                               price: float,
+                               type: str,
+                               volume: float,
+                               client_order_id: str = None,
+                               post_only: bool = None) -> dict:
+        return await self.do("POST", "/api/1/postorder", dict(
+            pair=pair,
+            price=price,
+            type=type,
+            volume=volume,
+            client_order_id=client_order_id,
+            post_only=post_only,
+        ))
+
+    async def stop_order(self, order_id: str) -> dict:
+        return await self.do("POST", "/api/1/stoporder", dict(order_id=order_id))
+
+    async def get_balances(self, assets: List[str] = None) -> dict:
+        return await self.do("GET", "/api/1/balance", dict(assets=",".join(assets) if assets else None))
+
+
+class LimitOrder:
+    __slots__ = ("client_order_id", "side", "price", "volume", "post_only")
+
+    def __init__(self, client_order_id: str, side: str, price: float, volume: float, post_only: bool = True):
+        self.client_order_id = client_order_id
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.post_only = post_only
+
+
+class OrderExecutor:
+    """
+    Args:
+        client (AsyncLunoClient): async client
+        pair (str): pair the orders are for
+    """
+
+    def __init__(self, client: AsyncLunoClient, pair: str):
+        self.client = client
+        self.pair = pair
+        self.failures = 0
+
+    async def place(self, orders: Iterable[LimitOrder]) -> list:
+        """Place orders concurrently, returns the exchange order_id (or the exception) per order"""
+        results = await asyncio.gather(*(self._place(o) for o in orders), return_exceptions=True)
+        return self._check(results, "place")
+
+    async def cancel(self, order_ids: Iterable[str]) -> list:
+        """Cancel exchange orders concurrently"""
+        results = await asyncio.gather(*(self.client.stop_order(oid) for oid in order_ids),
+                                       return_exceptions=True)
+        return self._check(results, "cancel")
+
+    async def cancel_replace(self,
+                             order_ids: Iterable[str],
+                             orders: Iterable[LimitOrder],
+                             concurrent: bool = True) -> tuple:
+        """Cancel `order_ids` and place `orders`
+
+        concurrent=True sends everything at once (one round trip). Old and new
+        orders can be live together for that round trip, fine for post-only
+        quotes. concurrent=False waits for the cancels first.
+
+        Returns:
+            tuple: (cancel results, place results)
+        """
+        if concurrent:
+            cancels, places = await asyncio.gather(self.cancel(order_ids), self.place(orders))
+        else:
+            cancels = await self.cancel(order_ids)
+            places = await self.place(orders)
+        return cancels, places
+
+    async def _place(self, order: LimitOrder) -> str:
+        res = await self.client.post_limit_order(pair=self.pair,
+                                                 price=order.price,
+                                                 type=order.side,
+                                                 volume=order.volume,
+                                                 client_order_id=order.client_order_id,
+                                                 post_only=order.post_only)
+        return res["order_id"]
+
+    def _check(self, results: list, action: str) -> list:
+        for r in results:
+            if isinstance(r, BaseException):
+                self.failures += 1
+                cprint(f"{action} failed: {r!r}", "red")
+        return results
@@ -0,0 +1,99 @@
+"""
+Event-sourced inventory
+
+Balances are kept per Luno account from BALANCE events on ORDER_UPDATES
+(translated balance_update messages). Every fill moves the base and counter
+accounts, so applying balance events keeps the inventory current the moment a
+fill lands, without a REST call in the quoting path.
+
+- events carry the absolute balance and a per-account row_index, so they are
+  applied in order and replays (the user stream resends its last 5 minutes on
+  reconnect) are ignored
+- reconcile() takes a REST get_balances snapshot, run off the hot path. It only
+  overwrites accounts that saw no event since the request was sent, anything
+  it corrects is counted in `drift`
+"""
+
+import threading
+from typing import Dict, Iterable
+
+
+class Inventory:
+    """
+    Args:
+        assets (Iterable[str]): assets to track, e.g. ["XBT", "MYR"]
+    """
+
+    def __init__(self, assets: Iterable[str]):
+        self.assets = list(assets)
+        self.balances: Dict[str, float] = {asset: 0.0 for asset in self.assets}
+        self._asset_of = {}  # account_id -> asset, learnt from REST balances
+        self._row_index = {}  # account_id -> last applied row_index
+        self._updated_seq = {}  # account_id -> seq of the last applied event
+        self._lock = threading.Lock()
+        self.seq = 0  # events applied
+        self.ready = False
+        # stats
+        self.events = 0
+        self.stale_events = 0
+        self.fills = 0
+        self.drift = 0
+
+    def __getitem__(self, asset: str) -> float:
+        return self.balances[asset]
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.balances)
+
+    def on_balance(self, msg: dict) -> bool:
+        """Apply a BALANCE event, returns True if a tracked balance changed"""
+        account_id = msg['account_id']
+        row_index = msg['row_index']
+        with self._lock:
+            self.events += 1
+            if row_index <= self._row_index.get(account_id, -1):
+                self.stale_events += 1
+                return False
+            self._row_index[account_id] = row_index
+            self.seq += 1
+            self._updated_seq[account_id] = self.seq
+            asset = self._asset_of.get(account_id)
+            if asset is None:
+                # account we do not trade (or not reconciled yet)
+                return False
+            self.balances[asset] = msg['balance']
+            return True
+
+    def on_fill(self, msg: dict):
+        """Fills are counted only, their balance changes arrive as BALANCE events"""
+        self.fills += 1
+
+    def reconcile(self, balances: list, since_seq: int = None) -> int:
+        """Apply a REST get_balances()['balance'] snapshot
+
+        Args:
+            balances (list): [{"account_id", "asset", "balance", ...}, ...]
+            since_seq (int): `seq` when the request was sent, accounts updated by
+                events after that keep the (newer) event balance. None applies all.
+
+        Returns:
+            int: number of balances corrected
+        """
+        corrected = 0
+        with self._lock:
+            for row in balances:
+                asset = row['asset']
+                if asset not in self.balances:
+                    continue
+                account_id = str(row['account_id'])
+                self._asset_of[account_id] = asset
+                if since_seq is not None and self._updated_seq.get(account_id, 0) > since_seq:
+                    continue
+                balance = float(row['balance'])
+                if self.ready and balance != self.balances[asset]:
+                    corrected += 1
+                self.balances[asset] = balance
+            self.drift += corrected
+            self.ready = True
+        return corrected
@@ -1,50 +1,193 @@
+"""
+Order tracker
+
+Orders are indexed by client_order_id and exchange_order_id (O(1) lookups)
+and follow ORDER_STATUS / FILL messages from the user stream:
+
+    PENDING -> ACTIVE -> PARTIAL -> FILLED
+                     \\-----------> CANCELLED
+
+- PENDING: sent, not acknowledged by Luno yet (Luno status AWAITING)
+- ACTIVE / PARTIAL: on the book (Luno status PENDING), PARTIAL once filled > 0
+- FILLED / CANCELLED: Luno status COMPLETE, depending on the filled quantity
+
+Live orders are also kept in creation order, so expiry only looks at the
+oldest orders instead of scanning all of them.
+"""
+
 import time
-from collections import deque
-from typing import Optional
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+PENDING = "PENDING"
+ACTIVE = "ACTIVE"
+PARTIAL = "PARTIAL"
+FILLED = "FILLED"
+CANCELLED = "CANCELLED"
+LIVE_STATES = (PENDING, ACTIVE, PARTIAL)
+
+
+class TrackedOrder:
+    __slots__ = ("client_order_id", "exchange_order_id", "side", "price", "size",
+                 "filled", "state", "created_ts", "updated_ts")
+
+    def __init__(self, client_order_id: str, side: str, price: float, size: float, ts: int):
+        self.client_order_id = client_order_id
+        self.exchange_order_id = None
+        self.side = side
+        self.price = price
+        self.size = size
+        self.filled = 0.0
+        self.state = PENDING
+        self.created_ts = ts
+        self.updated_ts = ts
+
+    @property
+    def remaining(self) -> float:
+        return self.size - self.filled if self.size is not None else None
+
+    @property
+    def is_live(self) -> bool:
+        return self.state in LIVE_STATES
+
+    def __repr__(self):
+        return (f"TrackedOrder({self.client_order_id}, {self.side} {self.filled}/{self.size} "
+                f"@ {self.price}, {self.state})")
+
 
 class OrderTracker:
-    def __init__(self) -> None:
-        self._limit_orders = {"BID": deque(), "ASK": deque()}
+    """
+    Args:
+        max_history (int): finished orders kept for lookups. Defaults to 1000.
+        clock (Callable): time in seconds. Defaults to time.time.
+    """
+
+    def __init__(self, max_history: int = 1000, clock: Callable[[], float] = None) -> None:
+        self.max_history = max_history
+        self._clock = clock or time.time
+        self._orders = {}  # client_order_id -> TrackedOrder, live and recent
+        self._by_exchange_id = {}  # exchange_order_id -> TrackedOrder
+        self._live = {"BID": OrderedDict(), "ASK": OrderedDict()}  # creation order
+        self._done = OrderedDict()  # finished client_order_ids, oldest first
         self._last_order_time: Optional[int] = None
 
-    def get_bid_orders(self) -> deque:
-        return self._limit_orders["BID"]
-    
-    def get_ask_orders(self) -> deque:
-        return self._limit_orders["ASK"]
-
-    def add_orders(self, order_id:str, side: str):
-        self._limit_orders[side].append(order_id)
-        self._last_order_time = int(time.time()*1000)
-    
-    def cancel_order(self, order_id:str):
-        if order_id in self._limit_orders['BID']:
-            self._limit_orders['BID'].remove(order_id)
-        elif order_id in self._limit_orders['ASK']:
-            self._limit_orders['ASK'].remove(order_id)
-    
+    def get(self, order_id: str) -> Optional[TrackedOrder]:
+        """Lookup by client_order_id"""
+        return self._orders.get(order_id)
+
+    def get_by_exchange_id(self, exchange_order_id: str) -> Optional[TrackedOrder]:
+        return self._by_exchange_id.get(exchange_order_id)
+
+    def get_bid_orders(self) -> List[str]:
+        return list(self._live["BID"])
+
+    def get_ask_orders(self) -> List[str]:
+        return list(self._live["ASK"])
+
+    def live_orders(self, side: str = None) -> List[TrackedOrder]:
+        if side is not None:
+            return list(self._live[side].values())
+        return [*self._live["BID"].values(), *self._live["ASK"].values()]
+
+    def add_orders(self, order_id: str, side: str, price: float = None, size: float = None) -> TrackedOrder:
+        now = int(self._clock()*1000)
+        order = TrackedOrder(order_id, side, price, size, now)
+        self._orders[order_id] = order
+        self._live[side][order_id] = order
+        self._last_order_time = now
+        return order
+
+    def set_exchange_id(self, order_id: str, exchange_order_id: str):
+        """Link the id returned by postorder"""
+        order = self._orders.get(order_id)
+        if order is None:
+            return
+        order.exchange_order_id = exchange_order_id
+        self._by_exchange_id[exchange_order_id] = order
+
+    def cancel_order(self, order_id: str):
+        order = self._orders.get(order_id)
+        if order is not None and order.is_live:
+            self._finish(order, CANCELLED)
+
+    def _finish(self, order: TrackedOrder, state: str):
+        order.state = state
+        order.updated_ts = int(self._clock()*1000)
+        self._live[order.side].pop(order.client_order_id, None)
+        self._done[order.client_order_id] = order
+        while len(self._done) > self.max_history:
+            _, old = self._done.popitem(last=False)
+            self._orders.pop(old.client_order_id, None)
+            self._by_exchange_id.pop(old.exchange_order_id, None)
+
+    def _find(self, msg: dict) -> Optional[TrackedOrder]:
+        order = self._orders.get(msg.get('order_id')) if msg.get('order_id') else None
+        if order is None:
+            order = self._by_exchange_id.get(msg.get('exchange_order_id'))
+        elif order.exchange_order_id is None and msg.get('exchange_order_id'):
+            self.set_exchange_id(order.client_order_id, msg['exchange_order_id'])
+        return order
+
+    def on_order_status(self, msg: dict) -> Optional[TrackedOrder]:
+        """Apply an ORDER_STATUS message, returns the order if it is ours"""
+        order = self._find(msg)
+        if order is None or not order.is_live:
+            return order
+        status = msg['order_status']
+        if status == "PENDING":
+            order.state = PARTIAL if order.filled > 0 else ACTIVE
+            order.updated_ts = int(self._clock()*1000)
+        elif status == "COMPLETE":
+            filled = order.size is not None and order.filled >= order.size
+            self._finish(order, FILLED if filled else CANCELLED)
+        return order
+
+    def on_fill(self, msg: dict) -> Optional[TrackedOrder]:
+        """Apply a FILL message (fill_size is the order's cumulative base fill)"""
+        order = self._find(msg)
+        if order is None:
+            return None
+        order.filled = max(order.filled, msg['fill_size'])
+        if not order.is_live:
+            # fill racing a cancel we already recorded
+            return order
+        if order.size is not None and order.filled >= order.size:
+            self._finish(order, FILLED)
+        else:
+            order.state = PARTIAL
+            order.updated_ts = int(self._clock()*1000)
+        return order
+
+    def expired(self, max_age_s: float, now: int = None) -> List[TrackedOrder]:
+        """Live orders older than max_age_s, oldest first"""
+        cutoff = (now if now is not None else int(self._clock()*1000)) - max_age_s*1000
+        expired = []
+        for live in self._live.values():
+            for order in live.values():
+                if order.created_ts > cutoff:
+                    break
+                expired.append(order)
+        expired.sort(key=lambda o: o.created_ts)
+        return expired
+
     @property
     def last_order_time(self):
         """Return the last timestamp when orders are placed"""
         return self._last_order_time
-    
+
     @property
     def no_orders_at_bid(self) -> bool:
-        if self._limit_orders["BID"]:
-            return False
-        return True
-    
+        return not self._live["BID"]
+
     @property
     def no_orders_at_ask(self) -> bool:
-        if self._limit_orders["ASK"]:
-            return False
-        return True
-    
+        return not self._live["ASK"]
+
     @property
     def no_orders(self) -> bool:
         return self.no_orders_at_bid and self.no_orders_at_ask
-    
+
     @property
-    def active_orders(self):
-        return self._limit_orders['BID'] + self._limit_orders['ASK']
-    
\ No newline at end of file
+    def active_orders(self) -> List[str]:
+        """client_order_ids of live orders, a copy so callers can cancel while iterating"""
+        return [*self._live["BID"], *self._live["ASK"]]
@@ -0,0 +1,69 @@
+"""
+Requote diff
+
+Compares the desired quote of each side with the live orders on that side and
+only touches a side when it has to, so resting orders keep their queue
+priority and we spend fewer API calls:
+- keep: exactly one live order, its price within min_ticks - 1 ticks of the
+  target and the same size
+- otherwise cancel what rests on that side and place the target quote
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+Quote = Tuple[float, float, str]  # (price, volume, side)
+
+
+class RequoteDiff:
+    """
+    Args:
+        price_quantum (float): tick size
+        size_quantum (float): order size step
+        min_ticks (int): price move (in ticks) that triggers a requote. Defaults to 1.
+    """
+
+    def __init__(self, price_quantum: float, size_quantum: float, min_ticks: int = 1):
+        self.price_quantum = price_quantum
+        self.size_quantum = size_quantum
+        self.min_ticks = max(1, min_ticks)
+        # stats
+        self.kept = 0
+        self.replaced = 0
+
+    def side_changed(self, order, price: float, volume: float) -> bool:
+        """True if the live `order` (TrackedOrder) no longer matches the target"""
+        if order.price is None or order.size is None:
+            return True
+        ticks = abs(price - order.price) / self.price_quantum
+        # tolerance of half a step absorbs float noise from quantization
+        if ticks >= self.min_ticks - 0.5:
+            return True
+        return abs(volume - order.size) >= self.size_quantum / 2
+
+    def diff(self, live: Dict[str, list], quotes: Iterable[Quote]) -> Tuple[List[str], List[Quote]]:
+        """
+        Args:
+            live (dict): side -> live TrackedOrders, e.g. from OrderTracker.live_orders(side)
+            quotes (Iterable[Quote]): desired quotes, at most one per side. Sides without
+                a quote are cancelled.
+
+        Returns:
+            tuple: (client_order_ids to cancel, quotes to place)
+        """
+        targets: Dict[str, Optional[Quote]] = {side: None for side in live}
+        for quote in quotes:
+            targets[quote[2]] = quote
+
+        cancel, place = [], []
+        for side, target in targets.items():
+            orders = live.get(side, ())
+            if target is None:
+                cancel.extend(o.client_order_id for o in orders)
+                continue
+            if len(orders) == 1 and not self.side_changed(orders[0], target[0], target[1]):
+                self.kept += 1
+                continue
+            self.replaced += 1
+            cancel.extend(o.client_order_id for o in orders)
+            place.append(target)
+        return cancel, place
@@ -0,0 +1,152 @@
+"""
+Conflating tick consumer
+
+Ticks (LOB::<pair>) are conflated: the reader keeps only the newest unhandled
+tick per channel, so a slow on_tick always acts on the latest book instead of
+working through a backlog. Priority channels (fills, order updates) are never
+conflated, they are queued in order and handled before any tick.
+
+Ticks can also be pushed with put_tick(), e.g. read from shared memory
+(common/tick_shm.py), those messages carry the decoded tick under "tick".
+
+Stats: ticks handled / dropped and staleness, i.e. tick ts to the time the
+handler returned (decision time), in ms.
+"""
+
+import asyncio
+import math
+import os
+import sys
+import time
+from collections import deque
+from typing import Callable, Iterable
+
+import redis.asyncio as aioredis
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import codec
+
+
+class ConflatingConsumer:
+    """
+    Args:
+        client (redis.asyncio.Redis): redis client
+        tick_channels (Iterable[str]): conflated channels, e.g. LOB::XBTMYR
+        on_tick (Callable): called with the redis message of the newest tick
+        priority_channels (Iterable[str]): lossless channels, e.g. ORDER_UPDATES
+        on_priority (Callable): called with every priority message, in order
+        in_thread (bool): run handlers in a worker thread (they make blocking
+            REST calls) so the reader keeps draining Redis. Defaults to True.
+    """
+
+    def __init__(self,
+                 client: aioredis.Redis,
+                 tick_channels: Iterable[str],
+                 on_tick: Callable,
+                 priority_channels: Iterable[str] = (),
+                 on_priority: Callable = None,
+                 in_thread: bool = True):
+        self._redis = client
+        self.tick_channels = list(tick_channels)
+        self.priority_channels = list(priority_channels)
+        self._on_tick = on_tick
+        self._on_priority = on_priority
+        self._in_thread = in_thread
+        self._latest = {}  # channel -> newest unhandled tick
+        self._priority = deque()
+        self._wakeup = None
+        # stats
+        self.ticks_received = 0
+        self.ticks_handled = 0
+        self.ticks_dropped = 0
+        self.priority_handled = 0
+        self.last_staleness_ms = math.nan
+        self.max_staleness_ms = 0.0
+        self._staleness_sum = 0.0
+
+    @property
+    def mean_staleness_ms(self) -> float:
+        return self._staleness_sum / self.ticks_handled if self.ticks_handled else math.nan
+
+    def stats(self) -> dict:
+        return dict(
+            ticks_received=self.ticks_received,
+            ticks_handled=self.ticks_handled,
+            ticks_dropped=self.ticks_dropped,
+            priority_handled=self.priority_handled,
+            last_staleness_ms=self.last_staleness_ms,
+            mean_staleness_ms=self.mean_staleness_ms,
+            max_staleness_ms=self.max_staleness_ms,
+        )
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        reader = asyncio.create_task(self._read())
+        try:
+            await self._consume()
+        finally:
+            reader.cancel()
+
+    async def _read(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(*self.tick_channels, *self.priority_channels)
+        priority = set(self.priority_channels)
+        async for msg in pubsub.listen():
+            channel = msg['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            if channel in priority:
+                self._priority.append(msg)
+                self._wakeup.set()
+            else:
+                self.put_tick(channel, msg)
+
+    def put_tick(self, channel: str, msg: dict):
+        """Make msg the newest tick of channel, replacing an unhandled one"""
+        self.ticks_received += 1
+        if channel in self._latest:
+            self.ticks_dropped += 1
+        self._latest[channel] = msg
+        self._wakeup.set()
+
+    async def _consume(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # fills and order updates first, never conflated
+            while self._priority:
+                await self._call(self._on_priority, self._priority.popleft())
+                self.priority_handled += 1
+            if not self._latest:
+                continue
+            latest, self._latest = self._latest, {}
+            for msg in latest.values():
+                await self._call(self._on_tick, msg)
+                self._record_staleness(msg)
+                if self._priority:
+                    # a fill landed while we were quoting, handle it before the next pair
+                    self._wakeup.set()
+                    for channel, pending in latest.items():
+                        self._latest.setdefault(channel, pending)
+                    break
+
+    async def _call(self, handler: Callable, msg):
+        if handler is None:
+            return
+        if self._in_thread:
+            await asyncio.to_thread(handler, msg)
+        else:
+            handler(msg)
+
+    def _record_staleness(self, msg):
+        self.ticks_handled += 1
+        tick = msg.get('tick')
+        try:
+            ts = tick['ts'] if tick is not None else codec.peek_ts(msg['data'])
+        except (ValueError, KeyError):
+            return
+        staleness = time.time()*1000 - ts
+        self.last_staleness_ms = staleness
+        self._staleness_sum += staleness
+        if staleness > self.max_staleness_ms:
+            self.max_staleness_ms = staleness
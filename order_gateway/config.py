@@ -1,3 +1,4 @@
+import redis.asyncio as aioredis
 from dotenv import dotenv_values
 
 
@@ -5,4 +6,20 @@ def get_redis_host_and_port():
     config = dotenv_values(".env")
     host = config["REDIS_HOST"]
     port = config["REDIS_PORT"]
-    return dict(host=host, port=port)
\ No newline at end of file
+    return dict(host=host, port=port)
+
+
+def get_async_redis_pool(max_connections: int = 16) -> aioredis.ConnectionPool:
+    """asyncio connection pool, create one per process and share it"""
+    return aioredis.ConnectionPool(**get_redis_host_and_port(), max_connections=max_connections)
+
+def get_wire_format() -> str:
+    """binary (default) or json, see common/codec.py"""
+    config = dotenv_values(".env")
+    return config.get("WIRE_FORMAT", "binary")
+
+def get_luno_urls() -> dict:
+    """websocket and REST base urls, point both at exchange_sim/luno_sim.py for load tests"""
+    config = dotenv_values(".env")
+    return dict(ws_url=config.get("LUNO_WS_URL") or "wss://ws.luno.com",
+                api_url=config.get("LUNO_API_URL") or "https://api.luno.com")
@@ -11,15 +11,21 @@ for longer than 5 minutes will discard the message cache.
 
 """
 
+import os
+import sys
 import time
 import json
+import argparse
 import config
-import redis
+import redis.asyncio as aioredis
 import asyncio
-import datetime
 from dotenv import dotenv_values 
 from websockets.client import connect as websocket_connect
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import codec
+from common.recorder import StreamRecorder
+
 class BackOffException(Exception):
     pass
         
@@ -28,7 +34,12 @@ class LunoUserStream:
 
     Manages user stream events and new outgoing messages from trading system.
     """
-    def __init__(self, auth_config: dict):
+    def __init__(self,
+                 auth_config: dict,
+                 recorder: StreamRecorder = None,
+                 redis_client: aioredis.Redis = None,
+                 ws_url: str = None):
+        """ws_url overrides LUNO_WS_URL, e.g. a local exchange_sim/luno_sim.py"""
 
         self.__auth = {
             "api_key_id": auth_config["LUNO_KEY_ID"],
@@ -36,10 +47,13 @@ class LunoUserStream:
         }
         self._websocket = None
         self._time_last_connection_attempt = None
-        self._url = "wss://ws.luno.com/api/1/userstream"
+        self._url = f"{ws_url or config.get_luno_urls()['ws_url']}/api/1/userstream"
         # base
-        self._redis = redis.Redis(**config.get_redis_host_and_port())
+        self._redis = redis_client or aioredis.Redis(connection_pool=config.get_async_redis_pool())
         self._order_updates_channel = "ORDER_UPDATES"
+        self._wire_format = config.get_wire_format()
+        # keeps every raw user stream message (no sequence numbers)
+        self.recorder = recorder
     
     def check_backoff(self):
         if self._time_last_connection_attempt is not None:
@@ -64,15 +78,23 @@ class LunoUserStream:
     async def run(self):
         """Start user stream (statuses/ fills)"""
         await self.connect()
-
-        async for message in self._websocket:
-            if message == '""':
-                continue
-
-            processed_dict = await self.handle_order_event(json.loads(message))
-            if processed_dict is not None:
-                await self._redis.publish(self._order_updates_channel, 
-                                          json.dumps(processed_dict))
+        # the user stream can be quiet for long, flush recorded messages on a timer
+        flusher = asyncio.create_task(self.recorder.run()) if self.recorder is not None else None
+
+        try:
+            async for message in self._websocket:
+                if message == '""':
+                    continue
+                if self.recorder is not None:
+                    self.recorder.record(message)
+
+                processed_dict = await self.handle_order_event(json.loads(message))
+                if processed_dict is not None:
+                    await self._redis.publish(self._order_updates_channel, 
+                                              codec.encode(processed_dict.get("msg_type"), processed_dict, self._wire_format))
+        finally:
+            if flusher is not None:
+                flusher.cancel()
     
 
     async def handle_order_event(self, msg: dict) -> dict:
@@ -170,28 +192,52 @@ class LunoUserStream:
             exchange = "LUNO",
             fill_price = float(msg['counter_fill'])/ float(msg['base_fill']),
             fill_size = float(msg['base_fill']),
-            fill_time = datetime.datetime.now(),
+            fill_time = time.time(), # epoch seconds, like the wire format's other times
             commission = msg['base_fee']
         )
 
     @staticmethod
     def balance_update_handler(msg: dict) -> dict:
-        """ Not implemented yet
-        balance_update
+        """Translate balance update message for trading system
+
+        Sample message
         {
-        "account_id": 8203463422864003664",
+        "account_id": "8203463422864003664",
         "row_index": 1,
         "balance": "100.00000000",
         "balance_delta": "100.00000000",
         "available": "99.00000000",
         "available_delta": "1.00000000"
         }
+
+        Translated message: same fields as numbers. row_index increases per
+        account, so consumers can apply balances in order and skip replays.
         """
-        return msg
+        return dict(
+            msg_type = "BALANCE",
+            account_id = str(msg['account_id']),
+            exchange = "LUNO",
+            row_index = int(msg['row_index']),
+            balance = float(msg['balance']),
+            balance_delta = float(msg['balance_delta']),
+            available = float(msg['available']),
+            available_delta = float(msg['available_delta']),
+            ts = int(time.time()*1000),
+        )
     
 
 if __name__ == "__main__":
 
+    # python order_gateway/order_gateway.py --record data/
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", type=str, help="Directory to record raw messages to")
+    args = parser.parse_args()
+
     auth_config = dotenv_values(".env")
-    us = LunoUserStream(auth_config)
-    asyncio.run(us.run())
\ No newline at end of file
+    recorder = StreamRecorder(os.path.join(args.record, "userstream"), "userstream") if args.record else None
+    us = LunoUserStream(auth_config, recorder=recorder)
+    try:
+        asyncio.run(us.run())
+    finally:
+        if recorder is not None:
+            recorder.close()
\ No newline at end of file
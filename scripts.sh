@@ -1,4 +1,5 @@
 #! /bin/bash
 
-python limit_order_book/orderbook.py --symbol XBTMYR &
-python marketmaking/avellaneda.py
\ No newline at end of file
+# one process streams every pair in the list, add --workers N to shard them
+python limit_order_book/engine.py --symbols XBTMYR &
+python marketmaking/avellaneda.py
@@ -0,0 +1,12 @@
+"""
+The services are scripts importing their siblings (`from orderbook import ...`),
+tests see them the way benchmarks/bench.py does.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# backtest first for its NullPublisher / SimExchange, limit_order_book before marketmaking for config
+sys.path.extend([os.path.join(ROOT, "backtest"), ROOT, os.path.join(ROOT, "benchmarks"),
+                 os.path.join(ROOT, "limit_order_book"), os.path.join(ROOT, "marketmaking")])
@@ -0,0 +1,52 @@
+"""
+BookAnalytics features and the book's handling of an empty side.
+"""
+
+import pytest
+
+from analytics import BookAnalytics
+from backtest import NO_AUTH, NullPublisher, ReplayClock
+from orderbook import LunoOrderBook
+
+BIDS = [[99.0, 1.0], [98.0, 2.0]]
+ASKS = [[101.0, 3.0], [102.0, 1.0]]
+
+
+def test_features():
+    values = BookAnalytics(levels=2, imbalance_levels=(1, 2)).update(BIDS, ASKS)
+    assert values["mid_price"] == 100.0
+    assert values["spread"] == 2.0
+    assert values["microprice"] == pytest.approx((101 * 1 + 99 * 3) / 4)
+    assert values["imbalance_1"] == pytest.approx(1 / 4)
+    assert values["imbalance_2"] == pytest.approx(3 / 7)
+    assert values["vamp"] == pytest.approx(((99 + 196) / 3 + (303 + 102) / 4) / 2)
+
+
+@pytest.mark.parametrize("bids, asks", [([], ASKS), (BIDS, []), ([], [])])
+def test_empty_side(bids, asks):
+    assert BookAnalytics(levels=2).update(bids, asks) is None
+
+
+def _message(sequence: int, **update) -> dict:
+    return dict(dict(sequence=str(sequence), timestamp=sequence,
+                     trade_updates=None, create_update=None, delete_update=None), **update)
+
+
+def test_book_with_an_empty_side_publishes_no_tick():
+    book = LunoOrderBook(NO_AUTH, "XBTMYR", publisher=NullPublisher(), clock=ReplayClock())
+    book.log_trades = False
+    book.load_snapshot({"sequence": "1", "timestamp": 0,
+                        "asks": [{"id": "a", "price": "101", "volume": "1"}],
+                        "bids": [{"id": "b", "price": "99", "volume": "1"}]})
+    assert book.build_tick(0)["mid_price"] == 100.0
+
+    book.process_message(_message(2, delete_update={"order_id": "b"}))
+    assert book.build_tick(1) is None
+    assert book.one_sided_ticks == 1
+    # a trade against the remaining side still goes through
+    book.process_message(_message(3, trade_updates=[
+        {"base": "0.5", "counter": "50.5", "maker_order_id": "a", "taker_order_id": "t"}]))
+    assert book.levels.asks.best()[1] == book.volume_codec.parse("0.5")
+
+    book.process_message(_message(4, create_update={"order_id": "c", "type": "BID", "price": "100", "volume": "1"}))
+    assert book.build_tick(2)["mid_price"] == 100.5
@@ -0,0 +1,36 @@
+"""
+Backtest smoke test: one Backtester run and a one config sweep on a synthetic
+Luno stream (benchmarks/stream_generator.py), no websocket, Redis or REST.
+
+python -m pytest tests
+"""
+
+from backtest import Backtester, TickStream, read_messages
+from sweep import prepare_stream, run_sweep
+from stream_generator import LunoStreamGenerator
+
+PAIR = "XBTMYR"
+# past the 20 min trade buffer warm up so the strategy quotes and fills
+MESSAGES = 2500
+CONFIG = dict(gamma=0.1, order_size=0.002)
+BACKTEST_KWARGS = dict(quote_balance=100_000)
+
+
+def _recording(tmp_path) -> str:
+    path = str(tmp_path / f"{PAIR}.jsonl.gz")
+    LunoStreamGenerator(depth=200, rate=1, seed=1).write(path, MESSAGES)
+    return path
+
+
+def test_backtest_and_sweep(tmp_path):
+    path = _recording(tmp_path)
+    stats = Backtester(PAIR, trading_config=CONFIG, **BACKTEST_KWARGS).run(read_messages(path))
+    assert stats["fills"] > 0
+
+    stream_path = prepare_stream(PAIR, path)
+    assert len(TickStream.load(stream_path)) > 0
+    [row] = run_sweep(stream_path, [CONFIG], workers=1, backtest_kwargs=BACKTEST_KWARGS)
+    assert row["error"] == ""
+    # precomputed ticks drive the strategy exactly like the replayed book
+    for key in ("fills", "orders_placed", "pnl"):
+        assert row[key] == stats[key], key
@@ -0,0 +1,79 @@
+"""
+Wire format round trips: every schema through codec.encode / codec.decode in
+both WIRE_FORMATs comes back with the same values and types.
+
+python -m pytest tests
+"""
+
+import datetime
+import math
+
+import pytest
+
+from common import codec
+
+TS = 1700000000.25
+
+MESSAGES = {
+    "LOB": dict(
+        ts=TS * 1000, mid_price=300000.5, spread=1.0, best_bid=300000.0, best_ask=300001.0,
+        best_bid_size=0.25, best_ask_size=0.5, vamp=300000.4, order_imbalance=-0.2,
+        volatility=0.05, alpha=1.5, kappa=0.01, microprice=300000.3,
+        imbalance_1=0.1, imbalance_5=0.2, imbalance_10=0.3,
+        weighted_depth_bid=2.0, weighted_depth_ask=3.0, slope_bid=0.5, slope_ask=0.6,
+        buffer_ready=True,
+    ),
+    "TRADE": dict(
+        ts=TS * 1000, price=300001.0, amount=0.01, mid_price=300000.5, distance=0.5,
+        best_bid=300000.0, best_ask=300001.0, bidask="ask",
+    ),
+    "ORDER_STATUS": dict(
+        msg_type="ORDER_STATUS", order_id="abc-1", exchange_order_id="BXMC2CJ7HNB88U4",
+        full_symbol="XBTMYR LUNO", symbol="XBTMYR", exchange="LUNO", order_status="COMPLETE",
+    ),
+    "FILL": dict(
+        fill_price=300001.0, fill_size=0.001, fill_time=TS, commission=0.0000035,
+        msg_type="FILL", order_id="abc-1", exchange_order_id="BXMC2CJ7HNB88U4",
+        full_symbol="XBTMYR LUNO", symbol="XBTMYR", exchange="LUNO",
+    ),
+    "BALANCE": dict(
+        row_index=7, balance=100.0, balance_delta=-1.0, available=99.0, available_delta=-1.0,
+        ts=TS * 1000, msg_type="BALANCE", account_id="8203463422864003664", exchange="LUNO",
+    ),
+    "BOOK_STATUS": dict(
+        ts=TS * 1000, sequence=24352, valid=False, msg_type="BOOK_STATUS", pair="XBTMYR",
+        reason="sequence gap 1 -> 3",
+    ),
+}
+
+
+def test_every_schema_has_a_message():
+    assert set(MESSAGES) == set(codec.SCHEMAS)
+
+
+@pytest.mark.parametrize("fmt", ["binary", "json"])
+@pytest.mark.parametrize("schema", sorted(MESSAGES))
+def test_round_trip(schema, fmt):
+    msg = MESSAGES[schema]
+    decoded = codec.decode(codec.encode(schema, msg, fmt), schema)
+    assert decoded == msg
+    for name, value in msg.items():
+        assert type(decoded[name]) is type(value), name
+
+
+@pytest.mark.parametrize("fmt", ["binary", "json"])
+def test_datetime_is_sent_as_epoch_seconds(fmt):
+    fill = dict(MESSAGES["FILL"], fill_time=datetime.datetime.fromtimestamp(TS))
+    assert codec.decode(codec.encode("FILL", fill, fmt))["fill_time"] == TS
+
+
+def test_missing_numbers_are_defaults():
+    decoded = codec.decode(codec.encode("TRADE", dict(price=1.0, bidask="bid")))
+    assert math.isnan(decoded["amount"])
+    decoded = codec.decode(codec.encode("BOOK_STATUS", dict(pair="XBTMYR")))
+    assert decoded["sequence"] == 0 and decoded["valid"] is False
+
+
+def test_peek_ts():
+    for fmt in ("binary", "json"):
+        assert codec.peek_ts(codec.encode("LOB", MESSAGES["LOB"], fmt)) == TS * 1000
@@ -0,0 +1,94 @@
+"""
+FixedPoint parsing / formatting and the book's fall back to Decimal when the
+stream is finer than the pair's quanta.
+"""
+
+import asyncio
+import json
+from decimal import Decimal
+
+import pytest
+
+from backtest import NO_AUTH, NullPublisher, ReplayClock
+from fixed_point import DecimalCodec, FixedPoint
+from orderbook import LunoOrderBook
+
+
+@pytest.mark.parametrize("quantum, value, units", [
+    (1, "300000", 300000),
+    (1, "300000.00", 300000),
+    ("0.000001", "0.001234", 1234),
+    ("0.000001", "0.00123400", 1234),
+    ("0.0001", "12", 120000),
+    ("0.0001", "1.2E-3", 12),
+    (0.01, "0", 0),
+])
+def test_parse(quantum, value, units):
+    assert FixedPoint(quantum).parse(value) == units
+
+
+@pytest.mark.parametrize("quantum, value", [
+    (1, "300000.5"),
+    ("0.000001", "0.0000015"),
+    ("0.01", "1E-3"),
+])
+def test_finer_than_quantum(quantum, value):
+    with pytest.raises(ValueError, match="finer than the quantum"):
+        FixedPoint(quantum).parse(value)
+
+
+def test_format():
+    codec = FixedPoint("0.0001")
+    units = codec.parse("1.2345")
+    assert codec.to_str(units) == "1.2345"
+    assert codec.to_decimal(units) == Decimal("1.2345")
+    assert codec.to_float(units) == 1.2345
+    assert codec.from_decimal(Decimal("1.2345")) == units
+    assert FixedPoint(1).to_str(300000) == "300000"
+
+
+def test_decimal_codec_is_exact():
+    codec = DecimalCodec()
+    assert codec.parse("0.1") + codec.parse("0.2") == Decimal("0.3")
+    assert codec.to_str(codec.parse("0.00123400")) == "0.00123400"
+
+
+def _book() -> LunoOrderBook:
+    book = LunoOrderBook(NO_AUTH, "XBTMYR", fixed_point=True, publisher=NullPublisher(), clock=ReplayClock())
+    book.log_trades = False
+    return book
+
+
+def _snapshot(ask_price: str = "101") -> dict:
+    return {"sequence": "1", "timestamp": 0,
+            "asks": [{"id": "a", "price": ask_price, "volume": "1"}],
+            "bids": [{"id": "b", "price": "99", "volume": "1"}]}
+
+
+def test_snapshot_finer_than_quantum_falls_back_to_decimal():
+    book = _book()
+    book.load_snapshot(_snapshot("100.5"))
+    assert not book.fixed_point
+    assert isinstance(book.price_codec, DecimalCodec)
+    assert book.levels.asks.best() == (Decimal("100.5"), Decimal("1"))
+
+
+def test_update_finer_than_quantum_falls_back_once():
+    book = _book()
+    book.load_snapshot(_snapshot())
+    assert book.fixed_point
+    reasons = []
+
+    async def resync(reason):
+        reasons.append(reason)
+        book.load_snapshot(_snapshot())
+
+    book.resync = resync
+    update = {"sequence": "2", "timestamp": 1, "trade_updates": None, "delete_update": None,
+              "create_update": {"order_id": "c", "type": "BID", "price": "99.5", "volume": "1"}}
+    asyncio.run(book.handle_message(json.dumps(update)))
+    assert len(reasons) == 1 and not book.fixed_point
+    # the same update applies once the book is back on Decimal
+    asyncio.run(book.handle_message(json.dumps(update)))
+    assert len(reasons) == 1
+    assert book.levels.bids.best() == (Decimal("99.5"), Decimal("1"))
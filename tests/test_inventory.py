@@ -0,0 +1,77 @@
+"""
+Inventory from BALANCE events: row_index ordering, replays, gaps and REST
+reconciliation.
+"""
+
+from inventory import Inventory
+
+XBT_ACCOUNT = "100"
+MYR_ACCOUNT = "200"
+REST = [
+    {"account_id": XBT_ACCOUNT, "asset": "XBT", "balance": "1.0"},
+    {"account_id": MYR_ACCOUNT, "asset": "MYR", "balance": "1000.0"},
+    {"account_id": "300", "asset": "ETH", "balance": "5.0"},
+]
+
+
+def _balance(account_id: str, row_index: int, balance: float) -> dict:
+    return dict(msg_type="BALANCE", account_id=account_id, row_index=row_index, balance=balance)
+
+
+def _inventory() -> Inventory:
+    inventory = Inventory(["XBT", "MYR"])
+    inventory.reconcile(REST)
+    return inventory
+
+
+def test_reconcile_learns_accounts():
+    inventory = _inventory()
+    assert inventory.ready
+    assert inventory.snapshot() == {"XBT": 1.0, "MYR": 1000.0}
+    assert inventory.drift == 0
+
+
+def test_events_apply_in_row_index_order():
+    inventory = _inventory()
+    assert inventory.on_balance(_balance(XBT_ACCOUNT, 1, 1.1))
+    assert inventory.on_balance(_balance(XBT_ACCOUNT, 2, 1.2))
+    # replayed / late rows are ignored
+    assert not inventory.on_balance(_balance(XBT_ACCOUNT, 2, 1.2))
+    assert not inventory.on_balance(_balance(XBT_ACCOUNT, 1, 1.1))
+    assert inventory["XBT"] == 1.2
+    assert inventory.stale_events == 2
+
+
+def test_row_index_gap_is_applied():
+    # balances are absolute, a missed row does not need the ones in between
+    inventory = _inventory()
+    inventory.on_balance(_balance(XBT_ACCOUNT, 3, 1.3))
+    assert inventory.on_balance(_balance(XBT_ACCOUNT, 10, 0.9))
+    assert inventory["XBT"] == 0.9
+    assert not inventory.on_balance(_balance(XBT_ACCOUNT, 7, 1.05))
+    assert inventory["XBT"] == 0.9
+
+
+def test_row_index_is_per_account():
+    inventory = _inventory()
+    inventory.on_balance(_balance(XBT_ACCOUNT, 50, 1.5))
+    assert inventory.on_balance(_balance(MYR_ACCOUNT, 1, 900.0))
+    assert inventory.snapshot() == {"XBT": 1.5, "MYR": 900.0}
+
+
+def test_untracked_account_is_ignored():
+    inventory = _inventory()
+    assert not inventory.on_balance(_balance("300", 1, 4.0))
+    assert not inventory.on_balance(_balance("999", 1, 4.0))
+    assert inventory.snapshot() == {"XBT": 1.0, "MYR": 1000.0}
+
+
+def test_reconcile_keeps_newer_event_balances():
+    inventory = _inventory()
+    since = inventory.seq
+    inventory.on_balance(_balance(XBT_ACCOUNT, 1, 1.4))
+    # REST answer sent before that event: XBT is older than the event, MYR drifted
+    stale = [dict(REST[0], balance="1.0"), dict(REST[1], balance="990.0")]
+    assert inventory.reconcile(stale, since_seq=since) == 1
+    assert inventory.snapshot() == {"XBT": 1.4, "MYR": 990.0}
+    assert inventory.drift == 1
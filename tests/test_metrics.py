@@ -0,0 +1,49 @@
+"""
+MetricsExporter: the Redis toggle and the HTTP endpoint both switch metrics,
+the last change wins.
+"""
+
+import asyncio
+
+import pytest
+
+from common.metrics import Metrics, MetricsExporter
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+async def _get(port: int, path: str) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def test_toggle_last_change_wins():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        metrics = Metrics("test", enabled=False)
+        exporter = MetricsExporter(metrics, redis)
+        key = f"{exporter.key}::enabled"
+
+        await redis.set(key, "1")
+        await exporter.export()
+        assert metrics.enabled
+        # switched off over HTTP, the unchanged Redis value does not turn it back on
+        server = await asyncio.start_server(exporter._serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        assert b'"enabled": false' in await _get(port, "/disable")
+        await exporter.export()
+        assert not metrics.enabled
+        await redis.set(key, "0")
+        await exporter.export()
+        assert not metrics.enabled
+        await redis.set(key, "1")
+        await exporter.export()
+        assert metrics.enabled
+        assert exporter.last["enabled"]
+        server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+OrderTracker lifecycle: PENDING -> ACTIVE -> PARTIAL -> FILLED / CANCELLED
+from ORDER_STATUS and FILL messages, lookups and expiry.
+"""
+
+from backtest import ReplayClock
+from order_tracker import ACTIVE, CANCELLED, FILLED, PARTIAL, PENDING, OrderTracker
+
+
+def _status(order_id: str, status: str, exchange_order_id: str = "") -> dict:
+    return dict(msg_type="ORDER_STATUS", order_id=order_id, exchange_order_id=exchange_order_id,
+                order_status=status)
+
+
+def _fill(order_id: str, fill_size: float, exchange_order_id: str = "") -> dict:
+    return dict(msg_type="FILL", order_id=order_id, exchange_order_id=exchange_order_id,
+                fill_size=fill_size, fill_price=100.0)
+
+
+def _tracker(max_history: int = 1000) -> OrderTracker:
+    clock = ReplayClock()
+    clock.now = 1000.0
+    return OrderTracker(max_history=max_history, clock=clock)
+
+
+def test_fill_lifecycle():
+    tracker = _tracker()
+    order = tracker.add_orders("c1", "BID", 100.0, 1.0)
+    assert order.state == PENDING and tracker.get_bid_orders() == ["c1"]
+    tracker.on_order_status(_status("c1", "AWAITING"))
+    assert order.state == PENDING
+    tracker.on_order_status(_status("c1", "PENDING", "BX1"))
+    assert order.state == ACTIVE
+    assert tracker.get_by_exchange_id("BX1") is order
+    tracker.on_fill(_fill("c1", 0.4))
+    assert order.state == PARTIAL and order.remaining == 0.6
+    # fill_size is cumulative, an older fill message does not lower it
+    tracker.on_fill(_fill("c1", 0.3))
+    assert order.filled == 0.4
+    tracker.on_order_status(_status("c1", "PENDING"))
+    assert order.state == PARTIAL
+    tracker.on_fill(_fill("c1", 1.0))
+    assert order.state == FILLED
+    assert tracker.no_orders and tracker.get("c1") is order
+    # late messages leave a finished order alone
+    tracker.on_order_status(_status("c1", "PENDING"))
+    assert order.state == FILLED
+
+
+def test_complete_without_full_fill_is_cancelled():
+    tracker = _tracker()
+    order = tracker.add_orders("c1", "ASK", 101.0, 1.0)
+    tracker.on_order_status(_status("c1", "PENDING"))
+    tracker.on_fill(_fill("c1", 0.25))
+    tracker.on_order_status(_status("c1", "COMPLETE"))
+    assert order.state == CANCELLED and order.filled == 0.25
+    assert tracker.no_orders_at_ask
+
+
+def test_fill_after_recorded_cancel_keeps_state():
+    tracker = _tracker()
+    order = tracker.add_orders("c1", "BID", 100.0, 1.0)
+    tracker.cancel_order("c1")
+    assert order.state == CANCELLED and tracker.active_orders == []
+    tracker.on_fill(_fill("c1", 0.5))
+    assert order.state == CANCELLED and order.filled == 0.5
+
+
+def test_lookup_by_exchange_id_only():
+    tracker = _tracker()
+    order = tracker.add_orders("c1", "BID", 100.0, 1.0)
+    tracker.set_exchange_id("c1", "BX1")
+    assert tracker.on_order_status(_status("", "PENDING", "BX1")) is order
+    assert order.state == ACTIVE
+    assert tracker.on_fill(_fill("unknown", 1.0, "BX9")) is None
+
+
+def test_history_is_bounded():
+    tracker = _tracker(max_history=2)
+    for i in range(3):
+        tracker.add_orders(f"c{i}", "BID", 100.0, 1.0)
+        tracker.set_exchange_id(f"c{i}", f"BX{i}")
+        tracker.cancel_order(f"c{i}")
+    assert tracker.get("c0") is None and tracker.get_by_exchange_id("BX0") is None
+    assert tracker.get("c2").state == CANCELLED
+
+
+def test_expired_oldest_first():
+    tracker = _tracker()
+    clock = tracker._clock
+    for i, side in enumerate(("BID", "ASK", "BID")):
+        clock.now = 1000.0 + i
+        tracker.add_orders(f"c{i}", side, 100.0, 1.0)
+    assert [o.client_order_id for o in tracker.expired(1.5, now=1_002_600)] == ["c0", "c1"]
+    tracker.cancel_order("c0")
+    assert [o.client_order_id for o in tracker.expired(0, now=1_002_000)] == ["c1", "c2"]
+    assert tracker.last_order_time == 1_002_000
@@ -0,0 +1,112 @@
+"""
+Incrementally maintained price levels against a full consolidate() of the
+resting orders over a generated stream, and the PriceLevelBook order index
+(fills, removes, queue position, order age).
+"""
+
+import pytest
+
+from backtest import NO_AUTH, NullPublisher, ReplayClock
+from orderbook import LunoOrderBook
+from price_levels import PriceLevelBook
+from stream_generator import LunoStreamGenerator
+
+UPDATES = 3000
+CHECK_EVERY = 100
+
+
+def _book(fixed_point: bool) -> LunoOrderBook:
+    book = LunoOrderBook(NO_AUTH, "XBTMYR", fixed_point=fixed_point, publisher=NullPublisher(), clock=ReplayClock())
+    book.log_trades = False
+    return book
+
+
+def _consolidated(book: LunoOrderBook, generator: LunoStreamGenerator, side: str) -> list:
+    """Levels rebuilt from the generator's own orders, the reference book"""
+    orders = [[book.price_codec.parse(generator._price(price)), book.volume_codec.parse(generator._volume(volume))]
+              for order_side, price, volume in generator._orders.values() if order_side == side]
+    return LunoOrderBook.consolidate(orders, reverse=side == "BID")
+
+
+def _levels(book: LunoOrderBook, side: str) -> list:
+    levels = book.levels.side(side)
+    return [[round(price, 4), round(volume, 4)] for price, volume in levels.top(len(levels))]
+
+
+@pytest.mark.parametrize("fixed_point", [False, True])
+def test_incremental_levels_match_consolidate(fixed_point):
+    generator = LunoStreamGenerator(depth=300, orders_per_level=1.5, trade_weight=0.2, seed=3)
+    book = _book(fixed_point)
+    book.load_snapshot(generator.snapshot())
+    book.build_tick(0)  # handle_trade reads the touch
+    for i, update in enumerate(generator.updates(UPDATES), 1):
+        book.process_message(update)
+        if i % CHECK_EVERY == 0:
+            book.build_tick(update["timestamp"])
+            for side in ("BID", "ASK"):
+                assert _levels(book, side) == _consolidated(book, generator, side), (i, side)
+    assert len(book.levels) == len(generator._orders)
+
+
+def test_top_and_best():
+    book = _book(False)
+    book.load_snapshot({"sequence": "1", "timestamp": 0,
+                        "asks": [{"id": f"a{p}", "price": str(p), "volume": "1"} for p in (103, 101, 102)],
+                        "bids": [{"id": f"b{p}", "price": str(p), "volume": "1"} for p in (97, 99, 98)]})
+    assert [p for p, _ in book.levels.bids.top(2)] == [99, 98]
+    assert [p for p, _ in book.levels.asks.top(5)] == [101, 102, 103]
+    assert book.levels.bids.best()[0] == 99 and book.levels.asks.best()[0] == 101
+    book.levels.remove_order("b99")
+    assert book.levels.bids.best()[0] == 98
+    assert len(book.levels.bids) == 2
+
+
+def _level_book():
+    clock = ReplayClock()
+    clock.now = 100.0
+    levels = PriceLevelBook(clock=clock)
+    levels.add_order("a", "BID", 99, 1.0)
+    levels.add_order("b", "BID", 99, 2.0)
+    levels.add_order("c", "BID", 99, 0.5)
+    levels.add_order("d", "ASK", 101, 3.0)
+    return levels, clock
+
+
+def test_fill_keeps_queue_place_until_filled():
+    levels, _ = _level_book()
+    assert levels.fill_order(levels.get("a"), 0.4) is False
+    assert levels.get("a").volume == pytest.approx(0.6)
+    assert levels.bids.volume_at(99) == pytest.approx(3.1)
+    assert levels.queue_position("b") == (pytest.approx(0.6), 1)
+    assert levels.fill_order(levels.get("a"), 0.6) is True
+    assert "a" not in levels
+    assert levels.queue_position("b") == (0, 0)
+    assert levels.bids.volume_at(99) == pytest.approx(2.5)
+
+
+def test_remove_drops_empty_level():
+    levels, _ = _level_book()
+    assert levels.remove_order("d").price == 101
+    assert not levels.asks
+    assert levels.remove_order("d") is None
+    assert levels.queue_position("d") is None
+    levels.remove_order("b")
+    assert levels.queue_position("c") == (1.0, 1)
+    assert len(levels) == 2
+
+
+def test_resent_order_id_replaces_and_requeues():
+    levels, _ = _level_book()
+    levels.add_order("a", "BID", 99, 1.0)
+    assert levels.queue_position("a") == (2.5, 2)
+    assert levels.bids.volume_at(99) == pytest.approx(3.5)
+
+
+def test_order_age_follows_the_book_clock():
+    levels, clock = _level_book()
+    clock.now = 102.5
+    assert levels.order_age_ms("a") == 2500
+    assert levels.order_age_ms("a", now=100_000 + 10) == 10
+    assert levels.order_age_ms("missing") is None
+    levels.add_order("e", "ASK", 102, 1.0, ts=90_000)
+    assert levels.order_age_ms("e") == 12_500
@@ -0,0 +1,62 @@
+"""
+RequoteDiff: which live quotes are kept and which are cancelled / replaced.
+"""
+
+from order_tracker import TrackedOrder
+from requote import RequoteDiff
+
+
+def _order(client_order_id: str, side: str, price: float, size: float) -> TrackedOrder:
+    return TrackedOrder(client_order_id, side, price, size, ts=0)
+
+
+def _live(*orders: TrackedOrder) -> dict:
+    live = {"BID": [], "ASK": []}
+    for order in orders:
+        live[order.side].append(order)
+    return live
+
+
+def test_unchanged_quotes_are_kept():
+    requote = RequoteDiff(price_quantum=1, size_quantum=0.000001)
+    live = _live(_order("b", "BID", 100.0, 0.002), _order("a", "ASK", 102.0, 0.002))
+    # float noise from quantization is not a move
+    quotes = [(100.0000001, 0.002, "BID"), (102.0, 0.0020000001, "ASK")]
+    assert requote.diff(live, quotes) == ([], [])
+    assert (requote.kept, requote.replaced) == (2, 0)
+
+
+def test_moved_side_is_replaced_other_kept():
+    requote = RequoteDiff(price_quantum=1, size_quantum=0.000001)
+    live = _live(_order("b", "BID", 100.0, 0.002), _order("a", "ASK", 102.0, 0.002))
+    cancel, place = requote.diff(live, [(101.0, 0.002, "BID"), (102.0, 0.002, "ASK")])
+    assert cancel == ["b"] and place == [(101.0, 0.002, "BID")]
+    cancel, place = requote.diff(live, [(100.0, 0.003, "BID"), (102.0, 0.002, "ASK")])
+    assert cancel == ["b"] and place == [(100.0, 0.003, "BID")]
+
+
+def test_min_ticks_tolerance():
+    requote = RequoteDiff(price_quantum=0.01, size_quantum=0.0001, min_ticks=3)
+    live = _live(_order("b", "BID", 10.00, 1.0))
+    assert requote.diff(live, [(10.02, 1.0, "BID")]) == ([], [])
+    assert requote.diff(live, [(9.97, 1.0, "BID")]) == (["b"], [(9.97, 1.0, "BID")])
+
+
+def test_side_without_quote_is_cancelled():
+    requote = RequoteDiff(price_quantum=1, size_quantum=0.000001)
+    live = _live(_order("b", "BID", 100.0, 0.002), _order("a", "ASK", 102.0, 0.002))
+    assert requote.diff(live, [(102.0, 0.002, "ASK")]) == (["b"], [])
+
+
+def test_several_or_unknown_orders_are_replaced():
+    requote = RequoteDiff(price_quantum=1, size_quantum=0.000001)
+    live = _live(_order("b1", "BID", 100.0, 0.002), _order("b2", "BID", 100.0, 0.002),
+                 _order("a", "ASK", None, None))
+    cancel, place = requote.diff(live, [(100.0, 0.002, "BID"), (102.0, 0.002, "ASK")])
+    assert cancel == ["b1", "b2", "a"]
+    assert place == [(100.0, 0.002, "BID"), (102.0, 0.002, "ASK")]
+
+
+def test_empty_side_places():
+    requote = RequoteDiff(price_quantum=1, size_quantum=0.000001)
+    assert requote.diff(_live(), [(100.0, 0.002, "BID")]) == ([], [(100.0, 0.002, "BID")])
@@ -0,0 +1,110 @@
+"""
+Shared memory ticks: seqlock round trip, version checks, a restarted writer
+invalidating the tick it finds, stale ticks and a reader racing the writer.
+"""
+
+import math
+import threading
+
+import pytest
+
+from backtest import ReplayClock
+from common.tick_shm import SEQLOCK, SEQLOCK_OFFSET, TickReader, TickWriter
+
+BIDS = [[300000.0, 0.5], [299999.0, 1.0]]
+ASKS = [[300001.0, 0.25]]
+
+
+def _tick(ts: float, mid_price: float = 300000.5) -> dict:
+    return dict(ts=ts, mid_price=mid_price, best_bid=300000.0, best_ask=300001.0,
+                volatility=0.05, buffer_ready=True)
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path)
+
+
+def test_round_trip(directory):
+    writer = TickWriter("XBTMYR", levels=3, directory=directory)
+    reader = TickReader("xbtmyr", directory=directory)
+    assert reader.read() is None  # nothing written yet
+    writer.write(_tick(1000.0), BIDS, ASKS, sequence=42)
+    tick = reader.read()
+    assert tick["ts"] == 1000.0 and tick["mid_price"] == 300000.5
+    assert tick["buffer_ready"] is True and tick["valid"] is True
+    assert tick["sequence"] == 42
+    assert tick["bids"] == [tuple(level) for level in BIDS]
+    assert tick["asks"] == [tuple(level) for level in ASKS]
+    assert math.isnan(tick["alpha"])  # missing fields are defaults
+    assert reader.levels == 3
+
+
+def test_read_new_only_when_the_version_moved(directory):
+    writer = TickWriter("XBTMYR", directory=directory)
+    reader = TickReader("XBTMYR", directory=directory)
+    writer.write(_tick(1000.0), BIDS, ASKS)
+    assert reader.read_new()["ts"] == 1000.0
+    assert reader.read_new() is None
+    writer.set_valid(False)
+    assert reader.read_new()["valid"] is False
+    writer.set_valid(False)
+    assert reader.read_new() is None
+    writer.write(_tick(2000.0), BIDS, ASKS)
+    assert reader.read_new()["valid"] is True
+
+
+def test_restarted_writer_invalidates_the_last_tick(directory):
+    TickWriter("XBTMYR", directory=directory).write(_tick(1000.0), BIDS, ASKS)  # dies without close
+    reader = TickReader("XBTMYR", directory=directory)
+    assert reader.read()["valid"] is True
+
+    writer = TickWriter("XBTMYR", directory=directory)
+    tick = reader.read_new()
+    assert tick["valid"] is False and tick["ts"] == 1000.0
+    writer.write(_tick(2000.0), BIDS, ASKS)
+    assert reader.read_new()["valid"] is True
+    writer.close()
+    reader_after = TickReader("XBTMYR", directory=directory)
+    assert reader_after.read()["valid"] is False
+
+
+def test_stale_ticks_are_invalid(directory):
+    clock = ReplayClock()
+    writer = TickWriter("XBTMYR", directory=directory)
+    reader = TickReader("XBTMYR", directory=directory, max_age_ms=500, clock=clock)
+    writer.write(_tick(10_000.0), BIDS, ASKS)
+    clock.now = 10.4
+    assert reader.read()["valid"] is True
+    clock.now = 10.6
+    assert reader.read()["valid"] is False
+    assert reader.stale == 1
+
+
+def test_reader_never_sees_a_torn_tick(directory):
+    writer = TickWriter("XBTMYR", levels=2, directory=directory)
+    reader = TickReader("XBTMYR", directory=directory)
+    n = 20_000
+    done = threading.Event()
+
+    def write():
+        for i in range(1, n + 1):
+            # every field of one tick carries the same i
+            writer.write(dict(ts=float(i), mid_price=float(i), best_bid=float(i), best_ask=float(i)),
+                         [[float(i), float(i)]], [[float(i), float(i)]], sequence=i)
+        done.set()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    seen = 0
+    while not done.is_set() or seen < n:
+        tick = reader.read_new()
+        if tick is None:
+            continue
+        i = tick["sequence"]
+        assert tick["ts"] == tick["mid_price"] == tick["best_bid"] == tick["best_ask"] == i
+        assert tick["bids"] == tick["asks"] == [(float(i), float(i))]
+        assert i >= seen
+        seen = i
+    thread.join()
+    assert SEQLOCK.unpack_from(writer._mm, SEQLOCK_OFFSET)[0] % 2 == 0
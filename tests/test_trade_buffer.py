@@ -0,0 +1,69 @@
+"""
+TradeBuffer expiry, growth and running aggregates, DistanceHistogram buckets.
+"""
+
+import numpy as np
+import pytest
+
+from trade_buffer import DistanceHistogram, TradeBuffer
+
+
+def test_bucket_rounds_half_up():
+    histogram = DistanceHistogram(1.0)
+    assert [histogram.bucket(d) for d in (0.0, 0.49, 0.5, 1.5, 2.5, 2.51)] == [0, 0, 1, 2, 3, 3]
+    assert DistanceHistogram(0.01).bucket(0.025) == 3
+
+
+def test_histogram_add_remove():
+    histogram = DistanceHistogram(1.0)
+    histogram.add(1, 0.5)
+    histogram.add(1, 0.25)
+    histogram.add(3, 1.0)
+    assert dict(histogram.items()) == {1: 0.75, 3: 1.0}
+    histogram.remove(1, 0.75)
+    assert dict(histogram.items()) == {3: 1.0}
+    assert (histogram.count, histogram.volume) == (2, 1.0)
+
+
+def test_cdf_is_volume_at_or_beyond():
+    histogram = DistanceHistogram(2.0)
+    for bucket, amount in ((0, 1.0), (2, 2.0), (1, 4.0)):
+        histogram.add(bucket, amount)
+    distance, volume = histogram.cdf()
+    assert distance.tolist() == [0.0, 2.0, 4.0]
+    assert volume.tolist() == [7.0, 6.0, 2.0]
+
+
+def test_expire_drops_only_old_trades():
+    buffer = TradeBuffer(window_ms=1000, bucket_size=1.0)
+    for ts, price in ((0, 100.0), (500, 101.0), (900, 102.0), (1600, 103.0)):
+        buffer.append(ts, price, 1.0, 100.0, price - 100.0)
+    buffer.expire(1600)
+    assert buffer.column("ts").tolist() == [900, 1600]
+    assert buffer.volume == 2.0
+    assert buffer.vwap == pytest.approx(102.5)
+    assert dict(buffer.histogram.items()) == {2: 1.0, 3: 1.0}
+
+    version = buffer.version
+    buffer.expire(1600)
+    assert buffer.version == version  # nothing expired, nothing changed
+
+    buffer.expire(5000)
+    assert not buffer
+    assert np.isnan(buffer.vwap)
+    assert len(buffer.histogram) == 0
+
+
+def test_aggregates_survive_growth_and_compaction():
+    buffer = TradeBuffer(window_ms=100, bucket_size=1.0, capacity=4)
+    for ts in range(1000):
+        buffer.append(ts, 100.0 + ts % 3, 0.5, 100.0, ts % 3)
+        buffer.expire(ts)
+        live = buffer.column("ts")
+        assert live[0] >= ts - 100 and live[-1] == ts
+    assert len(buffer) == 101
+    amounts = buffer.column("amount")
+    assert buffer.volume == pytest.approx(amounts.sum())
+    assert buffer.notional == pytest.approx(float(np.dot(buffer.column("price"), amounts)))
+    assert buffer.histogram.count == len(buffer)
+    assert buffer.last()["ts"] == 999